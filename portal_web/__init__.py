@@ -12,7 +12,6 @@ from logging.config import fileConfig
 from pyramid.config import Configurator
 from pyramid.authentication import AuthTktAuthenticationPolicy
 from pyramid.authorization import ACLAuthorizationPolicy
-from pyramid_beaker import session_factory_from_settings
 
 from .config import (
     replace_environment_vars,
@@ -27,6 +26,7 @@ from .resources import (
     WebRootFactory,
     ApiRootFactory
 )
+from .services.session import session_factory
 
 log = logging.getLogger(__name__)
 
@@ -86,7 +86,7 @@ def main(global_config, **settings):
     Tdb.init()
 
     # configure session
-    config.set_session_factory(factory=session_factory_from_settings(settings))
+    config.set_session_factory(factory=session_factory(settings))
 
     # configure policies
     config.set_authorization_policy(policy=ACLAuthorizationPolicy())
@@ -104,6 +104,9 @@ def main(global_config, **settings):
     config.add_subscriber(
         subscriber='.config.add_helpers',
         iface='pyramid.events.BeforeRender')
+    config.add_subscriber(
+        subscriber='.config.render_forms',
+        iface='pyramid.events.BeforeRender')
     config.add_subscriber(
         subscriber='.config.add_locale',
         iface='pyramid.events.NewRequest')
@@ -116,6 +119,10 @@ def main(global_config, **settings):
     config.add_subscriber(
         subscriber='.config.stop_db_transaction',
         iface='pyramid.events.NewRequest')
+    if settings['env'] != 'production':
+        config.add_subscriber(
+            subscriber='.config.add_form_renders',
+            iface='pyramid.events.NewResponse')
     if settings['env'] in ['development', 'staging']:
         config.add_subscriber(
             subscriber='.config.debug_request',
@@ -134,6 +141,8 @@ def main(global_config, **settings):
         name='environment', factory='.config.Environment')
 
     # configure request methods
+    config.add_request_method(
+        callable='.config.identity', name='identity', reify=True)
     config.add_request_method(
         callable='.config.web_user', name='web_user', reify=True)
     config.add_request_method(
@@ -166,6 +166,42 @@ def add_helpers(event):
     event['h'] = helpers
 
 
+def render_forms(event):
+    """
+    Renders the lazy form markup of the view response for non-template
+    renderers (e.g. json), templates render it on first access.
+
+    Args:
+        event (pyramid.events.BeforeRender): BeforeRender event.
+
+    Returns:
+        None.
+    """
+    if str(event.get('renderer_name', '')).endswith('.pt'):
+        return
+    response = event.rendering_val
+    if not isinstance(response, dict):
+        return
+    for key, value in response.items():
+        if hasattr(value, '__html__') and not isinstance(value, str):
+            response[key] = str(value)
+
+
+def add_form_renders(event):
+    """
+    Adds the number of forms rendered in the request as response header.
+
+    Args:
+        event (pyramid.events.NewResponse): NewResponse event.
+
+    Returns:
+        None.
+    """
+    from .views.forms.base import render_count
+    event.response.headers['X-Form-Renders'] = str(
+        render_count(event.request))
+
+
 def add_locale(event):
     """
     Sets the language of the app.
@@ -255,36 +291,89 @@ def stop_db_transaction(event):
     event.request.add_finished_callback(close_db)
 
 
-def web_user(request):
+class Identity(object):
+    """
+    Identity of the web user of the current request.
+
+    The web user, party, user and role codes are loaded in one batched read
+    on first access of any of them, so that the request attributes
+    `web_user`, `party`, `user` and `roles` share a single lookup.
+
+    Attributes:
+        email (str): Userid of the auth ticket, None if not logged in.
+    """
+
+    def __init__(self, request):
+        # the callback of the authentication policy (groupfinder) uses the
+        # identity, so the unauthenticated userid is used to avoid recursion
+        self.email = request.unauthenticated_userid
+        self._identity = None
+        self._loaded = False
+
+    def _load(self):
+        if not self._loaded:
+            self._loaded = True
+            self._identity = WebUser.load_identity(self.email)
+        return self._identity
+
+    def _get(self, key):
+        identity = self._load()
+        if not identity:
+            return None
+        return identity[key]
+
+    @property
+    def web_user(self):
+        return self._get('web_user')
+
+    @property
+    def party(self):
+        return self._get('party')
+
+    @property
+    def user(self):
+        return self._get('user')
+
+    @property
+    def roles(self):
+        return self._get('roles')
+
+    def __bool__(self):
+        return bool(self._load())
+
+
+class AnonymousIdentity(object):
+    """
+    Identity of requests excluded from the web user lookup.
+    """
+    email = web_user = party = user = roles = None
+
+    def __bool__(self):
+        return False
+
+
+def identity(request):
     p = request.path
     # exclude requests
     if p.startswith('/static/') or p.startswith('/_debug_toolbar/'):
-        return None
-    return WebUser.current_web_user(request)
+        return AnonymousIdentity()
+    return Identity(request)
+
+
+def web_user(request):
+    return request.identity.web_user
 
 
 def party(request):
-    p = request.path
-    # exclude requests
-    if p.startswith('/static/') or p.startswith('/_debug_toolbar/'):
-        return None
-    return WebUser.current_party(request)
+    return request.identity.party
 
 
 def user(request):
-    p = request.path
-    # exclude requests
-    if p.startswith('/static/') or p.startswith('/_debug_toolbar/'):
-        return None
-    return WebUser.current_user(request)
+    return request.identity.user
 
 
 def roles(request):
-    p = request.path
-    # exclude requests
-    if p.startswith('/static/') or p.startswith('/_debug_toolbar/'):
-        return None
-    return WebUser.current_roles(request)
+    return request.identity.roles
 
 
 def notfound(request):
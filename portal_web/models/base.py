@@ -1,6 +1,7 @@
 # For copyright and license terms, see COPYRIGHT.rst (top level of repository)
 # Repository: https://github.com/C3S/portal_web
 
+import os
 import logging
 from functools import wraps
 
@@ -62,7 +63,7 @@ class Tdb():
         retries before initialization.
 
         Note:
-            This function is expected to be called only once.
+            This function is expected to be called only once per process.
 
         Examples:
             >>> Tdb._db = 'db'
@@ -79,6 +80,22 @@ class Tdb():
         with Transaction().start(str(cls._db), int(cls._user), readonly=True):
             pool.init()
 
+    @classmethod
+    def close(cls):
+        """
+        Closes the database connection pool of the current process.
+
+        Used by the pre-fork server runner to free the connections opened by
+        the master process on app creation, before the workers are forked.
+        Tryton keeps one connection pool per process id, so each worker opens
+        its own pool on the next transaction or call of `init()`.
+        """
+        from trytond import backend
+        databases = getattr(backend.Database, '_databases', {})
+        if str(cls._db) not in databases.get(os.getpid(), {}):
+            return
+        backend.Database(str(cls._db)).close()
+
     @staticmethod
     def is_open():
         transaction = Transaction()
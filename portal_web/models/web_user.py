@@ -2,6 +2,7 @@
 # Repository: https://github.com/C3S/portal_web
 
 import logging
+import secrets
 
 from . import Tdb
 
@@ -14,6 +15,7 @@ class WebUser(Tdb):
     """
 
     __name__ = 'web.user'
+    _dummy_password_hash = None
 
     @classmethod
     def current_web_user(cls, request):
@@ -27,10 +29,7 @@ class WebUser(Tdb):
             obj (web.user): Web user.
             None: If no web user is logged in.
         """
-        userid = request.authenticated_userid
-        if not userid:
-            return None
-        return cls.search_by_email(userid)
+        return request.identity.web_user
 
     @classmethod
     def current_party(cls, request):
@@ -44,9 +43,7 @@ class WebUser(Tdb):
             obj (web.user.party): Party of the web user.
             None: If no web user is logged in
         """
-        if not request.web_user:
-            return None
-        return request.web_user.party
+        return request.identity.party
 
     @classmethod
     def current_user(cls, request):
@@ -60,9 +57,7 @@ class WebUser(Tdb):
             obj (web.user.party): Party of the web user.
             None: If no web user is logged in
         """
-        if not request.web_user:
-            return None
-        return request.web_user.user
+        return request.identity.user
 
     @classmethod
     def current_roles(cls, request):
@@ -76,9 +71,7 @@ class WebUser(Tdb):
             list: List of roles of the current web user.
             None: If no web user is logged in.
         """
-        if not request.web_user:
-            return None
-        return [role.code for role in request.web_user.roles]
+        return request.identity.roles
 
     @classmethod
     def groupfinder(cls, email, request):
@@ -93,6 +86,10 @@ class WebUser(Tdb):
             list: List of roles of the current web user.
             None: If no web user is logged in.
         """
+        # reuse the batched identity of the request, if it is the same user
+        identity = getattr(request, 'identity', None)
+        if identity and identity.email and identity.email == email:
+            return identity.roles
         web_user = cls.search_by_email(email)
         if web_user:
             return cls.roles(web_user)
@@ -111,6 +108,52 @@ class WebUser(Tdb):
         """
         return [role.code for role in web_user.roles]
 
+    @classmethod
+    def load_identity(cls, email):
+        """
+        Loads the identity of a web user in one batched read.
+
+        Reads the ids of the web user, party and user as well as the role
+        codes at once, instead of dereferencing the relations one by one.
+        The web user, party and user are returned as instances, which load
+        further fields lazily on access.
+
+        Args:
+            email (str): Email of the web user.
+
+        Returns:
+            dict: Identity of the web user.
+                {
+                    'web_user': obj (web.user),
+                    'party': obj (party.party) or None,
+                    'user': obj (res.user) or None,
+                    'roles': list (str)
+                }
+            None: If no match is found.
+        """
+        if email is None:
+            return None
+        WebUserModel = cls.get()
+        result = WebUserModel.search_read(
+            [('email', 'ilike', cls.escape(email))], limit=1,
+            fields_names=['id', 'party', 'user', 'roles.code'])
+        if not result:
+            return None
+        values = result[0]
+
+        def instance(field_name):
+            if values[field_name] is None:
+                return None
+            Target = WebUserModel._fields[field_name].get_target()
+            return Target(values[field_name])
+
+        return {
+            'web_user': WebUserModel(values['id']),
+            'party': instance('party'),
+            'user': instance('user'),
+            'roles': [role['code'] for role in values['roles.']],
+        }
+
     @classmethod
     def authenticate(cls, email, password):
         """
@@ -133,6 +176,78 @@ class WebUser(Tdb):
         if valid:
             return user
 
+    @classmethod
+    def dummy_password_hash(cls):
+        """
+        Gets a password hash of a random password, created once.
+
+        Checked against, if a web user is not found, so failed logins take
+        the same time for unknown and known email addresses.
+
+        Returns:
+            str: Password hash.
+        """
+        if cls._dummy_password_hash is None:
+            cls._dummy_password_hash = cls.get().hash_password(
+                secrets.token_hex(16))
+        return cls._dummy_password_hash
+
+    @classmethod
+    def load_for_login(cls, email, password):
+        """
+        Loads the login state of a web user in one projected read.
+
+        Reads the password hash and the opt in state at once and checks the
+        password exactly once, also if the web user is not found.
+
+        Args:
+            email (str): Email of the web user.
+            password (str): Password of the web user.
+
+        Returns:
+            dict: Login state of the web user.
+                {
+                    'id': int,
+                    'opt_in_state': str,
+                    'valid': bool
+                }
+            None: If no match is found.
+        """
+        WebUserModel = cls.get()
+        result = []
+        if email:
+            # support case-insensitive email addresses
+            result = WebUserModel.search_read(
+                [('email', 'ilike', cls.escape(email))], limit=1,
+                fields_names=['id', 'password_hash', 'opt_in_state'])
+        values = result[0] if result else {}
+        password_hash = values.get('password_hash')
+        valid, _ = WebUserModel.check_password(
+            password or '', password_hash or cls.dummy_password_hash())
+        if not values:
+            return None
+        return {
+            'id': values['id'],
+            'opt_in_state': values['opt_in_state'],
+            'valid': bool(valid and password_hash),
+        }
+
+    @classmethod
+    def email_exists(cls, email):
+        """
+        Checks, if a web user with the email exists, without reading it.
+
+        Args:
+            email (str): Email of the web user.
+
+        Returns:
+            bool: True, if the email is registered, False otherwise.
+        """
+        if email is None:
+            return False
+        return bool(cls.get().search_count(
+            [('email', 'ilike', cls.escape(email))]))
+
     @classmethod
     def search_all(cls):
         """
@@ -0,0 +1,410 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+"""
+Pre-fork server runner for the pyramid app.
+
+The master process loads the app once (paste deploy) and forks a configurable
+number of waitress worker processes, which share the listening socket. Each
+worker initializes its own tryton database pool after the fork, so the CPU
+bound parts of a request (template rendering, form serialization, password
+hashing) may use all cores of a host instead of competing for one GIL.
+
+Configuration in the .ini file::
+
+    [server:main]
+    use = egg:c3s_portal_web#prefork
+    host = 0.0.0.0
+    port = 6543
+    workers = 4
+    threads = 6
+    max_requests = 10000
+    max_requests_jitter = 1000
+    max_memory = 512
+    graceful_timeout = 30
+
+Signals handled by the master process:
+
+- TERM, INT: graceful shutdown of all workers
+- HUP: graceful rolling restart of all workers (code changes still need a
+  restart of the master process, as the app is loaded before the fork)
+- TTIN, TTOU: increment/decrement the number of workers
+"""
+
+import os
+import sys
+import time
+import random
+import signal
+import socket
+import logging
+import resource
+import threading
+
+from waitress import wasyncore
+from waitress.server import create_server
+
+from .models import Tdb
+from .services.csv import csv_flush
+from .services.session import flush_all
+
+log = logging.getLogger(__name__)
+
+
+def prefork_server_runner(wsgi_app, global_conf, host='0.0.0.0', port=6543,
+                          workers=None, max_requests=0, max_requests_jitter=0,
+                          max_memory=0, graceful_timeout=30, backlog=1024,
+                          **kw):
+    """
+    Paste server runner serving the app with forked waitress workers.
+
+    Args:
+        wsgi_app (obj): Pyramid WSGI application, loaded by the master.
+        global_conf (dict): Parsed [DEFAULT] section of .ini file.
+        host (str): Interface to listen on.
+        port (int): Port to listen on.
+        workers (int): Number of worker processes (default: number of cpus).
+        max_requests (int): Recycle a worker after this number of requests
+            (0: never).
+        max_requests_jitter (int): Random number of requests added to
+            max_requests per worker to avoid simultaneous restarts.
+        max_memory (int): Recycle a worker, if its resident memory exceeds
+            this limit in MB (0: never).
+        graceful_timeout (int): Seconds to wait for running requests on
+            shutdown or recycling of a worker.
+        backlog (int): Size of the socket backlog.
+        **kw: Waitress adjustments (e.g. threads, trusted_proxy).
+
+    Returns:
+        int: Exit code.
+    """
+    arbiter = Arbiter(
+        wsgi_app,
+        host=host,
+        port=int(port),
+        workers=int(workers or os.cpu_count() or 1),
+        max_requests=int(max_requests),
+        max_requests_jitter=int(max_requests_jitter),
+        max_memory=int(max_memory),
+        graceful_timeout=int(graceful_timeout),
+        backlog=int(backlog),
+        adjustments=kw)
+    arbiter.run()
+    return 0
+
+
+class Arbiter():
+    """
+    Master process, which forks, supervises and recycles the workers.
+
+    Attributes:
+        app (obj): WSGI application.
+        workers (dict): Mapping of worker pids to their generation.
+        generation (int): Current generation, incremented on reload.
+        socket (socket.socket): Listening socket shared with the workers.
+    """
+
+    def __init__(self, app, host, port, workers, max_requests,
+                 max_requests_jitter, max_memory, graceful_timeout, backlog,
+                 adjustments):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.num_workers = workers
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.max_memory = max_memory
+        self.graceful_timeout = graceful_timeout
+        self.backlog = backlog
+        self.adjustments = adjustments
+        self.workers = {}
+        self.generation = 0
+        self.signals = []
+        self.socket = None
+        self.pid = None
+
+    # --- Master --------------------------------------------------------------
+
+    def run(self):
+        """
+        Opens the socket, forks the workers and supervises them until stopped.
+        """
+        self.pid = os.getpid()
+        self.socket = self.listen()
+        log.info("master %s listening on %s:%s with %s workers" % (
+            os.getpid(), self.host, self.port, self.num_workers))
+
+        # free the database connections of the master, the workers open their
+        # own ones (otherwise an exiting worker would close the shared ones)
+        Tdb.close()
+
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP,
+                       signal.SIGTTIN, signal.SIGTTOU, signal.SIGCHLD):
+            signal.signal(signum, self.handle_signal)
+
+        try:
+            while True:
+                self.reap()
+                if not self.handle_signals():
+                    break
+                self.manage()
+                time.sleep(0.5)
+        finally:
+            # the workers never return here (see spawn)
+            if os.getpid() == self.pid:
+                self.stop()
+                self.socket.close()
+
+    def listen(self):
+        family = socket.AF_INET6 if ':' in self.host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(self.backlog)
+        sock.setblocking(False)
+        return sock
+
+    def handle_signal(self, signum, frame):
+        if signum != signal.SIGCHLD:
+            self.signals.append(signum)
+
+    def handle_signals(self):
+        """
+        Processes queued signals.
+
+        Returns:
+            bool: False, if the master should stop, True otherwise.
+        """
+        while self.signals:
+            signum = self.signals.pop(0)
+            if signum in (signal.SIGTERM, signal.SIGINT):
+                log.info("master %s shutting down" % os.getpid())
+                return False
+            if signum == signal.SIGHUP:
+                log.info("master %s reloading workers" % os.getpid())
+                self.generation += 1
+            elif signum == signal.SIGTTIN:
+                self.num_workers += 1
+            elif signum == signal.SIGTTOU and self.num_workers > 1:
+                self.num_workers -= 1
+        return True
+
+    def manage(self):
+        """
+        Spawns missing workers and retires outdated or surplus ones.
+
+        The number of processes doesn't exceed the number of workers: on a
+        rolling restart, one outdated worker is retired at a time and its
+        replacement is spawned after it was reaped.
+        """
+        current = [
+            pid for pid, gen in self.workers.items()
+            if gen == self.generation]
+        outdated = [
+            pid for pid, gen in self.workers.items()
+            if gen is not None and gen != self.generation]
+        retiring = [pid for pid, gen in self.workers.items() if gen is None]
+        missing = min(self.num_workers - len(current),
+                      self.num_workers - len(self.workers))
+        for _ in range(missing):
+            self.spawn()
+        if outdated and not retiring:
+            self.kill(outdated[0], signal.SIGTERM)
+        for pid in current[self.num_workers:]:
+            self.kill(pid, signal.SIGTERM)
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            if self.workers.pop(pid, None) is not None and status:
+                log.warning("worker %s exited with status %s" % (pid, status))
+
+    def kill(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            self.workers.pop(pid, None)
+        else:
+            # avoid signaling the same worker twice
+            self.workers[pid] = None
+
+    def stop(self):
+        """
+        Stops all workers gracefully, kills them after the graceful timeout.
+        """
+        for pid in list(self.workers):
+            self.kill(pid, signal.SIGTERM)
+        deadline = time.time() + self.graceful_timeout
+        while self.workers and time.time() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.workers):
+            self.kill(pid, signal.SIGKILL)
+        self.reap()
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = self.generation
+            return
+        # worker process: exit without unwinding the stack of the master
+        # (its finally clauses, atexit handlers and socket cleanup), the
+        # pending writes of the worker are flushed by Worker.run
+        code = 1
+        try:
+            Worker(self).run()
+            code = 0
+        except Exception:
+            log.exception("worker %s failed" % os.getpid())
+        finally:
+            for stream in (sys.stdout, sys.stderr):
+                try:
+                    stream.flush()
+                except Exception:
+                    pass
+            os._exit(code)
+
+
+class Worker():
+    """
+    Worker process serving requests with waitress until stopped or recycled.
+
+    Attributes:
+        requests (int): Number of handled requests.
+        max_requests (int): Recycling limit of requests including jitter.
+        alive (bool): False, if the worker should stop.
+    """
+
+    def __init__(self, arbiter):
+        self.arbiter = arbiter
+        self.requests = 0
+        self.max_requests = arbiter.max_requests
+        if self.max_requests and arbiter.max_requests_jitter:
+            self.max_requests += random.randint(
+                0, arbiter.max_requests_jitter)
+        self.max_memory = arbiter.max_memory * 1024 * 1024
+        self.alive = True
+        self.recycling = False
+        self.lock = threading.Lock()
+
+    def run(self):
+        for signum in (signal.SIGINT, signal.SIGHUP, signal.SIGTTIN,
+                       signal.SIGTTOU, signal.SIGCHLD):
+            signal.signal(signum, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, self.handle_stop)
+
+        # post fork initialization of tryton (new pool for this pid)
+        Tdb.init()
+
+        server = create_server(
+            self.app, sockets=[self.arbiter.socket],
+            **self.arbiter.adjustments)
+        log.info("worker %s started" % os.getpid())
+
+        # serve until stopped
+        while self.alive:
+            wasyncore.loop(
+                timeout=1, map=server._map, count=1,
+                use_poll=server.adj.asyncore_use_poll)
+
+        # stop accepting connections and finish running requests
+        server.del_channel()
+        deadline = time.time() + self.arbiter.graceful_timeout
+        while server.active_channels and time.time() < deadline:
+            for channel in list(server.active_channels.values()):
+                if not channel.requests:
+                    channel.will_close = True
+            wasyncore.loop(
+                timeout=0.1, map=server._map, count=1,
+                use_poll=server.adj.asyncore_use_poll)
+        server.task_dispatcher.shutdown(
+            cancel_pending=True, timeout=self.arbiter.graceful_timeout)
+        # write behind buffers, atexit handlers are skipped by os._exit
+        flush_all()
+        csv_flush()
+        log.info("worker %s stopped after %s requests" % (
+            os.getpid(), self.requests))
+
+    def handle_stop(self, signum, frame):
+        self.alive = False
+
+    def app(self, environ, start_response):
+        """
+        WSGI middleware counting requests and checking the recycling policy.
+
+        A request is counted, when its response is closed by the server, so
+        the worker isn't recycled while a response is still streamed.
+        """
+        try:
+            result = self.arbiter.app(environ, start_response)
+        except BaseException:
+            self.finished()
+            raise
+        return ClosingIterator(result, self.finished)
+
+    def finished(self):
+        """
+        Counts a finished request, stops the worker if it should recycle.
+        """
+        with self.lock:
+            self.requests += 1
+            if not self.recycle():
+                return
+            self.recycling = True
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    def recycle(self):
+        if not self.alive or self.recycling:
+            return False
+        if self.max_requests and self.requests >= self.max_requests:
+            log.info("worker %s reached max_requests" % os.getpid())
+            return True
+        if self.max_memory and rss() > self.max_memory:
+            log.info("worker %s reached max_memory" % os.getpid())
+            return True
+        return False
+
+
+class ClosingIterator():
+    """
+    Response iterable calling a callback after the response was closed.
+
+    Args:
+        iterable (iterable): Response iterable of the app.
+        callback (callable): Called after the close of the iterable.
+    """
+
+    def __init__(self, iterable, callback):
+        self.iterable = iterable
+        self.callback = callback
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def close(self):
+        try:
+            close = getattr(self.iterable, 'close', None)
+            if close:
+                close()
+        finally:
+            self.callback()
+
+
+def rss():
+    """
+    Gets the resident set size of the current process.
+
+    Returns:
+        int: Resident memory in bytes.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        # fallback: peak memory (kilobytes on linux)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
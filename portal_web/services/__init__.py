@@ -5,8 +5,10 @@
 # services
 from .translator import translator as _
 from .csv import (
+    CsvReader,
     csv_import,
-    csv_export
+    csv_export,
+    csv_flush
 )
 from .benchmark import (
     benchmark,
@@ -7,8 +7,9 @@ import datetime
 import logging
 
 from . import (
-    csv_import,
-    csv_export
+    CsvReader,
+    csv_export,
+    csv_flush
 )
 
 benchmark_file = "/ado/tmp/benchmark/benchmark.csv"
@@ -94,13 +95,14 @@ class benchmark():
 
 
 def benchmarks(delete=False):
+    csv_flush(benchmark_file)
     if delete and os.path.isfile(benchmark_file):
         os.remove(benchmark_file)
     if not os.path.isfile(benchmark_file):
         return {'benchmarks': None, 'results': None}
 
     # import
-    rows = csv_import(benchmark_file, **csv_config)
+    rows = CsvReader(benchmark_file, strict=False, **csv_config)
 
     # details
     benchmarks = {}
@@ -1,8 +1,48 @@
 # For copyright and license terms, see COPYRIGHT.rst (top level of repository)
 # Repository: https://github.com/C3S/portal_web
 
+"""
+Import and export of csv files.
+
+`CsvReader` streams the rows of a file, so the memory doesn't depend on the
+size of the file::
+
+    reader = CsvReader(path, converters={'amount': int}, tuples=True)
+    for batch in reader.batches(1000):
+        process(batch)
+    for line, message in reader.errors:
+        log.warning("line %s: %s" % (line, message))
+
+Rows are dicts or, with `tuples=True`, named tuples (without a per row
+`__dict__`). Rows with values, which can't be converted, or with a wrong
+number of values are skipped and collected in `errors` with their line
+number. With `strict=False`, missing values are filled up with None and
+surplus values are kept as list under the key `restkey` of the dict, like
+`csv.DictReader` does.
+
+`CsvWriter` keeps one open file per path and buffers the rows, which are
+written in batches when `size` rows are pending or after `interval`
+seconds by a background thread. A batch is written under an exclusive
+file lock, so the lines of several threads and worker processes don't
+interleave::
+
+    writer = get_csv_writer(path, fieldnames=['name', 'time'])
+    writer.write({'name': 'a', 'time': 1})
+"""
+
+import io
 import os
 import csv
+import fcntl
+import atexit
+import logging
+import threading
+from collections import namedtuple
+
+log = logging.getLogger(__name__)
+
+writers = {}
+writers_lock = threading.Lock()
 
 config_defaults = {
     'delimiter': ',',
@@ -10,44 +50,347 @@ config_defaults = {
 }
 
 
+class CsvReader(object):
+    """
+    Streaming reader of a csv file with a header line.
+
+    Args:
+        path (str): Path of the csv file.
+        converters (dict): Callables converting the string values by column
+            name, e.g. `{'amount': int}`. Exceptions are collected as errors.
+        tuples (bool): Yield named tuples instead of dicts.
+        strict (bool): Collect rows with a wrong number of values as errors
+            instead of filling up missing values with None and keeping
+            surplus values under `restkey` (named tuples can't keep surplus
+            values, so these rows are still collected as errors).
+        restkey (str): Key of the list of surplus values of a dict row.
+        encoding (str): Encoding of the file (default: locale encoding).
+        **kwargs: Formatting parameters of the csv reader.
+
+    Attributes:
+        fieldnames (list): Column names of the header line.
+        errors (list): Skipped rows as (line number, message).
+        line (int): Line number of the last row.
+
+    Raises:
+        IOError: If the file doesn't exist.
+    """
+
+    def __init__(self, path, converters=None, tuples=False, strict=True,
+                 restkey=None, encoding=None, **kwargs):
+        if not os.path.isfile(path):
+            raise IOError("File not found: " + path)
+        self.path = path
+        self.converters = converters or {}
+        self.tuples = tuples
+        self.strict = strict
+        self.restkey = restkey
+        self.encoding = encoding
+        self.config = config_defaults.copy()
+        self.config.update(kwargs)
+        self.fieldnames = []
+        self.errors = []
+        self.line = 0
+
+    def __iter__(self):
+        with open(self.path, 'r', newline='', encoding=self.encoding) as file:
+            reader = csv.reader(file, **self.config)
+            self.fieldnames = next(reader, [])
+            width = len(self.fieldnames)
+            row_type = dict
+            if self.tuples:
+                row_type = namedtuple(
+                    'Row', self.fieldnames, rename=True)._make
+            converters = [
+                (index, self.converters[name])
+                for index, name in enumerate(self.fieldnames)
+                if name in self.converters]
+            for values in reader:
+                if not values:
+                    continue
+                rest = None
+                if len(values) != width:
+                    if self.strict or (self.tuples and len(values) > width):
+                        self.errors.append((reader.line_num, (
+                            "expected %s values, got %s"
+                            % (width, len(values)))))
+                        continue
+                    rest = values[width:]
+                    values = (values + [None] * width)[:width]
+                try:
+                    for index, converter in converters:
+                        values[index] = converter(values[index])
+                except Exception as e:
+                    self.errors.append((reader.line_num, "%s: %s" % (
+                        self.fieldnames[index], e)))
+                    continue
+                self.line = reader.line_num
+                if self.tuples:
+                    yield row_type(values)
+                    continue
+                row = dict(zip(self.fieldnames, values))
+                if rest:
+                    row[self.restkey] = rest
+                yield row
+
+    def batches(self, size=1000):
+        """
+        Streams the rows in lists of a fixed size.
+
+        Args:
+            size (int): Number of rows per batch (the last one may be
+                smaller).
+
+        Yields:
+            list: Rows.
+        """
+        batch = []
+        for row in self:
+            batch.append(row)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
 def csv_import(path, **kwargs):
+    """
+    Reads all rows of a csv file.
+
+    Use `CsvReader` to stream large files.
+
+    Args:
+        path (str): Path of the csv file.
+        **kwargs: Formatting parameters of the csv reader.
+
+    Returns:
+        list: Rows as dicts.
+
+    Raises:
+        IOError: If the file doesn't exist.
+    """
+    return list(CsvReader(path, strict=False, **kwargs))
+
+
+class CsvWriter(object):
+    """
+    Buffered, thread- and process-safe appending writer of a csv file.
 
-    # sanity checks
-    if not os.path.isfile(path):
-        IOError("File not found: " + path)
-    cfg = config_defaults.copy()
-    if kwargs:
-        cfg.update(kwargs)
+    The header line is written, if the file is empty.
 
-    # read
-    with open(path, 'r') as csvfile:
-        reader = csv.DictReader(csvfile, **cfg)
-        return list(reader)
+    Args:
+        path (str): Path of the csv file.
+        fieldnames (list): Column names.
+        size (int): Number of pending rows, which triggers a write.
+        interval (float): Seconds after which pending rows are written
+            (0: only by size, flush or on exit).
+        **kwargs: Formatting parameters of the csv writer.
+    """
+
+    def __init__(self, path, fieldnames, size=100, interval=1.0, **kwargs):
+        self.path = path
+        self.fieldnames = list(fieldnames)
+        self.size = size
+        self.interval = interval
+        self.config = config_defaults.copy()
+        self.config.update(kwargs)
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Resets the writer (initially and in a forked child process).
+        """
+        self.pid = os.getpid()
+        self.rows = []
+        self.file = None
+        self.thread = None
+        self.stopped = threading.Event()
+        self.written = 0
+
+    def check_pid(self):
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.reset()
+
+    def write(self, row):
+        """
+        Adds a row to the buffer, writes the buffer if it is full.
+
+        Args:
+            row (dict): Values by column name.
+        """
+        self.check_pid()
+        with self.lock:
+            self.rows.append(row)
+            full = len(self.rows) >= self.size
+        if full:
+            self.flush()
+        else:
+            self.start()
+
+    def open(self):
+        """
+        Gets the open file, reopens it if it was removed or replaced.
+
+        Returns:
+            file: File opened for appending.
+        """
+        if self.file:
+            try:
+                if os.stat(self.path).st_ino == \
+                        os.fstat(self.file.fileno()).st_ino:
+                    return self.file
+            except OSError:
+                pass
+            self.file.close()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.file = open(self.path, 'a', newline='')
+        return self.file
+
+    def flush(self):
+        """
+        Writes the pending rows to the file.
+
+        Returns:
+            int: Number of written rows.
+        """
+        if self.pid != os.getpid():
+            return 0
+        with self.write_lock:
+            with self.lock:
+                rows, self.rows = self.rows, []
+            if not rows:
+                return 0
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, self.fieldnames, **self.config)
+            writer.writerows(rows)
+            file = self.open()
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                if not os.fstat(file.fileno()).st_size:
+                    csv.DictWriter(
+                        file, self.fieldnames, **self.config).writeheader()
+                file.write(buffer.getvalue())
+                file.flush()
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+            self.written += len(rows)
+        return len(rows)
+
+    def truncate(self):
+        """
+        Discards the pending rows and empties the file.
+        """
+        self.check_pid()
+        with self.write_lock:
+            with self.lock:
+                self.rows = []
+            file = self.open()
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                file.truncate(0)
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def close(self):
+        """
+        Writes the pending rows and closes the file.
+        """
+        self.stopped.set()
+        self.flush()
+        with self.write_lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+    def start(self):
+        """
+        Starts the background thread for timed writes (once per pid).
+        """
+        if self.thread or not self.interval:
+            return
+        with self.lock:
+            if self.thread:
+                return
+            self.thread = threading.Thread(
+                target=self.run, name='csv-writer', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                log.exception("csv write of %s failed" % self.path)
+
+
+def get_csv_writer(path, fieldnames, **kwargs):
+    """
+    Gets the writer of a path, creates it if necessary.
+
+    Args:
+        path (str): Path of the csv file.
+        fieldnames (list): Column names.
+        **kwargs: Arguments of the CsvWriter.
+
+    Returns:
+        CsvWriter: Writer of the path.
+    """
+    writer = writers.get(path)
+    if writer:
+        return writer
+    with writers_lock:
+        if path not in writers:
+            writers[path] = CsvWriter(path, fieldnames, **kwargs)
+        return writers[path]
+
+
+def csv_flush(path=None):
+    """
+    Writes the pending rows of the writers (on exit of the process).
+
+    Args:
+        path (str): Path of the csv file (default: all).
+    """
+    for writer in list(writers.values()):
+        if path is None or writer.path == path:
+            writer.flush()
 
 
 def csv_export(path, row, mode='a', **kwargs):
+    """
+    Writes a row to a csv file via the buffered writer of the path.
+
+    Args:
+        path (str): Path of the csv file.
+        row (dict): Values by column name.
+        mode (str): 'a' appends the row, 'w' empties the file first.
+        **kwargs: Formatting parameters of the csv writer and `fieldnames`.
 
-    # sanity checks
+    Raises:
+        KeyError: If the mode is not supported or the fieldnames are missing.
+    """
     if not row:
         return
     supported_modes = ('w', 'a')
     if mode not in supported_modes:
-        KeyError(
-            'mode "' + mode + '" not supported. '
-            'supported modes: ' + supported_modes + ')'
-        )
-    cfg = config_defaults.copy()
-    if kwargs:
-        cfg.update(kwargs)
-    if not cfg.get('fieldnames'):
-        KeyError('argument "fieldnames" ist missing.')
-    fieldnames = cfg.get('fieldnames')
-    del cfg['fieldnames']
-
-    # write
-    write_header = (not os.path.isfile(path))
-    with open(path, mode) as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames, **cfg)
-        if write_header:
-            writer.writeheader()
-        writer.writerow(row)
+        raise KeyError(
+            'mode "%s" not supported. supported modes: %s' % (
+                mode, ', '.join(supported_modes)))
+    cfg = dict(kwargs)
+    fieldnames = cfg.pop('fieldnames', None)
+    if not fieldnames:
+        raise KeyError('argument "fieldnames" is missing.')
+    writer = get_csv_writer(path, fieldnames, **cfg)
+    if mode == 'w':
+        writer.truncate()
+    writer.write(row)
+
+
+atexit.register(csv_flush)
@@ -0,0 +1,248 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+"""
+Streaming exports of Tryton records as csv or json lines.
+
+The records are read in batches ordered by id, each batch continues after
+the last id of the previous one (keyset paging), so no batch has to skip
+the records already exported and the response memory doesn't depend on the
+number of records. The response body is a generator, the first chunk (the
+csv header) is sent before the first query::
+
+    from portal_web.services.export import export_response
+
+    @view_config(name='addresses.csv', permission='administrator')
+    def addresses(request):
+        return export_response(
+            request, Address, ['party.name', 'street', 'city'],
+            domain=[('country.code', '=', 'DE')], compress=True)
+
+The body is iterated after the request transaction has been closed, so each
+batch is read in a readonly transaction of its own, which is stopped before
+the batch is sent. The export is therefore not a snapshot of the table, if
+records are changed while it is running.
+"""
+
+import io
+import csv
+import json
+import zlib
+import logging
+
+from pyramid.response import Response
+from trytond.transaction import Transaction
+
+from ..models import Tdb
+
+log = logging.getLogger(__name__)
+
+formats = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+}
+
+
+class Export(object):
+    """
+    Streaming export of the records of a Tryton model.
+
+    Args:
+        model (Tdb): Model wrapper of the records.
+        fields (list): Tryton field names (dotted for relations).
+        domain (list): Tryton domain of the records.
+        format (str): 'csv' or 'jsonl'.
+        batch_size (int): Number of records per query.
+        compress (bool): Gzip the chunks.
+        **kwargs: Formatting parameters of the csv writer.
+    """
+
+    def __init__(self, model, fields, domain=None, format='csv',
+                 batch_size=1000, compress=False, **kwargs):
+        if format not in formats:
+            raise KeyError(
+                'format "%s" not supported. supported formats: %s' % (
+                    format, ', '.join(formats)))
+        self.model = model
+        self.fields = list(fields)
+        self.domain = list(domain or [])
+        self.format = format
+        self.batch_size = batch_size
+        self.compress = compress
+        self.config = kwargs
+        self.name = model.__dict__.get('__name__') or model.__name__
+        self.context = None
+        self.exported = 0
+        self.iterator = None
+
+    def transaction(self):
+        """
+        Starts a readonly transaction on top of the transaction stack.
+
+        Returns:
+            trytond.transaction.Transaction: Transaction, to be stopped by
+                the caller (context manager).
+        """
+        return Transaction(new=True).start(
+            str(Tdb._db), 0, readonly=True, context=self.context)
+
+    def fetch(self, domain):
+        """
+        Reads the next batch of records in a transaction of its own.
+
+        Args:
+            domain (list): Tryton domain including the keyset condition.
+
+        Returns:
+            list: Values of the records.
+        """
+        with self.transaction() as transaction:
+            if self.context is None:
+                self.context = Tdb.pool().get('res.user').get_preferences(
+                    context_only=True)
+            with transaction.set_context(self.context):
+                return self.model.get().search_read(
+                    domain, limit=self.batch_size, order=[('id', 'ASC')],
+                    fields_names=sorted(set(['id'] + self.fields)))
+
+    def records(self):
+        """
+        Streams the records in batches ordered by id.
+
+        Yields:
+            list: Values of the records of a batch.
+        """
+        last = None
+        while True:
+            domain = self.domain
+            if last is not None:
+                domain = domain + [('id', '>', last)]
+            records = self.fetch(domain)
+            if not records:
+                return
+            yield records
+            if len(records) < self.batch_size:
+                return
+            last = records[-1]['id']
+
+    def row(self, values):
+        """
+        Gets the values of the fields of a record.
+
+        Args:
+            values (dict): Values of the record read by search_read.
+
+        Returns:
+            list: Values in the order of the fields.
+        """
+        row = []
+        for field in self.fields:
+            value = values
+            *relations, name = field.split('.')
+            for relation in relations:
+                value = value.get(relation + '.') or {}
+            row.append(value.get(name))
+        return row
+
+    def lines(self):
+        """
+        Streams the encoded lines, one chunk per batch.
+
+        Yields:
+            str: Lines.
+        """
+        if self.format == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer, **self.config)
+            writer.writerow(self.fields)
+            yield buffer.getvalue()
+            for records in self.records():
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerows(self.row(values) for values in records)
+                self.exported += len(records)
+                yield buffer.getvalue()
+            return
+        for records in self.records():
+            self.exported += len(records)
+            yield ''.join(
+                json.dumps(dict(zip(self.fields, self.row(values))),
+                           default=str) + '\n'
+                for values in records)
+
+    def __iter__(self):
+        self.iterator = self.chunks()
+        return self.iterator
+
+    def close(self):
+        """
+        Closes the iteration, called by the WSGI server (e.g. on disconnect).
+        """
+        if self.iterator:
+            self.iterator.close()
+
+    def chunks(self):
+        """
+        Streams the encoded and optionally compressed chunks.
+
+        The compressor is flushed after the first chunk (e.g. the csv header),
+        so the client receives the first bytes before the next batch is read.
+
+        Yields:
+            bytes: Chunks.
+        """
+        compressor = None
+        if self.compress:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        try:
+            for index, chunk in enumerate(self.lines()):
+                chunk = chunk.encode('utf-8')
+                if compressor:
+                    chunk = compressor.compress(chunk)
+                    if not index:
+                        chunk += compressor.flush(zlib.Z_SYNC_FLUSH)
+                    if not chunk:
+                        continue
+                yield chunk
+        except Exception:
+            log.exception("export of %s failed after %s records" % (
+                self.name, self.exported))
+            raise
+        if compressor:
+            yield compressor.flush()
+
+
+def export_response(request, model, fields, domain=None, format='csv',
+                    filename=None, compress=False, **kwargs):
+    """
+    Creates a response streaming the records of a model.
+
+    The body is gzipped on the fly, if `compress` is set and the client
+    accepts the gzip content encoding.
+
+    Args:
+        request (pyramid.request.Request): Current request.
+        model (Tdb): Model wrapper of the records.
+        fields (list): Tryton field names (dotted for relations).
+        domain (list): Tryton domain of the records.
+        format (str): 'csv' or 'jsonl'.
+        filename (str): Name of the downloaded file (default: model name).
+        compress (bool): Gzip the body, if the client accepts it.
+        **kwargs: Arguments of the Export.
+
+    Returns:
+        pyramid.response.Response: Streaming response.
+    """
+    content_type, extension = formats.get(format, (None, None))
+    compress = compress and 'Accept-Encoding' in request.headers and bool(
+        request.accept_encoding.acceptable_offers(['gzip']))
+    export = Export(model, fields, domain=domain, format=format,
+                    compress=compress, **kwargs)
+    response = Response(
+        app_iter=export, content_type=content_type, charset='utf-8')
+    if compress:
+        response.content_encoding = 'gzip'
+    response.vary = ('Accept-Encoding',)
+    response.content_disposition = 'attachment; filename="%s"' % (
+        filename or '%s.%s' % (export.name, extension))
+    return response
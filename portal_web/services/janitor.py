@@ -0,0 +1,206 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+"""
+Background removal of expired temporary files.
+
+A janitor keeps a time-ordered index (heap) of the files below a directory
+and removes each file in a background thread as soon as it was not modified
+for `timeout` seconds. Empty subdirectories of removed files are removed as
+well. Files existing before the start of the process are indexed once by
+the thread, so requests only need to register new files.
+
+As a subdirectory might be removed between its creation and the creation of
+a file in it, files in the managed directories are created via `create`::
+
+    file = create(directory, lambda: open(path, 'wb'))
+"""
+
+import os
+import time
+import heapq
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+janitors = {}
+janitors_lock = threading.Lock()
+
+
+class Janitor(object):
+    """
+    Removes the expired files below a directory in a background thread.
+
+    Args:
+        path (str): Directory of the temporary files.
+        timeout (int): Seconds after the last modification until a file
+            expires.
+        linked (bool): Keep expired files, which are still hard linked
+            elsewhere (reference counted by the number of links).
+    """
+
+    def __init__(self, path, timeout, linked=False):
+        self.path = path
+        self.timeout = timeout
+        self.linked = linked
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Resets the janitor (initially and in a forked child process).
+        """
+        self.pid = os.getpid()
+        self.heap = []
+        self.thread = None
+        self.removed = 0
+
+    def register(self, file):
+        """
+        Adds a file to the index.
+
+        Args:
+            file (str): Path of the file.
+
+        Returns:
+            None.
+        """
+        if self.pid != os.getpid():
+            self.reset()
+        with self.lock:
+            heapq.heappush(self.heap, (time.time() + self.timeout, file))
+        self.start()
+
+    def start(self):
+        """
+        Starts the background thread (once per pid).
+        """
+        if self.thread:
+            return
+        with self.lock:
+            if self.thread:
+                return
+            self.thread = threading.Thread(
+                target=self.run, name='tmpfile-janitor', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        try:
+            self.scan()
+        except Exception:
+            log.exception("indexing of %s failed" % self.path)
+        while True:
+            with self.lock:
+                expires = self.heap[0][0] if self.heap else None
+            if expires is None:
+                # new files expire after the timeout at the earliest
+                time.sleep(self.timeout)
+            else:
+                time.sleep(max(0, expires - time.time()))
+            try:
+                self.clean()
+            except Exception:
+                log.exception("cleanup of %s failed" % self.path)
+
+    def scan(self):
+        """
+        Indexes the files existing before the start of the janitor.
+        """
+        entries = []
+        for root, dirs, files in os.walk(self.path):
+            for name in files:
+                file = os.path.join(root, name)
+                try:
+                    entries.append(
+                        (os.path.getmtime(file) + self.timeout, file))
+                except OSError:
+                    continue
+        with self.lock:
+            for entry in entries:
+                heapq.heappush(self.heap, entry)
+
+    def clean(self):
+        """
+        Removes the expired files of the index.
+        """
+        now = time.time()
+        while True:
+            with self.lock:
+                if not self.heap or self.heap[0][0] > now:
+                    return
+                expires, file = heapq.heappop(self.heap)
+            try:
+                stat = os.stat(file)
+            except OSError:
+                # already removed
+                continue
+            expires = stat.st_mtime + self.timeout
+            if self.linked and stat.st_nlink > 1:
+                # still referenced
+                expires = max(expires, now + self.timeout)
+            if expires > now:
+                # modified meanwhile
+                with self.lock:
+                    heapq.heappush(self.heap, (expires, file))
+                continue
+            try:
+                os.unlink(file)
+                self.removed += 1
+            except OSError:
+                continue
+            directory = os.path.dirname(file)
+            if directory != self.path:
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    # not empty
+                    pass
+
+
+def create(directory, opener, retries=3):
+    """
+    Creates a file in a directory, which a janitor may remove, if empty.
+
+    The directory is created before each attempt, the opener is retried, if
+    the directory was removed concurrently.
+
+    Args:
+        directory (str): Directory of the file.
+        opener (callable): Function creating the file in the directory.
+        retries (int): Number of retries.
+
+    Returns:
+        obj: Return value of the opener.
+
+    Raises:
+        FileNotFoundError: If the directory vanished on each attempt.
+    """
+    for attempt in range(retries + 1):
+        os.makedirs(directory, exist_ok=True)
+        try:
+            return opener()
+        except FileNotFoundError:
+            if attempt == retries:
+                raise
+
+
+def get_janitor(path, timeout, linked=False):
+    """
+    Gets the janitor of a directory, creates it if necessary.
+
+    Args:
+        path (str): Directory of the temporary files.
+        timeout (int): Seconds after the last modification until a file
+            expires.
+        linked (bool): Keep expired files, which are still hard linked.
+
+    Returns:
+        Janitor: Janitor of the directory.
+    """
+    key = (path, timeout)
+    if key not in janitors:
+        with janitors_lock:
+            if key not in janitors:
+                janitors[key] = Janitor(path, timeout, linked)
+    return janitors[key]
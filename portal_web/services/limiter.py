@@ -0,0 +1,190 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+"""
+In-process rate limiting with token buckets.
+
+Each key (e.g. an ip address or an email) has a bucket of `limit` tokens,
+which is refilled by `limit` tokens per minute. An attempt takes one token
+and is rejected, if the bucket is empty. The buckets are kept in a bounded
+LRU, so a flood of distinct keys doesn't exhaust the memory.
+
+Configuration in the .ini file::
+
+    login.ip_limit = 30
+    login.email_limit = 10
+    login.limiter_size = 10000
+    login.trusted_proxies =
+
+The ip address of a request is the address of the peer. Only if the peer is
+one of the `trusted_proxies` (addresses or networks, comma separated), the
+right-most address of `X-Forwarded-For`, which is not a trusted proxy, is
+used, as the left ones are set by the client.
+"""
+
+import time
+import ipaddress
+import logging
+import threading
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+limiters = {}
+limiters_lock = threading.Lock()
+proxies = {}
+
+
+class Limiter(object):
+    """
+    Token buckets per key in a bounded LRU.
+
+    Args:
+        limit (int): Capacity of a bucket and tokens refilled per minute
+            (0: unlimited).
+        size (int): Maximum number of buckets.
+    """
+
+    def __init__(self, limit, size=10000):
+        self.limit = limit
+        self.rate = limit / 60.0
+        self.size = size
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+        self.allowed = 0
+        self.rejected = 0
+
+    def allow(self, key, now=None):
+        """
+        Takes a token from the bucket of a key.
+
+        Args:
+            key (str): Key of the bucket.
+            now (float): Current time in seconds (default: time.monotonic).
+
+        Returns:
+            bool: True, if the attempt is allowed, False otherwise.
+        """
+        if not self.limit or key is None:
+            return True
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            tokens, last = self.buckets.pop(key, (self.limit, now))
+            tokens = min(self.limit, tokens + (now - last) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+                self.allowed += 1
+            else:
+                self.rejected += 1
+            self.buckets[key] = (tokens, now)
+            while len(self.buckets) > self.size:
+                self.buckets.popitem(last=False)
+        return allowed
+
+    def stats(self):
+        """
+        Gets the counters of the limiter.
+
+        Returns:
+            dict: Limit, number of buckets, allowed and rejected attempts.
+        """
+        return {
+            'limit': self.limit,
+            'buckets': len(self.buckets),
+            'allowed': self.allowed,
+            'rejected': self.rejected,
+        }
+
+
+def get_limiter(settings, name):
+    """
+    Gets a limiter configured by the settings, creates it if necessary.
+
+    Args:
+        settings (dict): Parsed .ini file settings.
+        name (str): Name of the limit setting, e.g. 'login.ip'.
+
+    Returns:
+        Limiter: Limiter.
+    """
+    if name not in limiters:
+        with limiters_lock:
+            if name not in limiters:
+                prefix = name.split('.')[0]
+                limiters[name] = Limiter(
+                    int(settings.get(name + '_limit', 0)),
+                    size=int(settings.get(prefix + '.limiter_size', 10000)))
+    return limiters[name]
+
+
+def stats():
+    """
+    Gets the counters of all limiters.
+
+    Returns:
+        dict: Counters by limiter name.
+    """
+    return {name: limiter.stats() for name, limiter in limiters.items()}
+
+
+def trusted_proxies(settings, prefix='login'):
+    """
+    Gets the trusted proxy networks configured by the settings.
+
+    Args:
+        settings (dict): Parsed .ini file settings.
+        prefix (str): Prefix of the setting, e.g. 'login'.
+
+    Returns:
+        tuple: Networks (ipaddress.ip_network).
+    """
+    value = settings.get(prefix + '.trusted_proxies') or ''
+    if value not in proxies:
+        proxies[value] = tuple(
+            ipaddress.ip_network(network.strip(), strict=False)
+            for network in value.split(',') if network.strip())
+    return proxies[value]
+
+
+def trusted(address, networks):
+    """
+    Checks, if an ip address is in one of the trusted networks.
+
+    Args:
+        address (str): Ip address.
+        networks (tuple): Networks (ipaddress.ip_network).
+
+    Returns:
+        bool: True, if the address is trusted, False otherwise.
+    """
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(address in network for network in networks)
+
+
+def client_address(request, prefix='login'):
+    """
+    Gets the ip address of the client of a request.
+
+    Args:
+        request (pyramid.request.Request): Current request.
+        prefix (str): Prefix of the trusted proxies setting.
+
+    Returns:
+        str: Ip address.
+    """
+    address = request.environ.get('REMOTE_ADDR')
+    networks = trusted_proxies(request.registry.settings, prefix)
+    forwarded = request.environ.get('HTTP_X_FORWARDED_FOR')
+    if not networks or not forwarded or not trusted(address, networks):
+        return address
+    for hop in reversed([h.strip() for h in forwarded.split(',')]):
+        if not hop:
+            continue
+        if not trusted(hop, networks):
+            return hop
+        address = hop
+    return address
@@ -0,0 +1,458 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+"""
+Bulk import of members (parties, addresses and bank accounts) from csv.
+
+The rows are streamed and validated, the IBANs are checked by
+`services.iban`. Each batch of rows is written in one transaction: the
+existing parties, bank account numbers, banks and countries of the batch are
+looked up with one query each, the new records are created with one call per
+model. Operational errors of the database (e.g. deadlocks) are retried by
+`Tdb.transaction` (`retry` in the database section of the trytond config),
+the rows of a batch failing repeatedly are reported as errors. Batches
+failing with other errors are split in halves until the failing rows are
+isolated, so only these rows are reported.
+
+Columns of the csv file (header line required)::
+
+    name,email,street,postal_code,city,country,iban,bic
+
+Example (e.g. in `pshell development.ini`)::
+
+    from portal_web.services.member_import import MemberImport
+    importer = MemberImport('/shared/tmp/members.csv', batch_size=500)
+    importer.run(dry_run=True)
+    importer.errors
+"""
+
+import re
+import time
+import logging
+
+from trytond.backend import DatabaseOperationalError
+
+from . import iban
+from .csv import CsvReader
+from ..models import (
+    Tdb,
+    Party,
+    Country,
+    BankAccountNumber
+)
+
+log = logging.getLogger(__name__)
+
+EMAIL = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+IBAN = re.compile(r'^[A-Z]{2}[0-9]{2}[A-Z0-9]+$')
+BIC = re.compile(r'^[A-Z]{4}[A-Z]{2}[A-Z0-9]{2}([A-Z0-9]{3})?$')
+
+
+def valid_iban(value):
+    """
+    Normalizes and validates an IBAN.
+
+    Args:
+        value (str): IBAN, optionally grouped by spaces.
+
+    Returns:
+        str: Compact IBAN in upper case.
+
+    Raises:
+        ValueError: If the IBAN is invalid.
+    """
+    number = ''.join((value or '').split()).upper()
+    if not IBAN.match(number):
+        raise ValueError("invalid iban format: %s" % value)
+    country = iban.country_data(number[:2])
+    if not country:
+        raise ValueError("unknown iban country: %s" % value)
+    if len(number) != country.total_lng():
+        raise ValueError("invalid iban length: %s" % value)
+    if not iban.iban_okay(number):
+        raise ValueError("invalid iban checksum: %s" % value)
+    return number
+
+
+def valid_bic(value, number=None):
+    """
+    Normalizes and validates a BIC.
+
+    Args:
+        value (str): BIC.
+        number (str): Compact IBAN of the account, if the country of the
+            BIC should match the country of the IBAN.
+
+    Returns:
+        str: BIC in upper case.
+
+    Raises:
+        ValueError: If the BIC is invalid or doesn't match the IBAN.
+    """
+    bic = (value or '').strip().upper()
+    if not BIC.match(bic):
+        raise ValueError("invalid bic format: %s" % value)
+    if number and bic[4:6] != number[:2]:
+        raise ValueError("bic %s doesn't match iban country %s" % (
+            bic, number[:2]))
+    return bic
+
+
+def grouped_iban(number):
+    """
+    Groups a compact IBAN by four characters, as stored by Tryton.
+
+    Args:
+        number (str): Compact IBAN.
+
+    Returns:
+        str: Grouped IBAN.
+    """
+    return ' '.join(number[i:i + 4] for i in range(0, len(number), 4))
+
+
+class MemberImport(object):
+    """
+    Import pipeline of members from a csv file.
+
+    Attributes:
+        address (dict): Tryton address field names by csv column name.
+        errors (list): Rejected rows as (line number, message).
+        counters (dict): Numbers of rows, duplicates, invalid and failed
+            rows, created records and batches.
+
+    Args:
+        path (str): Path of the csv file.
+        batch_size (int): Number of rows per transaction.
+        progress (callable): Called with the report after each batch
+            (default: log the report).
+        **kwargs: Formatting parameters of the csv reader.
+    """
+    address = {
+        'street': 'street',
+        'postal_code': 'postal_code',
+        'city': 'city',
+    }
+
+    def __init__(self, path, batch_size=500, progress=None, **kwargs):
+        self.reader = CsvReader(path, **kwargs)
+        self.batch_size = batch_size
+        self.progress = progress or self.log
+        self.emails = set()
+        self.numbers = set()
+        self.banks = {}
+        self.countries = {}
+        self.errors = []
+        self.counters = dict.fromkeys([
+            'rows', 'duplicates', 'invalid', 'failed', 'parties',
+            'addresses', 'bank_accounts', 'banks', 'batches'], 0)
+        self.start = None
+
+    # --- Pipeline ------------------------------------------------------------
+
+    def run(self, dry_run=False):
+        """
+        Imports the members of the csv file.
+
+        Args:
+            dry_run (bool): Validate and look up the rows, but don't write.
+
+        Returns:
+            dict: Final report.
+        """
+        self.start = time.time()
+        batch = []
+        for row in self.reader:
+            self.counters['rows'] += 1
+            record = self.validate(self.reader.line, row)
+            if record:
+                batch.append(record)
+            if len(batch) >= self.batch_size:
+                self.process(batch, dry_run)
+                batch = []
+        if batch:
+            self.process(batch, dry_run)
+        for line, message in self.reader.errors:
+            self.counters['invalid'] += 1
+            self.errors.append((line, message))
+        self.errors.sort()
+        report = self.report()
+        self.progress(report)
+        return report
+
+    def validate(self, line, row):
+        """
+        Validates and normalizes a row, skips duplicates within the file.
+
+        Args:
+            line (int): Line number of the row.
+            row (dict): Values by column name.
+
+        Returns:
+            dict: Normalized record.
+            None: If the row is invalid or a duplicate.
+        """
+        name = (row.get('name') or '').strip()
+        email = (row.get('email') or '').strip().lower()
+        try:
+            if not name:
+                raise ValueError("name is missing")
+            if not EMAIL.match(email):
+                raise ValueError("invalid email: %s" % email)
+            number = None
+            bic = None
+            if (row.get('iban') or '').strip():
+                number = valid_iban(row['iban'])
+                if not (row.get('bic') or '').strip():
+                    raise ValueError("bic is missing")
+                bic = valid_bic(row['bic'], number)
+        except ValueError as e:
+            self.counters['invalid'] += 1
+            self.errors.append((line, str(e)))
+            return None
+        if email in self.emails and (not number or number in self.numbers):
+            self.counters['duplicates'] += 1
+            return None
+        record = {
+            'line': line,
+            'name': name,
+            'email': email,
+            'address': {
+                field: row[column].strip()
+                for column, field in self.address.items()
+                if (row.get(column) or '').strip()},
+            'country': (row.get('country') or '').strip().upper(),
+            'iban': number if number not in self.numbers else None,
+            'bic': bic,
+        }
+        self.emails.add(email)
+        if number:
+            self.numbers.add(number)
+        return record
+
+    def process(self, batch, dry_run=False):
+        """
+        Writes a batch in one transaction.
+
+        Operational errors of the database are retried by the transaction,
+        the rows of a batch failing nonetheless are reported. Batches failing
+        with other errors are split in halves, until the failing rows are
+        isolated.
+
+        Args:
+            batch (list): Normalized records.
+            dry_run (bool): Only look up the existing records.
+        """
+        write = self.lookup if dry_run else self.store
+        try:
+            # None: the retries of the transaction are exhausted
+            result = write(batch)
+        except DatabaseOperationalError as e:
+            log.warning("member import batch failed: %s" % e)
+            result = None
+        except Exception as e:
+            if len(batch) == 1:
+                log.warning("member import of line %s failed: %s" % (
+                    batch[0]['line'], e))
+                self.counters['failed'] += 1
+                self.errors.append((batch[0]['line'], str(e)))
+                return
+            half = len(batch) // 2
+            self.process(batch[:half], dry_run)
+            self.process(batch[half:], dry_run)
+            return
+        if result is None:
+            log.warning("member import of lines %s-%s failed" % (
+                batch[0]['line'], batch[-1]['line']))
+            self.counters['failed'] += len(batch)
+            self.errors.extend(
+                (record['line'], "batch failed") for record in batch)
+            return
+        for key in ('parties', 'addresses', 'bank_accounts', 'banks'):
+            self.counters[key] += result[key]
+        self.banks.update(result.get('bank_ids', {}))
+        self.counters['batches'] += 1
+        self.progress(self.report())
+
+    # --- Database ------------------------------------------------------------
+
+    def existing(self, batch):
+        """
+        Looks up the existing records of a batch, one query per model.
+
+        Args:
+            batch (list): Normalized records.
+
+        The country ids are cached in `countries`.
+
+        Returns:
+            tuple: Party ids by email (dict), existing IBANs (set) and bank
+                ids by bic (dict).
+        """
+        emails = sorted(set(record['email'] for record in batch))
+        parties = {}
+        for party in Party.get().search_read(
+                ['OR'] + [('email', 'ilike', Party.escape(email))
+                          for email in emails],
+                fields_names=['email']):
+            parties.setdefault((party['email'] or '').lower(), party['id'])
+
+        numbers = [record['iban'] for record in batch if record['iban']]
+        existing = set()
+        if numbers:
+            for number in BankAccountNumber.get().search_read(
+                    ['OR', ('number', 'in', numbers),
+                     ('number', 'in', [grouped_iban(n) for n in numbers])],
+                    fields_names=['number']):
+                existing.add(''.join(number['number'].split()).upper())
+
+        bics = sorted(set(
+            record['bic'] for record in batch
+            if record['bic'] and record['bic'] not in self.banks))
+        banks = {}
+        if bics:
+            for bank in Tdb.get('bank').search_read(
+                    [('bic', 'in', bics)], fields_names=['bic']):
+                banks[bank['bic']] = bank['id']
+
+        codes = sorted(set(
+            record['country'] for record in batch
+            if record['country'] and record['country'] not in self.countries))
+        if codes:
+            for country in Country.get().search_read(
+                    [('code', 'in', codes)], fields_names=['code']):
+                self.countries[country['code']] = country['id']
+
+        return parties, existing, banks
+
+    def new(self, batch, parties):
+        """
+        Gets the records of a batch with a new party (first of each email).
+
+        Args:
+            batch (list): Normalized records.
+            parties (dict): Party ids of the existing emails.
+
+        Returns:
+            list: Records.
+        """
+        emails = set(parties)
+        new = []
+        for record in batch:
+            if record['email'] not in emails:
+                emails.add(record['email'])
+                new.append(record)
+        return new
+
+    @Tdb.transaction(readonly=True)
+    def lookup(self, batch):
+        """
+        Counts the records a batch would create (dry run).
+
+        Args:
+            batch (list): Normalized records.
+
+        Returns:
+            dict: Numbers of records, which would be created.
+        """
+        parties, existing, banks = self.existing(batch)
+        banks.update(self.banks)
+        new = self.new(batch, parties)
+        accounts = [
+            r for r in batch if r['iban'] and r['iban'] not in existing]
+        return {
+            'parties': len(new),
+            'addresses': len([r for r in new if r['address']]),
+            'bank_accounts': len(accounts),
+            'banks': len(set(
+                r['bic'] for r in accounts if r['bic'] not in banks)),
+        }
+
+    @Tdb.transaction(readonly=False)
+    def store(self, batch):
+        """
+        Creates the parties, addresses, banks and bank accounts of a batch.
+
+        Args:
+            batch (list): Normalized records.
+
+        Returns:
+            dict: Numbers of created records and the ids of created banks.
+        """
+        parties, existing, banks = self.existing(batch)
+        banks.update(self.banks)
+
+        # parties with email and address
+        new = self.new(batch, parties)
+        vlist = []
+        for record in new:
+            values = {
+                'name': record['name'],
+                'contact_mechanisms': [('create', [{
+                    'type': 'email', 'value': record['email']}])],
+            }
+            if record['address']:
+                address = dict(record['address'], name=record['name'])
+                if record['country'] in self.countries:
+                    address['country'] = self.countries[record['country']]
+                values['addresses'] = [('create', [address])]
+            vlist.append(values)
+        if vlist:
+            for record, party in zip(new, Party.create(vlist)):
+                parties[record['email']] = party.id
+
+        # banks, named by the bic
+        accounts = [
+            r for r in batch if r['iban'] and r['iban'] not in existing]
+        bics = sorted(set(r['bic'] for r in accounts) - set(banks))
+        created = {}
+        if bics:
+            owners = Party.create([{'name': bic} for bic in bics])
+            for bank in Tdb.get('bank').create([
+                    {'bic': bic, 'party': owner.id}
+                    for bic, owner in zip(bics, owners)]):
+                created[bank.bic] = bank.id
+            banks.update(created)
+
+        # bank accounts
+        if accounts:
+            Tdb.get('bank.account').create([{
+                'bank': banks[record['bic']],
+                'owner': parties[record['email']],
+                'numbers': [('create', [{
+                    'type': 'iban', 'number': record['iban']}])],
+            } for record in accounts])
+
+        return {
+            'parties': len(new),
+            'addresses': len([r for r in new if r['address']]),
+            'bank_accounts': len(accounts),
+            'banks': len(created),
+            'bank_ids': created,
+        }
+
+    # --- Report --------------------------------------------------------------
+
+    def report(self):
+        """
+        Gets the progress of the import.
+
+        Returns:
+            dict: Counters, errors, elapsed seconds and rows per second.
+        """
+        elapsed = time.time() - self.start if self.start else 0
+        report = dict(self.counters)
+        report.update({
+            'errors': len(self.errors),
+            'elapsed': round(elapsed, 1),
+            'rate': round(self.counters['rows'] / elapsed, 1)
+            if elapsed else 0,
+        })
+        return report
+
+    def log(self, report):
+        log.info(
+            "member import: %(rows)s rows (%(rate)s/s), %(parties)s parties, "
+            "%(addresses)s addresses, %(bank_accounts)s bank accounts, "
+            "%(duplicates)s duplicates, %(invalid)s invalid, "
+            "%(failed)s failed" % report)
@@ -0,0 +1,214 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+"""
+Thumbnails of uploaded images.
+
+Thumbnails are generated by a thread pool, so the request uploading an image
+doesn't decode it. They are cached on disk keyed by the content hash of the
+image and the size, so the same image is only scaled once per size. Requests
+don't wait for the generation, a placeholder is served until the thumbnail is
+cached.
+
+Configuration in the .ini file::
+
+    preview.workers = 2
+    preview.sizes = 240, 480
+"""
+
+import io
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import (
+    Image,
+    ImageOps
+)
+
+from .janitor import (
+    create,
+    get_janitor
+)
+
+log = logging.getLogger(__name__)
+
+previewers = {}
+previewers_lock = threading.Lock()
+placeholders = {}
+
+
+class Previewer(object):
+    """
+    Generates and caches thumbnails in a thread pool.
+
+    Args:
+        path (str): Directory of the thumbnail cache.
+        workers (int): Number of worker threads.
+        timeout (int): Seconds after the last modification until a cached
+            thumbnail expires (0: never).
+    """
+
+    def __init__(self, path, workers=2, timeout=0):
+        self.path = path
+        self.workers = workers
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Resets the previewer (initially and in a forked child process).
+        """
+        self.pid = os.getpid()
+        self.executor = None
+        self.futures = {}
+
+    def thumbnail(self, key, size):
+        """
+        Gets the path of a cached thumbnail.
+
+        Args:
+            key (str): Content hash of the image.
+            size (int): Maximum width and height of the thumbnail.
+
+        Returns:
+            str: Path of the thumbnail.
+        """
+        return os.path.join(
+            self.path, key[:2], '%s_%s.png' % (key, size))
+
+    def schedule(self, source, key, size):
+        """
+        Schedules the generation of a thumbnail, if it is not cached yet.
+
+        Args:
+            source (str): Path of the image.
+            key (str): Content hash of the image.
+            size (int): Maximum width and height of the thumbnail.
+
+        Returns:
+            concurrent.futures.Future: Generation of the thumbnail.
+            None: If the thumbnail is cached.
+        """
+        thumbnail = self.thumbnail(key, size)
+        if os.path.isfile(thumbnail):
+            return None
+        if self.pid != os.getpid():
+            self.reset()
+        with self.lock:
+            future = self.futures.get(thumbnail)
+            if future:
+                return future
+            if not self.executor:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix='preview')
+            future = self.executor.submit(
+                self.generate, source, thumbnail, size)
+            self.futures[thumbnail] = future
+        future.add_done_callback(
+            lambda future: self.futures.pop(thumbnail, None))
+        return future
+
+    def generate(self, source, thumbnail, size):
+        """
+        Scales an image down to a thumbnail.
+
+        Args:
+            source (str): Path of the image.
+            thumbnail (str): Path of the thumbnail.
+            size (int): Maximum width and height of the thumbnail.
+
+        Returns:
+            bool: True, if the thumbnail was generated, False otherwise.
+        """
+        try:
+            with Image.open(source) as image:
+                # decode jpegs in a reduced resolution
+                image.draft('RGB', (size, size))
+                image = ImageOps.exif_transpose(image)
+                image.thumbnail((size, size))
+                if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+                    image = image.convert('RGBA')
+                tmp = '%s.%s.tmp' % (thumbnail, threading.get_ident())
+                create(os.path.dirname(thumbnail),
+                       lambda: image.save(tmp, 'PNG', optimize=False))
+            os.replace(tmp, thumbnail)
+        except Exception as e:
+            log.debug("thumbnail of %s failed: %s" % (source, e))
+            return False
+        if self.timeout:
+            get_janitor(self.path, self.timeout).register(thumbnail)
+        return True
+
+    def get(self, key, size):
+        """
+        Gets a cached thumbnail without waiting for a scheduled generation.
+
+        Args:
+            key (str): Content hash of the image.
+            size (int): Maximum width and height of the thumbnail.
+
+        Returns:
+            str: Path of the thumbnail.
+            None: If the thumbnail is not available (yet).
+        """
+        thumbnail = self.thumbnail(key, size)
+        if os.path.isfile(thumbnail):
+            return thumbnail
+        return None
+
+
+def get_previewer(settings):
+    """
+    Gets the previewer configured by the settings, creates it if necessary.
+
+    Args:
+        settings (dict): Parsed .ini file settings.
+
+    Returns:
+        Previewer: Previewer.
+    """
+    path = os.path.join(
+        settings.get('session.data_dir', '/tmp'), 'preview_cache')
+    if path not in previewers:
+        with previewers_lock:
+            if path not in previewers:
+                previewers[path] = Previewer(
+                    path,
+                    workers=int(settings.get('preview.workers', 2)),
+                    timeout=int(settings.get('session.file_expires', 0)))
+    return previewers[path]
+
+
+def placeholder(size):
+    """
+    Gets the png served until a thumbnail is generated.
+
+    Args:
+        size (int): Width and height of the placeholder.
+
+    Returns:
+        bytes: Png image.
+    """
+    if size not in placeholders:
+        buffer = io.BytesIO()
+        Image.new('L', (size, size), 230).save(buffer, 'PNG')
+        placeholders[size] = buffer.getvalue()
+    return placeholders[size]
+
+
+def preview_sizes(settings):
+    """
+    Gets the allowed thumbnail sizes, the first one is the default.
+
+    Args:
+        settings (dict): Parsed .ini file settings.
+
+    Returns:
+        list: Sizes in pixels.
+    """
+    return [
+        int(size) for size in settings.get('preview.sizes', '240').split(',')
+        if size.strip()]
@@ -0,0 +1,548 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+"""
+Beaker session backend with an in-process LRU cache and write-behind.
+
+The backend extends the beaker file backend: session files are still stored
+as serialized dictionaries in `session.data_dir` (sharded into subdirectories
+by the first characters of the session id), so sessions survive a restart.
+The serialized sessions of the most recently used session ids are kept in
+memory, writes are buffered and flushed to disk by a background thread,
+which also removes expired session files.
+
+The session factory skips writes of unchanged sessions: in place changes of
+mutable session values (e.g. form controllers and uploads) are detected by
+fingerprints, the accessed time is saved at most every
+`session.touch_interval` seconds.
+
+Configuration in the .ini file::
+
+    session.type = lrufile
+    session.lru_size = 1000
+    session.flush_interval = 2
+    session.sweep_interval = 600
+    session.touch_interval = 300
+
+Note:
+    A cached session is validated against the modification time of its file,
+    so sessions written by other processes are reloaded. Sessions with
+    pending writes are not validated, so for multiple worker processes
+    without sticky sessions `session.flush_interval` should be 0
+    (write-through, reads still cached).
+"""
+
+import os
+import time
+import atexit
+import pickle
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from beaker import util
+from beaker.container import FileNamespaceManager
+from beaker.synchronization import mutex_synchronizer
+from pyramid_beaker import session_factory_from_settings
+
+log = logging.getLogger(__name__)
+
+caches = {}
+caches_lock = threading.Lock()
+
+
+class Entry(object):
+    """
+    Cached serialized session.
+
+    Attributes:
+        data (bytes): Serialized namespace dictionary, None if not existing.
+        mtime (int): Modification time of the file when read/written (ns).
+        dirty (bool): True, if the data has not been written to disk yet.
+        accessed (float): Timestamp of the last access.
+    """
+    __slots__ = ('data', 'mtime', 'dirty', 'accessed')
+
+    def __init__(self, data, mtime=None, dirty=False):
+        self.data = data
+        self.mtime = mtime
+        self.dirty = dirty
+        self.accessed = time.time()
+
+
+class SessionCache(object):
+    """
+    Per process LRU cache of serialized sessions of one data directory.
+
+    Args:
+        file_dir (str): Directory of the session files.
+        size (int): Maximum number of cached sessions.
+        flush_interval (float): Seconds between write-behind flushes
+            (0: write-through).
+        sweep_interval (float): Seconds between sweeps of expired session
+            files (0: no sweeps).
+        timeout (int): Seconds after which an unused session file expires.
+    """
+
+    def __init__(self, file_dir, size=1000, flush_interval=2,
+                 sweep_interval=600, timeout=None):
+        self.file_dir = file_dir
+        self.size = size
+        self.flush_interval = flush_interval
+        self.sweep_interval = sweep_interval
+        self.timeout = timeout
+        self.lock = threading.RLock()
+        self.write_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Resets the cache (initially and in a forked child process).
+        """
+        self.pid = os.getpid()
+        self.entries = OrderedDict()
+        self.thread = None
+        self.stopped = threading.Event()
+        self.swept = time.time()
+        self.counters = dict.fromkeys([
+            'hits', 'misses', 'stale', 'reads', 'writes', 'flushes',
+            'evictions', 'swept', 'read_time', 'write_time'], 0)
+
+    def check_pid(self):
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.reset()
+
+    # --- Access --------------------------------------------------------------
+
+    def get(self, file):
+        """
+        Gets the serialized session of a file, from memory if possible.
+
+        Args:
+            file (str): Path of the session file.
+
+        Returns:
+            bytes: Pickled namespace dictionary.
+            None: If the session file does not exist.
+        """
+        self.check_pid()
+        start = time.time()
+        with self.lock:
+            entry = self.entries.get(file)
+            if entry:
+                self.entries.move_to_end(file)
+                dirty, entry_mtime = entry.dirty, entry.mtime
+        if entry and not dirty and entry_mtime != mtime(file):
+            # changed or removed by another process
+            self.counters['stale'] += 1
+            entry = None
+        if entry:
+            self.counters['hits'] += 1
+            entry.accessed = time.time()
+            data = entry.data
+        else:
+            self.counters['misses'] += 1
+            data, file_mtime = read(file)
+            self.counters['reads'] += 1
+            self.put(file, Entry(data, file_mtime))
+        self.counters['read_time'] += time.time() - start
+        return data
+
+    def set(self, file, data):
+        """
+        Sets the serialized session of a file, written to disk deferred.
+
+        Args:
+            file (str): Path of the session file.
+            data (bytes): Pickled namespace dictionary.
+
+        Returns:
+            None.
+        """
+        self.check_pid()
+        self.put(file, Entry(data, dirty=True))
+        if not self.flush_interval:
+            self.flush([file])
+        self.start()
+
+    def remove(self, file):
+        """
+        Removes a session from the cache and disk.
+
+        Args:
+            file (str): Path of the session file.
+
+        Returns:
+            None.
+        """
+        self.check_pid()
+        with self.lock:
+            self.entries.pop(file, None)
+        try:
+            os.remove(file)
+        except OSError:
+            pass
+
+    def put(self, file, entry):
+        evicted = []
+        with self.lock:
+            self.entries[file] = entry
+            self.entries.move_to_end(file)
+            while len(self.entries) > self.size:
+                evicted.append(self.entries.popitem(last=False))
+        for evicted_file, evicted_entry in evicted:
+            self.counters['evictions'] += 1
+            if evicted_entry.dirty:
+                self.write(evicted_file, evicted_entry, evicted=True)
+
+    # --- Persistence ---------------------------------------------------------
+
+    def write(self, file, entry, evicted=False):
+        with self.write_lock:
+            # skip outdated entries, the newer one is written instead
+            if not evicted and self.entries.get(file) is not entry:
+                return
+            start = time.time()
+            try:
+                util.safe_write(file, entry.data)
+            except OSError as e:
+                log.error(
+                    "session file %s could not be written: %s" % (file, e))
+                return
+            # mark clean only with the mtime of the written file, so a
+            # concurrent get doesn't reload the file in between
+            file_mtime = mtime(file)
+            with self.lock:
+                entry.mtime = file_mtime
+                entry.dirty = False
+            self.counters['writes'] += 1
+            self.counters['write_time'] += time.time() - start
+
+    def flush(self, files=None):
+        """
+        Writes pending sessions to disk.
+
+        Args:
+            files (list): Paths of the session files to flush (default: all).
+
+        Returns:
+            None.
+        """
+        if self.pid != os.getpid():
+            return
+        with self.lock:
+            if files is None:
+                files = list(self.entries)
+            pending = [
+                (file, self.entries[file]) for file in files
+                if file in self.entries and self.entries[file].dirty]
+        for file, entry in pending:
+            self.write(file, entry)
+        if pending:
+            self.counters['flushes'] += 1
+
+    def sweep(self):
+        """
+        Removes expired session files and cache entries.
+
+        Returns:
+            None.
+        """
+        self.swept = time.time()
+        if not self.timeout:
+            return
+        expired = time.time() - self.timeout
+        for root, dirs, files in os.walk(self.file_dir):
+            for name in files:
+                file = os.path.join(root, name)
+                with self.lock:
+                    entry = self.entries.get(file)
+                if entry and (entry.dirty or entry.accessed > expired):
+                    continue
+                try:
+                    if os.path.getmtime(file) > expired:
+                        continue
+                    os.remove(file)
+                except OSError:
+                    continue
+                with self.lock:
+                    self.entries.pop(file, None)
+                self.counters['swept'] += 1
+
+    def start(self):
+        """
+        Starts the background thread for flushes and sweeps (once per pid).
+        """
+        if self.thread or not (self.flush_interval or self.sweep_interval):
+            return
+        with self.lock:
+            if self.thread:
+                return
+            self.thread = threading.Thread(
+                target=self.run, name='session-cache', daemon=True)
+            self.thread.start()
+
+    def run(self):
+        interval = min(
+            i for i in (self.flush_interval, self.sweep_interval) if i)
+        while not self.stopped.wait(interval):
+            try:
+                self.flush()
+                if self.sweep_interval and \
+                        time.time() - self.swept > self.sweep_interval:
+                    self.sweep()
+            except Exception:
+                log.exception("session cache maintenance failed")
+
+    def stats(self):
+        """
+        Gets the statistics of the cache.
+
+        Returns:
+            dict: Counters, hit rate and average latencies in ms.
+        """
+        counters = dict(self.counters)
+        lookups = counters['hits'] + counters['misses']
+        with self.lock:
+            dirty = len([e for e in self.entries.values() if e.dirty])
+            cached = len(self.entries)
+        counters.update({
+            'pid': self.pid,
+            'cached': cached,
+            'dirty': dirty,
+            'hit_rate': lookups and counters['hits'] / lookups,
+            'read_avg_ms': lookups and counters['read_time'] / lookups * 1000,
+            'write_avg_ms': counters['writes'] and (
+                counters['write_time'] / counters['writes'] * 1000),
+        })
+        return counters
+
+
+def mtime(file):
+    try:
+        return os.stat(file).st_mtime_ns
+    except OSError:
+        return None
+
+
+def read(file):
+    try:
+        with open(file, 'rb') as f:
+            return f.read(), os.fstat(f.fileno()).st_mtime_ns
+    except OSError:
+        return None, None
+
+
+def get_cache(file_dir, **kwargs):
+    """
+    Gets the session cache of a directory, creates it if necessary.
+
+    Args:
+        file_dir (str): Directory of the session files.
+        **kwargs: Arguments of the SessionCache.
+
+    Returns:
+        SessionCache: Cache of the directory.
+    """
+    cache = caches.get(file_dir)
+    if cache:
+        return cache
+    with caches_lock:
+        if file_dir not in caches:
+            caches[file_dir] = SessionCache(file_dir, **kwargs)
+        return caches[file_dir]
+
+
+def flush_all():
+    """
+    Writes all pending sessions to disk (on exit of the process).
+    """
+    for cache in list(caches.values()):
+        cache.flush()
+
+
+def stats():
+    """
+    Gets the statistics of the session writes and caches of the process.
+
+    Returns:
+        dict: Statistics of the session writes and per session directory.
+    """
+    counters = dict(persist_counters)
+    counters['writes_per_request'] = counters['requests'] and (
+        counters['writes'] + counters['touches']) / counters['requests']
+    return {
+        'persist': counters,
+        'caches': {
+            file_dir: cache.stats() for file_dir, cache in caches.items()},
+    }
+
+
+atexit.register(flush_all)
+
+
+# --- Dirty tracking ----------------------------------------------------------
+
+FINGERPRINT = 'portal_web.session.fingerprint'
+IMMUTABLE_TYPES = (str, bytes, int, float, complex, bool, type(None))
+
+persist_counters = dict.fromkeys(
+    ['requests', 'writes', 'touches', 'skipped'], 0)
+
+
+def fingerprint(session):
+    """
+    Gets a fingerprint of the session values, which may be mutated in place.
+
+    Changes of nested objects (e.g. the form controllers in `forms`) are not
+    noticed by the session, so they are detected by comparing fingerprints
+    of all values, which are not of an immutable type. Immutable values can
+    only be changed by assignment, which is noticed by the session.
+
+    Args:
+        session (pyramid.interfaces.ISession): Session.
+
+    Returns:
+        bytes: Digest of the pickled values.
+        None: If a value could not be pickled.
+    """
+    digest = hashlib.sha1()
+    for key, value in session.items():
+        if isinstance(value, IMMUTABLE_TYPES):
+            continue
+        digest.update(str(key).encode())
+        try:
+            digest.update(
+                pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        except Exception as e:
+            log.debug("session value %s not fingerprinted: %s" % (key, e))
+            return None
+    return digest.digest()
+
+
+def track_session(request):
+    """
+    Remembers the fingerprint of the session on first call in a request.
+
+    Args:
+        request (pyramid.request.Request): Current request.
+
+    Returns:
+        None.
+    """
+    if FINGERPRINT not in request.environ:
+        request.environ[FINGERPRINT] = fingerprint(request.session)
+
+
+def session_factory(settings):
+    """
+    Creates a beaker session factory with dirty tracking.
+
+    An accessed session is only saved, if it was changed or if the stored
+    accessed time is older than `session.touch_interval` seconds (0: save
+    on every access). In place changes of mutable session values are
+    detected, if `track_session` was called for the request.
+
+    Args:
+        settings (dict): Parsed .ini file settings.
+
+    Returns:
+        class: Pyramid session factory.
+    """
+    touch_interval = int(settings.get('session.touch_interval', 0))
+    options = {
+        key: value for key, value in settings.items()
+        if key != 'session.touch_interval'}
+    if options.get('session.type') == 'lrufile':
+        # beaker doesn't pass the data_serializer to the namespace manager
+        options.setdefault('session.serializer', options.get(
+            'session.data_serializer', 'pickle'))
+    factory = session_factory_from_settings(options)
+
+    class Session(factory):
+
+        def persist(self):
+            persist_counters['requests'] += 1
+            environ = self.__dict__['_environ']
+            if not self.dirty() and FINGERPRINT in environ:
+                # values without a fingerprint are always saved
+                current = fingerprint(self)
+                if current is None or current != environ[FINGERPRINT]:
+                    self.save()
+            if self.dirty():
+                persist_counters['writes'] += 1
+            else:
+                session = self._session()
+                if session.is_new:
+                    return
+                if touch_interval and session.last_accessed and \
+                        time.time() - session.last_accessed < touch_interval:
+                    persist_counters['skipped'] += 1
+                    return
+                persist_counters['touches'] += 1
+            factory.persist(self)
+
+    return Session
+
+
+class LRUFileNamespaceManager(FileNamespaceManager):
+    """
+    File namespace manager reading from and writing to a SessionCache.
+
+    Registered as beaker backend `lrufile`. The cache settings are taken from
+    the session settings on first use of the data directory in a process.
+    The sessions are (de)serialized by the `session.data_serializer`
+    ('pickle', 'json' or a serializer object), unreadable session files are
+    treated as empty sessions.
+    """
+
+    def __init__(self, namespace, lru_size=1000, flush_interval=2,
+                 sweep_interval=600, timeout=None, serializer='pickle',
+                 **kwargs):
+        FileNamespaceManager.__init__(self, namespace, **kwargs)
+        if serializer == 'json':
+            self.serializer = util.JsonSerializer()
+        elif serializer == 'pickle':
+            self.serializer = util.PickleSerializer()
+        else:
+            self.serializer = serializer
+        self.cache = get_cache(
+            self.file_dir,
+            size=int(lru_size),
+            flush_interval=float(flush_interval),
+            sweep_interval=float(sweep_interval),
+            timeout=timeout and int(timeout))
+
+    def get_access_lock(self):
+        # cross process consistency is based on atomic writes and mtimes
+        return mutex_synchronizer(
+            identifier="lrufile/%s/%s" % (self.file_dir, self.namespace))
+
+    def get_creation_lock(self, key):
+        return mutex_synchronizer(
+            identifier="lrufile/funclock/%s/%s" % (self.namespace, key))
+
+    def do_open(self, flags, replace):
+        if not replace:
+            data = self.cache.get(self.file)
+            if data:
+                try:
+                    self.hash = self.serializer.loads(data)
+                except Exception as e:
+                    log.warning("session file %s could not be loaded: %s" % (
+                        self.file, e))
+                    self.hash = {}
+        self.flags = flags
+
+    def do_close(self):
+        if self.flags == 'c' or self.flags == 'w':
+            self.cache.set(self.file, self.serializer.dumps(self.hash))
+        self.hash = {}
+        self.flags = None
+
+    def do_remove(self):
+        self.cache.remove(self.file)
+        self.hash = {}
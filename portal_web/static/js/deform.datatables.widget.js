@@ -79,6 +79,8 @@ if(typeof deform.datatableSequences == "undefined")
         - more: zoom-in/out icon to show details, if available
         - controls: control links (edit, remove)
         - sequence: contains html code for colander sequence item
+        - fields: field values to instantiate the sequence item from the
+          prototype instead (widget option client_rows)
         - mode: add|create|edit
         - errors: error feedback from colander validation
 
@@ -108,6 +110,7 @@ var DatatableSequence = function(vars) {
     this.errormsg = vars.errormsg ? vars.errormsg : false;
     this.orderable = vars.orderable ? parseInt(vars.orderable) == 1 : false;
     this.proto = vars.proto;
+    this.clientRows = vars.clientRows === true;
     this.api = vars.api;
     this.apiPath = vars.apiPath;
     this.apiArgs = vars.apiArgs ? vars.apiArgs : false;
@@ -204,7 +207,10 @@ var DatatableSequence = function(vars) {
         // initial data
         data: $(ds.sel.container).data('source'),
         total: parseInt($(ds.sel.container).data('source-total')) > -1 ?
-               $(ds.sel.container).data('source-total') : null
+               $(ds.sel.container).data('source-total') : null,
+        // url of the cacheable initial data (loaded before initialization)
+        url: $(ds.sel.container).data('source-url'),
+        loaded: false
     };
 };
 
@@ -234,6 +240,24 @@ DatatableSequence.prototype = {
             // prevent reinitialization
             if(typeof deform.datatableSequences[ds.oid] !== "undefined")
                 return;
+
+            // load the initial source data first, if stored externally
+            if(ds.source.url && !ds.source.loaded &&
+                    $.inArray('add', ds.actions) > -1) {
+                $.getJSON(ds.source.url).done(function(source) {
+                    ds.source.data = source.data;
+                    ds.source.total = parseInt(source.total) > -1 ?
+                                      source.total : null;
+                }).fail(function() {
+                    // fall back to the api
+                    ds.source.data = undefined;
+                    ds.source.total = null;
+                }).always(function() {
+                    ds.source.loaded = true;
+                    ds.init();
+                });
+                return;
+            }
             $("#" + ds.oid).addClass("initialized");
 
             // initialize columns
@@ -309,6 +333,13 @@ DatatableSequence.prototype = {
                     });
             }
 
+            // instantiate sequences of client side rows from the prototype
+            if(ds.clientRows && typeof ds.target.data != "undefined")
+                $.each(ds.target.data, function(index, data) {
+                    if(typeof data.sequence == "undefined")
+                        data.sequence = ds.rowSequence(data);
+                });
+
             // initialize target table
             ds.target.table = $(ds.sel.targetTable).DataTable({
                 retrieve: true,
@@ -1427,6 +1458,52 @@ DatatableSequence.prototype = {
         ds.updateSequence(form, data);
     },
 
+    /**
+     * Instantiates the sequence item of a client side row.
+     *
+     * The sequence item is instantiated from the prototype and filled with
+     * the field values of the row, as the server only provides the values
+     * instead of the rendered sequence item (widget option `client_rows`).
+     * The values are set as attributes, so the html code equals the one of a
+     * sequence item rendered on the server.
+     *
+     * Args:
+     *   data (array): Datatables row data with field values (data.fields).
+     *
+     * Returns:
+     *   string: Html code of the sequence item.
+     */
+    rowSequence: function(data) {
+        var ds = this;
+        var sequence = ds.newSequence(data).node;
+        $.each(data.fields || {}, function(name, value) {
+            var element = sequence.find("[name='" + name + "']");
+            var values = $.isArray(value) ? value : [String(value)];
+            if(element.length === 0)
+                return;
+            if(element.is(':checkbox, :radio')) {
+                element.each(function() {
+                    if($.inArray($(this).val(), values) != -1)
+                        $(this).attr('checked', 'checked');
+                    else
+                        $(this).removeAttr('checked');
+                });
+            } else if(element.is('select')) {
+                element.children('option').each(function() {
+                    if($.inArray($(this).val(), values) != -1)
+                        $(this).attr('selected', 'selected');
+                    else
+                        $(this).removeAttr('selected');
+                });
+            } else if(element.is('textarea')) {
+                element.text(value);
+            } else {
+                element.attr('value', value);
+            }
+        });
+        return $('<div>').append(sequence).html();
+    },
+
     /**
      * Gets data template for new rows.
      *
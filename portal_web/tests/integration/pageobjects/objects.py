@@ -12,6 +12,7 @@ from paste.deploy.loadwsgi import appconfig
 from ....config import (
     get_plugins,
     replace_environment_vars,
+    identity,
     web_user,
     party,
     user,
@@ -64,6 +65,7 @@ class DeformFormObject(object):
                 config = testing.setUp(request=request, settings=settings())
                 if userid:
                     config.testing_securitypolicy(userid)
+                    request.identity = identity(request)
                     request.web_user = web_user(request)
                     request.party = party(request)
                     request.user = user(request)
@@ -0,0 +1,140 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+"""
+Web User Tests
+"""
+
+import pytest
+
+from ....models import WebUser
+
+
+class TargetMock():
+    def __init__(self, id):
+        self.id = id
+
+
+class FieldMock():
+    def __init__(self, target):
+        self.target = target
+
+    def get_target(self):
+        return self.target
+
+
+class WebUserModelMock():
+    """
+    mock of the Tryton model web.user
+    """
+    records = [{
+        'id': 1,
+        'email': 'user@test.test',
+        'password_hash': 'hash:secret',
+        'opt_in_state': 'opted-in',
+        'party': 2,
+        'user': None,
+        'roles': [3],
+        'roles.': [{'id': 3, 'code': 'editor'}],
+    }]
+
+    def __init__(self):
+        self.checked = []
+        self.queries = []
+        self._fields = {
+            'party': FieldMock(TargetMock), 'user': FieldMock(TargetMock)}
+
+    def __call__(self, id):
+        return TargetMock(id)
+
+    def match(self, domain):
+        (field, operator, value), = domain
+        assert (field, operator) == ('email', 'ilike')
+        return [r for r in self.records if r['email'] == value.lower()]
+
+    def search_read(self, domain, limit=None, fields_names=None):
+        self.queries.append(('search_read', fields_names))
+        # dotted fields are read as relation values like in tryton
+        names = set(
+            name.split('.')[0] + '.' if '.' in name else name
+            for name in fields_names)
+        return [
+            {name: record[name] for name in names}
+            for record in self.match(domain)][:limit]
+
+    def search_count(self, domain):
+        self.queries.append(('search_count', None))
+        return len(self.match(domain))
+
+    def hash_password(self, password):
+        return 'hash:' + password
+
+    def check_password(self, password, password_hash):
+        self.checked.append(password_hash)
+        return password_hash == 'hash:' + password, None
+
+
+@pytest.fixture
+def model(monkeypatch):
+    model = WebUserModelMock()
+    monkeypatch.setattr(WebUser, 'get', classmethod(lambda cls: model))
+    monkeypatch.setattr(WebUser, '_dummy_password_hash', None)
+    return model
+
+
+class TestWebUser:
+    """
+    WebUser test class
+    """
+
+    def test_load_identity(self, model):
+        """
+        Web user, party, user and roles are read in one query
+        """
+        identity = WebUser.load_identity('User@test.test')
+        assert model.queries == [
+            ('search_read', ['id', 'party', 'user', 'roles.code'])]
+        assert identity['web_user'].id == 1
+        assert identity['party'].id == 2
+        assert identity['user'] is None
+        assert identity['roles'] == ['editor']
+        assert WebUser.load_identity('unknown@test.test') is None
+        assert WebUser.load_identity(None) is None
+        assert len(model.queries) == 2
+
+    def test_load_for_login(self, model):
+        """
+        Login state is read in one query, the password checked once
+        """
+        assert WebUser.load_for_login('User@test.test', 'secret') == {
+            'id': 1, 'opt_in_state': 'opted-in', 'valid': True}
+        assert model.queries == [
+            ('search_read', ['id', 'password_hash', 'opt_in_state'])]
+        assert model.checked == ['hash:secret']
+
+    def test_load_for_login_wrong_password(self, model):
+        """
+        Wrong passwords are rejected
+        """
+        assert WebUser.load_for_login('user@test.test', 'wrong') == {
+            'id': 1, 'opt_in_state': 'opted-in', 'valid': False}
+        assert model.checked == ['hash:secret']
+
+    def test_load_for_login_unknown(self, model):
+        """
+        Unknown emails are checked against the dummy hash
+        """
+        assert WebUser.load_for_login('unknown@test.test', 'secret') is None
+        assert WebUser.load_for_login(None, None) is None
+        dummy = WebUser.dummy_password_hash()
+        assert dummy.startswith('hash:') and dummy != 'hash:secret'
+        assert model.checked == [dummy, dummy]
+
+    def test_email_exists(self, model):
+        """
+        Emails are checked by count without reading the web user
+        """
+        assert WebUser.email_exists('USER@test.test') is True
+        assert WebUser.email_exists('unknown@test.test') is False
+        assert WebUser.email_exists(None) is False
+        assert model.queries == [('search_count', None)] * 2
@@ -0,0 +1,92 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+"""
+Csv Tests
+"""
+
+import threading
+
+import pytest
+
+from ....services.csv import (
+    CsvReader,
+    CsvWriter,
+    csv_import
+)
+
+
+class TestCsvReader:
+    """
+    CsvReader test class
+    """
+
+    def test_typed_rows(self, tmpdir):
+        """
+        Values are converted and invalid rows are collected as errors
+        """
+        file = tmpdir.join('members.csv')
+        file.write('name,amount\na,1\nb,x\n\nc\nd,4\n')
+        reader = CsvReader(str(file), converters={'amount': int}, tuples=True)
+        rows = list(reader)
+        assert [(row.name, row.amount) for row in rows] == [('a', 1), ('d', 4)]
+        assert [line for line, message in reader.errors] == [3, 5]
+
+    def test_batches(self, tmpdir):
+        """
+        Rows are streamed in batches of a fixed size
+        """
+        file = tmpdir.join('members.csv')
+        file.write('name\n' + ''.join('%s\n' % i for i in range(5)))
+        batches = list(CsvReader(str(file)).batches(2))
+        assert [len(batch) for batch in batches] == [2, 2, 1]
+        assert batches[0][0] == {'name': '0'}
+
+    def test_lenient_rows(self, tmpdir):
+        """
+        Non-strict rows are filled up and keep their surplus values
+        """
+        file = tmpdir.join('members.csv')
+        file.write('name,amount\na\nb,2,x,y\n')
+        assert csv_import(str(file)) == [
+            {'name': 'a', 'amount': None},
+            {'name': 'b', 'amount': '2', None: ['x', 'y']}]
+        reader = CsvReader(str(file), tuples=True, strict=False)
+        assert [tuple(row) for row in reader] == [('a', None)]
+        assert [line for line, message in reader.errors] == [3]
+
+    def test_missing_file(self, tmpdir):
+        """
+        A missing file raises an IOError
+        """
+        with pytest.raises(IOError):
+            csv_import(str(tmpdir.join('missing.csv')))
+
+
+class TestCsvWriter:
+    """
+    CsvWriter test class
+    """
+
+    def test_concurrent_writes(self, tmpdir):
+        """
+        Rows of several threads are written in batches without interleaving
+        """
+        path = str(tmpdir.join('benchmark.csv'))
+        writer = CsvWriter(path, ['name', 'value'], size=10, interval=0)
+
+        def write(name):
+            for value in range(100):
+                writer.write({'name': name, 'value': 'x' * value})
+
+        threads = [
+            threading.Thread(target=write, args=(str(i),)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.close()
+        rows = list(CsvReader(path))
+        assert len(rows) == 400
+        assert sorted(len(row['value']) for row in rows) == sorted(
+            list(range(100)) * 4)
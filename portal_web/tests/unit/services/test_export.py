@@ -0,0 +1,122 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+"""
+Export Tests
+"""
+
+import gzip
+import json
+import zlib
+from contextlib import nullcontext
+
+from pyramid.request import Request
+from trytond.transaction import Transaction
+
+from ....services.export import (
+    Export,
+    export_response
+)
+
+
+class ModelMock(object):
+    __name__ = 'export.mock'
+    records = [
+        {'id': i, 'name': 'name%s' % i, 'party.': {'name': 'party%s' % i}}
+        for i in range(1, 26)]
+
+    @classmethod
+    def get(cls):
+        return cls
+
+    @classmethod
+    def search_read(cls, domain, limit, order, fields_names):
+        assert Transaction().readonly
+        last = domain[-1][2] if domain else 0
+        return [r for r in cls.records if r['id'] > last][:limit]
+
+
+class DatabaseMock(object):
+    def has_channel(self):
+        return False
+
+    def put_connection(self, connection, close):
+        pass
+
+
+def start(self, database_name, user, readonly=False, context=None, **kw):
+    self.database = DatabaseMock()
+    self.readonly = readonly
+    self.user = user
+    self.close = False
+    self.context = dict(context or {})
+    self._datamanagers = []
+    return self
+
+
+class ExportMock(Export):
+    domains = []
+
+    def fetch(self, domain):
+        ExportMock.domains.append(domain)
+        last = domain[-1][2] if domain else 0
+        records = [r for r in self.model.records if r['id'] > last]
+        return records[:self.batch_size]
+
+
+class TestExport:
+    """
+    Export test class
+    """
+
+    def test_keyset_batches(self):
+        """
+        Records are read in batches continuing after the last id
+        """
+        export = ExportMock(
+            ModelMock, ['name', 'party.name'], format='jsonl', batch_size=10)
+        ExportMock.domains = []
+        lines = b''.join(export).decode('utf-8').splitlines()
+        assert len(lines) == 25
+        assert json.loads(lines[-1]) == {
+            'name': 'name25', 'party.name': 'party25'}
+        assert ExportMock.domains == [
+            [], [('id', '>', 10)], [('id', '>', 20)]]
+
+    def test_compressed_csv(self, monkeypatch):
+        """
+        Csv responses are streamed gzipped, if accepted by the client, the
+        header is flushed first
+        """
+        monkeypatch.setattr(Export, 'fetch', ExportMock.fetch)
+        request = Request.blank('/', headers={'Accept-Encoding': 'gzip'})
+        response = export_response(
+            request, ModelMock, ['name'], compress=True, batch_size=10)
+        assert response.content_encoding == 'gzip'
+        chunks = list(response.app_iter)
+        header = zlib.decompressobj(31).decompress(chunks[0])
+        assert header == b'name\r\n'
+        body = gzip.decompress(b''.join(chunks)).decode('utf-8')
+        assert body.splitlines()[:2] == ['name', 'name1']
+        assert len(body.splitlines()) == 26
+
+    def test_transactions(self, monkeypatch):
+        """
+        Each batch is read in a transaction, the stack is unchanged afterwards
+        """
+        monkeypatch.setattr(Transaction, 'start', start)
+        monkeypatch.setattr(Transaction, 'rollback', lambda self: None)
+        monkeypatch.setattr(Transaction, 'set_context',
+                            lambda self, c: nullcontext())
+        stack = list(Transaction._local.transactions)
+        export = Export(ModelMock, ['name'], batch_size=10)
+        export.context = {}
+        assert len(b''.join(export).splitlines()) == 26
+        assert Transaction._local.transactions == stack
+        export = Export(ModelMock, ['name'], batch_size=10)
+        export.context = {}
+        chunks = iter(export)
+        next(chunks)
+        next(chunks)
+        export.close()
+        assert Transaction._local.transactions == stack
@@ -0,0 +1,69 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+"""
+Janitor Tests
+"""
+
+import os
+
+from ....services.janitor import (
+    Janitor,
+    create
+)
+
+
+class TestJanitor:
+    """
+    Janitor test class
+    """
+
+    def test_clean(self, tmpdir):
+        """
+        Expired files and their empty subdirectories are removed
+        """
+        subdirectory = tmpdir.mkdir('session')
+        expired = subdirectory.join('expired')
+        expired.write('x')
+        os.utime(str(expired), (0, 0))
+        current = tmpdir.join('current')
+        current.write('x')
+        janitor = Janitor(str(tmpdir), 60)
+        janitor.scan()
+        janitor.clean()
+        assert not expired.exists()
+        assert not subdirectory.exists()
+        assert current.exists()
+        assert janitor.removed == 1
+
+    def test_modified(self, tmpdir):
+        """
+        Files modified after registration are kept
+        """
+        file = tmpdir.join('file')
+        file.write('x')
+        janitor = Janitor(str(tmpdir), 60)
+        janitor.heap.append((0, str(file)))
+        janitor.clean()
+        assert file.exists()
+        assert len(janitor.heap) == 1
+
+    def test_create(self, tmpdir):
+        """
+        Files are created, if the directory is removed concurrently
+        """
+        directory = str(tmpdir.join('session'))
+        path = os.path.join(directory, 'file')
+        attempts = []
+
+        def opener():
+            attempts.append(1)
+            if len(attempts) == 1:
+                # removed by the janitor after makedirs
+                os.rmdir(directory)
+            return open(path, 'wb')
+
+        with create(directory, opener) as file:
+            file.write(b'x')
+        assert len(attempts) == 2
+        assert os.path.isfile(path)
@@ -0,0 +1,61 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+"""
+Limiter Tests
+"""
+
+from pyramid import testing
+
+from ....services.limiter import (
+    Limiter,
+    client_address
+)
+
+
+class TestLimiter:
+    """
+    Limiter test class
+    """
+
+    def test_allow(self):
+        """
+        Attempts over the limit are rejected until the bucket is refilled
+        """
+        limiter = Limiter(2)
+        assert limiter.allow('ip', now=0)
+        assert limiter.allow('ip', now=0)
+        assert not limiter.allow('ip', now=0)
+        assert limiter.allow('other', now=0)
+        assert limiter.allow('ip', now=30)
+        assert limiter.stats()['rejected'] == 1
+
+    def test_bounded(self):
+        """
+        The least recently used buckets are dropped
+        """
+        limiter = Limiter(1, size=2)
+        for key in ('a', 'b', 'c'):
+            limiter.allow(key, now=0)
+        assert list(limiter.buckets) == ['b', 'c']
+
+    def test_unlimited(self):
+        """
+        A limit of 0 disables the limiter
+        """
+        limiter = Limiter(0)
+        assert all(limiter.allow('ip') for _ in range(100))
+
+    def test_client_address(self):
+        """
+        X-Forwarded-For is only used behind a trusted proxy
+        """
+        request = testing.DummyRequest(environ={
+            'REMOTE_ADDR': '10.0.0.2',
+            'HTTP_X_FORWARDED_FOR': '6.6.6.6, 1.2.3.4, 10.0.0.1'})
+        request.registry.settings = {}
+        assert client_address(request) == '10.0.0.2'
+        request.registry.settings = {'login.trusted_proxies': '10.0.0.0/8'}
+        assert client_address(request) == '1.2.3.4'
+        request.environ['REMOTE_ADDR'] = '5.5.5.5'
+        assert client_address(request) == '5.5.5.5'
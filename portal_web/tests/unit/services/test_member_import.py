@@ -0,0 +1,121 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+"""
+Member Import Tests
+"""
+
+import pytest
+from trytond.backend import DatabaseOperationalError
+
+from ....services.member_import import (
+    MemberImport,
+    valid_bic,
+    valid_iban
+)
+
+
+class ImportMock(MemberImport):
+    invalid = ()
+
+    def store(self, batch):
+        self.batches.append([record['line'] for record in batch])
+        if self.fail:
+            # Tdb.transaction returns None, if its retries are exhausted
+            self.fail -= 1
+            return None
+        for record in batch:
+            if record['line'] in self.invalid:
+                raise ValueError('invalid record')
+        return {'parties': len(batch), 'addresses': 0, 'bank_accounts': 0,
+                'banks': 0}
+
+
+class TestMemberImport:
+    """
+    MemberImport test class
+    """
+
+    def test_valid_iban(self):
+        """
+        IBANs are normalized and validated
+        """
+        assert valid_iban('de89 3704 0044 0532 0130 00') == \
+            'DE89370400440532013000'
+        with pytest.raises(ValueError):
+            valid_iban('DE88370400440532013000')
+
+    def test_valid_bic(self):
+        """
+        BICs are normalized, validated and matched with the IBAN country
+        """
+        assert valid_bic(' cobadeffxxx ') == 'COBADEFFXXX'
+        assert valid_bic('COBADEFF', 'DE89370400440532013000') == 'COBADEFF'
+        with pytest.raises(ValueError):
+            valid_bic('COBA-DEFF')
+        with pytest.raises(ValueError):
+            valid_bic('COBAFRFFXXX', 'DE89370400440532013000')
+
+    def test_batches(self, tmpdir):
+        """
+        Valid rows are written in batches, rows of failed batches reported
+        """
+        file = tmpdir.join('members.csv')
+        file.write(
+            'name,email,iban,bic\n'
+            'a,a@test.test,DE89370400440532013000,COBADEFFXXX\n'
+            'b,b@test.test,,\n'
+            'a,A@test.test,,\n'
+            'c,invalid,,\n'
+            'd,d@test.test,DE00370400440532013000,COBADEFFXXX\n'
+            'e,e@test.test,,\n')
+        importer = ImportMock(str(file), batch_size=2,
+                              progress=lambda report: None)
+        importer.batches = []
+        importer.fail = 1
+        report = importer.run()
+        assert importer.batches == [[2, 3], [7]]
+        assert report['parties'] == 1
+        assert report['duplicates'] == 1
+        assert report['failed'] == 2
+        assert report['batches'] == 1
+        assert [line for line, message in importer.errors] == [2, 3, 5, 6]
+
+    def test_operational_error(self, tmpdir):
+        """
+        Rows of batches raising operational errors are reported, not retried
+        """
+        file = tmpdir.join('members.csv')
+        file.write('name,email\n' + ''.join(
+            '%s,%s@test.test\n' % (name, name) for name in 'ab'))
+        importer = ImportMock(str(file), batch_size=2,
+                              progress=lambda report: None)
+        lookups = []
+
+        def lookup(batch):
+            lookups.append(len(batch))
+            raise DatabaseOperationalError('deadlock')
+
+        importer.lookup = lookup
+        report = importer.run(dry_run=True)
+        assert lookups == [2]
+        assert report['failed'] == 2
+        assert importer.errors == [(2, 'batch failed'), (3, 'batch failed')]
+
+    def test_bisect(self, tmpdir):
+        """
+        Batches failing with other errors are split to isolate the rows
+        """
+        file = tmpdir.join('members.csv')
+        file.write('name,email\n' + ''.join(
+            '%s,%s@test.test\n' % (name, name) for name in 'abcd'))
+        importer = ImportMock(str(file), batch_size=4,
+                              progress=lambda report: None)
+        importer.batches = []
+        importer.fail = 0
+        importer.invalid = (4,)
+        report = importer.run()
+        assert importer.batches == [[2, 3, 4, 5], [2, 3], [4, 5], [4], [5]]
+        assert report['parties'] == 3
+        assert report['failed'] == 1
+        assert importer.errors == [(4, 'invalid record')]
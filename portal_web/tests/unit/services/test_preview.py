@@ -0,0 +1,71 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+"""
+Preview Tests
+"""
+
+import io
+import threading
+
+from PIL import Image
+
+from ....services.preview import (
+    Previewer,
+    placeholder
+)
+
+
+class TestPreviewer:
+    """
+    Previewer test class
+    """
+
+    def test_thumbnail(self, tmpdir):
+        """
+        Thumbnails are generated in the background and cached
+        """
+        source = str(tmpdir.join('image.jpg'))
+        Image.new('RGB', (2000, 1000), 'red').save(source)
+        previewer = Previewer(str(tmpdir.join('cache')))
+        future = previewer.schedule(source, 'abcdef', 240)
+        assert future.result(10) is True
+        thumbnail = previewer.get('abcdef', 240)
+        with Image.open(thumbnail) as image:
+            assert image.size == (240, 120)
+        assert previewer.schedule(source, 'abcdef', 240) is None
+
+    def test_invalid(self, tmpdir):
+        """
+        No thumbnail is cached for invalid images
+        """
+        source = tmpdir.join('image.jpg')
+        source.write('no image')
+        previewer = Previewer(str(tmpdir.join('cache')))
+        future = previewer.schedule(str(source), 'abcdef', 240)
+        assert future.result(10) is False
+        assert previewer.get('abcdef', 240) is None
+
+    def test_get_nonblocking(self, tmpdir, monkeypatch):
+        """
+        Scheduled thumbnails are not awaited, a placeholder is available
+        """
+        source = str(tmpdir.join('image.png'))
+        Image.new('RGB', (100, 100), 'red').save(source)
+        previewer = Previewer(str(tmpdir.join('cache')))
+        generate = previewer.generate
+        release = threading.Event()
+
+        def blocked(*args):
+            release.wait(10)
+            return generate(*args)
+
+        monkeypatch.setattr(previewer, 'generate', blocked)
+        future = previewer.schedule(source, 'abcdef', 240)
+        assert previewer.get('abcdef', 240) is None
+        assert not future.done()
+        release.set()
+        future.result(10)
+        assert previewer.get('abcdef', 240)
+        with Image.open(io.BytesIO(placeholder(240))) as image:
+            assert image.size == (240, 240)
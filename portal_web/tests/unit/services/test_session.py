@@ -0,0 +1,216 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+"""
+Session Backend Tests
+"""
+
+import os
+import pickle
+
+from beaker import util
+from beaker.session import Session
+from pyramid.testing import DummyRequest
+
+from ....services.session import (
+    SessionCache,
+    LRUFileNamespaceManager,
+    persist_counters,
+    session_factory,
+    track_session
+)
+
+
+class TestSessionCache:
+    """
+    Session cache test class
+    """
+
+    def test_write_behind(self, tmpdir):
+        """
+        Cache writes sessions deferred and serves reads from memory
+        """
+        cache = SessionCache(str(tmpdir), size=2, flush_interval=60)
+        file = os.path.join(str(tmpdir), 'a.cache')
+        cache.set(file, b'data')
+        assert not os.path.exists(file)
+        assert cache.get(file) == b'data'
+        cache.flush()
+        with open(file, 'rb') as f:
+            assert f.read() == b'data'
+        assert cache.counters['hits'] == 1
+
+    def test_eviction_persists(self, tmpdir):
+        """
+        Cache writes dirty sessions to disk on eviction
+        """
+        cache = SessionCache(str(tmpdir), size=1, flush_interval=60)
+        a = os.path.join(str(tmpdir), 'a.cache')
+        b = os.path.join(str(tmpdir), 'b.cache')
+        cache.set(a, b'a')
+        cache.set(b, b'b')
+        assert os.path.exists(a)
+        assert cache.get(a) == b'a'
+        assert cache.counters['misses'] == 1
+
+    def test_stale(self, tmpdir):
+        """
+        Cache reloads sessions changed by another process
+        """
+        cache = SessionCache(str(tmpdir), flush_interval=0)
+        file = os.path.join(str(tmpdir), 'a.cache')
+        cache.set(file, b'old')
+        with open(file, 'wb') as f:
+            f.write(b'new')
+        os.utime(file, ns=(0, 0))
+        assert cache.get(file) == b'new'
+        assert cache.counters['stale'] == 1
+
+    def test_get_while_writing(self, tmpdir, monkeypatch):
+        """
+        Cache serves the written data to reads during a write
+        """
+        cache = SessionCache(str(tmpdir), flush_interval=60)
+        file = os.path.join(str(tmpdir), 'a.cache')
+        reads = []
+        safe_write = util.safe_write
+
+        def write(path, data):
+            safe_write(path, data)
+            reads.append(cache.get(file))
+
+        monkeypatch.setattr(util, 'safe_write', write)
+        cache.set(file, b'new')
+        cache.flush()
+        assert reads == [b'new']
+        assert cache.get(file) == b'new'
+        assert cache.counters['stale'] == 0
+
+    def test_sweep(self, tmpdir):
+        """
+        Cache removes expired session files
+        """
+        cache = SessionCache(str(tmpdir), flush_interval=0, timeout=60)
+        file = os.path.join(str(tmpdir), 'a.cache')
+        with open(file, 'wb') as f:
+            f.write(pickle.dumps({}))
+        os.utime(file, (0, 0))
+        cache.sweep()
+        assert not os.path.exists(file)
+
+
+class TestLRUFileNamespaceManager:
+    """
+    Beaker backend test class
+    """
+
+    def test_session(self, tmpdir):
+        """
+        Beaker session is saved and loaded via the backend
+        """
+        options = {
+            'data_dir': str(tmpdir),
+            'namespace_class': LRUFileNamespaceManager,
+            'flush_interval': '0',
+        }
+        session = Session({}, **options)
+        session['key'] = 'value'
+        session.save()
+        loaded = Session({}, id=session.id, **options)
+        assert loaded['key'] == 'value'
+        assert not loaded.is_new
+
+    def test_serializer(self, tmpdir):
+        """
+        Sessions are stored by the serializer, corrupt files load empty
+        """
+        options = {
+            'data_dir': str(tmpdir),
+            'namespace_class': LRUFileNamespaceManager,
+            'flush_interval': '0',
+            'serializer': 'json',
+        }
+        session = Session({}, **options)
+        session['key'] = 'value'
+        session.save()
+        file = session.namespace.file
+        with open(file, 'rb') as f:
+            data = util.JsonSerializer().loads(f.read())
+        assert 'session' in data
+        assert Session({}, id=session.id, **options)['key'] == 'value'
+        with open(file, 'wb') as f:
+            f.write(b'corrupt')
+        os.utime(file, ns=(0, 0))
+        loaded = Session({}, id=session.id, **options)
+        assert 'key' not in loaded
+
+
+class TestSessionFactory:
+    """
+    Session factory test class
+    """
+
+    def settings(self, tmpdir, touch_interval):
+        return {
+            'session.type': 'file',
+            'session.data_dir': str(tmpdir),
+            'session.touch_interval': touch_interval,
+        }
+
+    def request(self, session_id):
+        return DummyRequest(
+            environ={'HTTP_COOKIE': 'beaker.session.id=%s' % session_id})
+
+    def test_nested_change(self, tmpdir):
+        """
+        Changes of tracked nested session values are saved
+        """
+        Session = session_factory(self.settings(tmpdir, '300'))
+        session = Session(DummyRequest())
+        session['forms'] = {}
+        session.persist()
+        request = self.request(session.id)
+        session = Session(request)
+        request.session = session
+        track_session(request)
+        session['forms']['form'] = 'changed'
+        session.persist()
+        assert Session(self.request(session.id))['forms'] == {
+            'form': 'changed'}
+
+    def test_untracked_nested_change(self, tmpdir):
+        """
+        Changes of other nested session values are saved within the touch
+        interval
+        """
+        Session = session_factory(self.settings(tmpdir, '300'))
+        session = Session(DummyRequest())
+        session['wizard'] = {'steps': []}
+        session.persist()
+        request = self.request(session.id)
+        session = Session(request)
+        request.session = session
+        track_session(request)
+        session['wizard']['steps'].append('done')
+        writes = persist_counters['writes']
+        session.persist()
+        assert persist_counters['writes'] == writes + 1
+        assert Session(self.request(session.id))['wizard'] == {
+            'steps': ['done']}
+
+    def test_touch_throttled(self, tmpdir):
+        """
+        Unchanged sessions are not saved within the touch interval
+        """
+        Session = session_factory(self.settings(tmpdir, '300'))
+        session = Session(DummyRequest())
+        session['forms'] = {}
+        session.persist()
+        request = self.request(session.id)
+        session = Session(request)
+        request.session = session
+        track_session(request)
+        session['forms']
+        skipped = persist_counters['skipped']
+        session.persist()
+        assert persist_counters['skipped'] == skipped + 1
@@ -0,0 +1,90 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+"""
+Config Tests
+"""
+
+import pytest
+
+from ...models import WebUser
+from ...config import (
+    AnonymousIdentity,
+    Identity,
+    identity,
+    party,
+    roles,
+    user,
+    web_user
+)
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    lookups = []
+
+    def load_identity(cls, email):
+        lookups.append(email)
+        if email != 'user@test.test':
+            return None
+        return {
+            'web_user': 'web_user',
+            'party': 'party',
+            'user': None,
+            'roles': ['editor'],
+        }
+
+    monkeypatch.setattr(WebUser, 'load_identity', classmethod(load_identity))
+    return lookups
+
+
+class RequestMock():
+    """
+    mock request with the request methods of the identity
+    """
+
+    def __init__(self, userid, path='/'):
+        self.unauthenticated_userid = userid
+        self.path = path
+        self.identity = identity(self)
+
+
+class TestIdentity:
+    """
+    Identity test class
+    """
+
+    def test_single_lookup(self, lookups):
+        """
+        Web user, party, user and roles share one lookup
+        """
+        req = RequestMock('user@test.test')
+        assert isinstance(req.identity, Identity)
+        assert lookups == []
+        assert web_user(req) == 'web_user'
+        assert party(req) == 'party'
+        assert user(req) is None
+        assert roles(req) == ['editor']
+        assert bool(req.identity)
+        assert lookups == ['user@test.test']
+
+    def test_missing_user(self, lookups):
+        """
+        Unknown web users are looked up once and yield None
+        """
+        req = RequestMock('unknown@test.test')
+        assert web_user(req) is None
+        assert roles(req) is None
+        assert not req.identity
+        assert lookups == ['unknown@test.test']
+
+    def test_anonymous(self, lookups):
+        """
+        Requests of static files are excluded from the lookup
+        """
+        req = RequestMock('user@test.test', path='/static/style.css')
+        assert isinstance(req.identity, AnonymousIdentity)
+        assert web_user(req) is None
+        assert party(req) is None
+        assert not req.identity
+        assert lookups == []
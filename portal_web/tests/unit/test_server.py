@@ -0,0 +1,137 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+"""
+Server Tests
+"""
+
+import os
+import time
+import signal
+
+from ... import server
+from ...server import (
+    Arbiter,
+    Worker
+)
+
+
+def arbiter(app=None, workers=1, **kw):
+    options = {
+        'max_requests': 0,
+        'max_requests_jitter': 0,
+        'max_memory': 0,
+        'graceful_timeout': 1,
+    }
+    options.update(kw)
+    return Arbiter(app, host='127.0.0.1', port=0, workers=workers, backlog=1,
+                   adjustments={}, **options)
+
+
+class WorkerMock():
+    code = 0
+
+    def __init__(self, arbiter):
+        pass
+
+    def run(self):
+        if self.code:
+            raise Exception('failed')
+
+
+class TestArbiter:
+    """
+    Arbiter test class
+    """
+
+    def wait(self, master):
+        deadline = time.time() + 10
+        while master.workers and time.time() < deadline:
+            master.reap()
+            time.sleep(0.01)
+
+    def test_spawn_reap(self, monkeypatch):
+        """
+        Spawned workers exit with their own code and are reaped
+        """
+        monkeypatch.setattr(server, 'Worker', WorkerMock)
+        master = arbiter()
+        pid = os.getpid()
+        master.spawn()
+        assert os.getpid() == pid
+        assert len(master.workers) == 1
+        assert list(master.workers.values()) == [master.generation]
+        self.wait(master)
+        assert master.workers == {}
+
+    def test_spawn_failure(self, monkeypatch):
+        """
+        Failing workers exit with a status, the master keeps running
+        """
+        warnings = []
+        monkeypatch.setattr(WorkerMock, 'code', 1)
+        monkeypatch.setattr(server, 'Worker', WorkerMock)
+        monkeypatch.setattr(
+            server.log, 'warning', lambda message: warnings.append(message))
+        master = arbiter()
+        master.spawn()
+        self.wait(master)
+        assert master.workers == {}
+        assert len(warnings) == 1 and 'exited with status' in warnings[0]
+
+    def test_rolling_restart(self, monkeypatch):
+        """
+        Outdated workers are replaced one at a time
+        """
+        pids = iter(range(100, 200))
+        kills = []
+        master = arbiter(workers=2)
+        monkeypatch.setattr(
+            master, 'spawn', lambda: master.workers.__setitem__(
+                next(pids), master.generation))
+        monkeypatch.setattr(
+            os, 'kill', lambda pid, signum: kills.append(pid))
+        master.manage()
+        assert master.workers == {100: 0, 101: 0}
+        master.generation += 1
+        master.manage()
+        assert kills == [100]
+        assert master.workers == {100: None, 101: 0}
+        master.manage()
+        assert kills == [100]
+        del master.workers[100]
+        master.manage()
+        assert master.workers == {101: None, 102: 1}
+        del master.workers[101]
+        master.manage()
+        assert master.workers == {102: 1, 103: 1}
+        assert kills == [100, 101]
+
+
+class TestWorker:
+    """
+    Worker test class
+    """
+
+    def test_max_requests(self, monkeypatch):
+        """
+        Workers stop themselves after max_requests closed responses
+        """
+        kills = []
+        monkeypatch.setattr(
+            os, 'kill', lambda pid, signum: kills.append((pid, signum)))
+        worker = Worker(arbiter(
+            lambda environ, start_response: [b''], max_requests=2,
+            max_requests_jitter=3))
+        assert 2 <= worker.max_requests <= 5
+        for _ in range(worker.max_requests - 1):
+            worker.app({}, None).close()
+        assert kills == []
+        response = worker.app({}, None)
+        assert list(response) == [b'']
+        assert kills == []
+        response.close()
+        assert kills == [(os.getpid(), signal.SIGTERM)]
+        worker.app({}, None).close()
+        assert len(kills) == 1
+        assert worker.requests == worker.max_requests + 1
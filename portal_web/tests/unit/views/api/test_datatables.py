@@ -0,0 +1,81 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+"""
+Datatables API Tests
+"""
+
+from pyramid import testing
+
+from .....models import Tdb
+from .....views.api.datatables import (
+    DatatablesSchema,
+    DatatableSource
+)
+
+
+class ModelMock(Tdb):
+    __name__ = 'datatables.mock'
+    records = [
+        {'id': i, 'name': 'name%s' % i, 'party.': {'name': 'party%s' % i}}
+        for i in range(100)]
+    queries = []
+
+    @classmethod
+    def get(cls):
+        return cls
+
+    @classmethod
+    def search_count(cls, domain):
+        cls.queries.append(('count', domain))
+        return len(cls.records)
+
+    @classmethod
+    def search_read(cls, domain, offset, limit, order, fields_names):
+        cls.queries.append(('read', domain, order, fields_names))
+        return cls.records[offset:offset + limit]
+
+
+class SourceMock(DatatableSource):
+    model = ModelMock
+    columns = {'name': 'name', 'party': 'party.name'}
+    searchable = ('name',)
+
+
+class TestDatatableSource:
+    """
+    DatatableSource test class
+    """
+
+    def test_process(self):
+        """
+        Test paging, ordering, searching and projection
+        """
+        args = DatatablesSchema().deserialize({
+            'draw': 3, 'start': 10, 'length': 5,
+            'search': {'value': 'x', 'regex': False},
+            'order': [{'column': 1, 'dir': 'desc'}],
+            'columns': [{'data': 'name'}, {'data': 'party'}],
+        })
+        source = SourceMock(testing.DummyRequest())
+        result = source.process(args)
+        assert result['draw'] == 3
+        assert result['recordsTotal'] == 100
+        assert result['data'][0] == {'name': 'name10', 'party': 'party10'}
+        assert len(result['data']) == 5
+        read = ModelMock.queries[-1]
+        assert read[1] == [['OR', ('name', 'ilike', '%x%')]]
+        assert read[2] == [('party.name', 'DESC'), ('id', 'ASC')]
+        assert read[3] == ['name', 'party.name']
+
+    def test_count_cache(self):
+        """
+        Test counts are cached
+        """
+        args = DatatablesSchema().deserialize({'draw': 1})
+        source = SourceMock(testing.DummyRequest())
+        source.process(args)
+        queries = len(ModelMock.queries)
+        source.process(args)
+        assert ModelMock.queries[queries:] == [ModelMock.queries[-1]]
+        assert ModelMock.queries[-1][0] == 'read'
@@ -5,12 +5,34 @@
 Form Controller Tests
 """
 
+import io
+import os
+import pickle
+import hashlib
+
+import pytest
+import colander
+import deform
+from chameleon import PageTemplate
+from PIL import Image
+from pyramid import testing
+from pyramid.events import NewResponse
 from pyramid.httpexceptions import HTTPFound
+from pyramid.renderers import render
 
 from pyramid.testing import DummyResource, DummyRequest
 
+from .....config import add_form_renders
 from .....resources import ResourceBase
-from .....views.forms.base import FormController
+from .....views.forms.base import (
+    FormController,
+    FileTmpStore,
+    LazyRender,
+    TmpFile,
+    dedup_stats,
+    render_count,
+    UploadTooLarge
+)
 
 
 class FormControllerMock(FormController):
@@ -84,6 +106,30 @@ class TestFormController:
         assert res['_name'] == 'FormControllerMoo'
         assert res['persistent'] is True
 
+    def test_formcontroller_state_roundtrip(self):
+        """
+        Test the serialization of the state
+        """
+        rows = [{'code': str(i), 'name': 'row'} for i in range(500)]
+        my_form = FormControllerMock(appstruct={'rows': rows})
+        my_form.data.update({'rows': rows, 'other': {'foo': 'bar'}})
+        res = pickle.loads(pickle.dumps(my_form))
+        assert res.data['rows'] == rows
+        assert res.appstruct == {'rows': rows}
+        assert res.appstruct['rows'] is res.data['rows']
+
+    def test_formcontroller_state_unchanged(self):
+        """
+        Test the reuse of the serialized state of untouched values
+        """
+        my_form = FormControllerMock()
+        my_form.data.update({'a': [1] * 2000, 'b': 'b'})
+        state = my_form.__getstate__()
+        res = pickle.loads(pickle.dumps(my_form))
+        assert res.__getstate__()['_data'] == state['_data']
+        assert res.data['b'] == 'b'
+        assert res.data == {'a': [1] * 2000, 'b': 'b'}
+
     def test_validate(self):
         """
         Test validation success
@@ -327,3 +373,248 @@ class TestFormController:
         assert my_form._form is None
         assert my_form._data == {}
         assert my_form.validationfailure is None
+
+    def test_cached_form(self):
+        """
+        Test cached form prototypes are cloned with their oids
+        """
+        def factory(title):
+            schema = colander.Schema()
+            schema.add(colander.SchemaNode(
+                colander.String(), name='email', oid='login-email',
+                title=title))
+            return deform.Form(schema=schema)
+
+        request = DummyRequest()
+        request.registry.settings = {'env': 'testing'}
+        my_form = FormControllerMock(request=request)
+        form = my_form.cached_form(factory, title='Email')
+        clone = my_form.cached_form(factory, title='Email')
+        assert form is not clone
+        assert clone.children[0].oid == 'login-email'
+        assert clone.children[0].schema is form.children[0].schema
+        assert clone.children[0] is not form.children[0]
+        assert clone.children[0].parent is clone
+        clone.children[0].cstruct = 'changed'
+        assert form.children[0].cstruct is colander.null
+        assert 'changed' in clone.render()
+        assert 'changed' not in form.render()
+        other = my_form.cached_form(factory, title='Mail')
+        assert other.children[0].title == 'Mail'
+
+    def test_render_cache(self):
+        """
+        Test pristine forms are rendered once, if opted in
+        """
+        class CachedFormControllerMock(FormControllerMock):
+            __render_cache__ = True
+
+        class DeformFormMockCounting(DeformFormMockValidating):
+            error = None
+            children = []
+            renders = 0
+
+            def render(self, appstruct={}):
+                self.renders += 1
+                return "<form>%s</form>" % appstruct.get('foo', '')
+
+        request = DummyRequest()
+        request.registry.settings = {'env': 'testing'}
+        my_form = CachedFormControllerMock(request=request)
+        my_form.form = DeformFormMockCounting()
+        for _ in range(2):
+            my_form.render()
+            str(my_form.response[my_form.name])
+        assert my_form.form.renders == 1
+        my_form.render({'foo': 'bar'})
+        assert my_form.response[my_form.name] == '<form>bar</form>'
+        my_form.form.error = 'error'
+        my_form.render()
+        str(my_form.response[my_form.name])
+        assert my_form.form.renders == 3
+        my_form.form.error = None
+        request.registry.settings['pyramid.reload_templates'] = True
+        my_form.render()
+        str(my_form.response[my_form.name])
+        assert my_form.form.renders == 4
+
+    def test_render_json(self):
+        """
+        Test form responses are rendered as strings by the json renderer
+        """
+        config = testing.setUp()
+        try:
+            config.add_subscriber(
+                'portal_web.config.render_forms',
+                'pyramid.events.BeforeRender')
+            request = DummyRequest()
+            request.registry.settings = {'env': 'testing'}
+            my_form = FormControllerMock(request=request)
+            my_form.form = DeformFormMockValidating()
+            my_form.render()
+            body = render('json', my_form.response, request=request)
+        finally:
+            testing.tearDown()
+        assert body == '{"%s": "<form></form>"}' % my_form.name
+        assert render_count(request) == 1
+
+    def test_render_lazy(self):
+        """
+        Test only the accessed response is rendered
+        """
+        request = DummyRequest(post={'foo': 'bar'})
+        request.registry.settings = {'env': 'testing'}
+        my_form = FormControllerMock(request=request)
+        my_form.form = DeformFormMockValidating()
+        my_form.render()
+        my_form.validate()
+        assert render_count(request) == 0
+        assert my_form.response[my_form.name].__html__() == '<form></form>'
+        str(my_form.response[my_form.name])
+        assert render_count(request) == 1
+
+    def test_render_str(self):
+        """
+        Test lazy markup behaves like the rendered str
+        """
+        request = DummyRequest()
+        markup = LazyRender(lambda: '<form></form>', request)
+        assert markup
+        assert render_count(request) == 1
+        assert len(markup) == 13
+        assert '<form' in markup
+        assert markup + '!' == '<form></form>!'
+        assert '!' + markup == '!<form></form>'
+        assert markup.startswith('<form')
+        assert render_count(request) == 1
+        assert not LazyRender(lambda: '', request)
+
+    def test_render_template(self):
+        """
+        Test lazy markup is rendered once by templates
+        """
+        request = DummyRequest()
+        template = PageTemplate(
+            '<div tal:condition="form">${structure: form}</div>')
+        markup = LazyRender(lambda: '<form></form>', request)
+        assert template(form=markup) == '<div><form></form></div>'
+        assert render_count(request) == 1
+
+    def test_render_header(self):
+        """
+        Test the number of renders is added as response header
+        """
+        request = DummyRequest()
+        str(LazyRender(lambda: '<form></form>', request))
+        response = request.response
+        add_form_renders(NewResponse(request, response))
+        assert response.headers['X-Form-Renders'] == '1'
+
+
+class TestTmpFile:
+    """
+    TmpFile test class
+    """
+    content = b'%PDF-1.4\n' + b'x' * 100000
+
+    def test_copy(self, tmpdir):
+        """
+        Test spooling of an anonymous upload with digests and mimetype
+        """
+        tmpfile = TmpFile(
+            io.BytesIO(self.content), dir=str(tmpdir), delete=False,
+            digests=['sha256'])
+        assert tmpfile.read() == self.content
+        assert tmpfile.size == len(self.content)
+        assert tmpfile.digests == {
+            'sha256': hashlib.sha256(self.content).hexdigest()}
+        assert tmpfile.mimetype == 'application/pdf'
+
+    def test_link(self, tmpdir):
+        """
+        Test linking of a named upload
+        """
+        source = tmpdir.join('source')
+        source.write_binary(self.content)
+        with open(str(source), 'rb') as fp:
+            tmpfile = TmpFile(fp, dir=str(tmpdir), delete=False)
+        assert os.stat(tmpfile.name).st_ino == os.stat(str(source)).st_ino
+        assert tmpfile.size == len(self.content)
+        res = pickle.loads(pickle.dumps(tmpfile))
+        assert res.read() == self.content
+        assert res.mimetype == 'application/pdf'
+
+    def test_max_size(self, tmpdir):
+        """
+        Test rejection of uploads exceeding the maximum size
+        """
+        with pytest.raises(UploadTooLarge):
+            TmpFile(
+                io.BytesIO(self.content), dir=str(tmpdir), delete=False,
+                max_size=1000)
+        assert not tmpdir.listdir()
+
+
+class TestFileTmpStore:
+    """
+    FileTmpStore test class
+    """
+
+    def test_content_addressed(self, tmpdir):
+        """
+        Test deduplication of uploads in content addressed mode
+        """
+        class Source(io.BytesIO):
+            reads = 0
+
+            def read(self, *args):
+                data = super(Source, self).read(*args)
+                self.reads += len(data)
+                return data
+
+        tmpstore = FileTmpStore(
+            path=str(tmpdir.join('tmp')), blobs=str(tmpdir.join('blobs')))
+        content = b'content' * 1000
+        stats = dedup_stats()
+        for uid in ('a', 'b'):
+            source = Source(content)
+            tmpstore[uid] = {'fp': source}
+            assert source.reads == len(content)
+        counters = dedup_stats()
+        assert counters['uploads'] - stats['uploads'] == 2
+        assert counters['stored_bytes'] - stats['stored_bytes'] == \
+            len(content)
+        a, b = tmpstore['a']['fp'], tmpstore['b']['fp']
+        assert a.name != b.name
+        assert os.stat(a.name).st_ino == os.stat(b.name).st_ino
+        assert os.stat(a.name).st_nlink == 3
+        assert b.read() == content
+        assert tmpstore['b']['checksum'] == {
+            'code': hashlib.sha256(content).hexdigest(),
+            'algorithm': 'sha256',
+            'begin': 0,
+            'end': len(content),
+        }
+
+    def test_preview_url(self, tmpdir):
+        """
+        Test previews are addressed by the content digest of the upload
+        """
+        request = DummyRequest()
+        request.registry.settings = {
+            'env': 'testing', 'session.data_dir': str(tmpdir)}
+        testing.setUp(request=request, settings=request.registry.settings)
+        try:
+            tmpstore = FileTmpStore(path=str(tmpdir.join('tmp')))
+            buffer = io.BytesIO()
+            Image.new('RGB', (10, 10), 'red').save(buffer, 'PNG')
+            content = buffer.getvalue()
+            tmpstore['a'] = {'fp': io.BytesIO(content)}
+            digest = hashlib.sha256(content).hexdigest()
+            assert tmpstore.preview_url('a').endswith(
+                '/preview/%s/240' % digest)
+            assert tmpstore['a']['preview_key'] == digest
+            del tmpstore['a']['digests']
+            assert tmpstore.preview_url('a') is None
+        finally:
+            testing.tearDown()
@@ -0,0 +1,155 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+"""
+Datatable Sequence Tests
+"""
+
+import os
+import json
+import gzip
+from urllib.parse import unquote
+
+import colander
+import deform
+from pyramid import testing
+from pyramid.i18n import make_localizer
+
+from .....views.forms.datatables import (
+    DatatableSequence,
+    DatatableSequenceWidget
+)
+from .....views.forms.datatables.datatable_sequence import (
+    language,
+    source_path
+)
+
+
+def sequence_field(request, title, **kw):
+    class ItemSchema(colander.Schema):
+        name = colander.SchemaNode(colander.String(), title=title)
+
+    class Sequence(DatatableSequence):
+        item = ItemSchema()
+
+    class Schema(colander.Schema):
+        sequence = Sequence(
+            widget=DatatableSequenceWidget(request=request, **kw))
+
+    return deform.Form(Schema())['sequence']
+
+
+class TestDatatableSequenceWidget:
+    """
+    DatatableSequenceWidget test class
+    """
+
+    def test_prototype_cache(self):
+        """
+        Test prototypes are cached per item schema structure
+        """
+        request = testing.DummyRequest()
+        request.registry.settings = {'env': 'testing'}
+        field = sequence_field(request, 'Name')
+        proto = field.widget.prototype(field)
+        assert 'Name' in unquote(proto)
+        other = sequence_field(request, 'Name')
+        assert other.widget.prototype(other) is proto
+        changed = sequence_field(request, 'Title')
+        assert 'Title' in unquote(changed.widget.prototype(changed))
+        assert other.children[0]._fingerprint == \
+            field.children[0]._fingerprint
+        request.registry.settings['pyramid.reload_templates'] = 'true'
+        assert other.widget.prototype(other) is not proto
+
+    def test_client_rows(self):
+        """
+        Test client rows contain the field values instead of the markup
+        """
+        request = testing.DummyRequest()
+        request.registry.settings = {'env': 'testing'}
+        field = sequence_field(request, 'Name', client_rows=True)
+        cstruct = [{'name': 'a'}, {'name': 'b'}]
+        subfields = []
+        for item in cstruct:
+            subfield = field.children[0].clone()
+            subfield.cstruct = dict(item)
+            subfields.append((item, subfield))
+        rows = json.loads(
+            field.widget.rows(field, cstruct, {'subfields': subfields}))
+        assert [row['fields'] for row in rows] == cstruct
+        assert 'sequence' not in rows[0]
+
+    def test_client_rows_errors(self):
+        """
+        Test client rows with errors are rendered on the server
+        """
+        request = testing.DummyRequest()
+        request.registry.settings = {'env': 'testing'}
+        field = sequence_field(request, 'Name', client_rows=True)
+        cstruct = [{'name': 'a'}, {'name': ''}]
+        subfields = []
+        for item in cstruct:
+            subfield = field.children[0].clone()
+            subfield.cstruct = dict(item)
+            subfields.append((item, subfield))
+        invalid = subfields[1][1]
+        invalid.children[0].error = colander.Invalid(
+            invalid.children[0].schema, 'Required')
+        testing.setUp(request=request, settings=request.registry.settings)
+        try:
+            rows = json.loads(
+                field.widget.rows(field, cstruct, {'subfields': subfields}))
+        finally:
+            testing.tearDown()
+        assert 'sequence' not in rows[0] and rows[0]['errors'] == ''
+        assert 'fields' not in rows[1]
+        assert 'Required' in rows[1]['sequence']
+        assert 'Required' in rows[1]['errors']
+
+    def test_select_labels(self):
+        """
+        Test select values are substituted by their labels
+        """
+        request = testing.DummyRequest()
+        widget = DatatableSequenceWidget(request=request)
+        options = widget.options([
+            ('a', 'A'),
+            deform.widget.OptGroup('group', ('b', 'B'), ('c', 'C'))])
+        assert options == {'a': 'A', 'b': 'B', 'c': 'C'}
+
+    def test_language_cache(self):
+        """
+        Test the language json is cached per locale, domain and overrides
+        """
+        localizer = make_localizer('en', [])
+        payload = language(localizer)
+        assert language(make_localizer('en', [])) is payload
+        overridden = language(localizer, overrides={'custom': {'add': 'X'}})
+        assert json.loads(overridden)['custom']['add'] == 'X'
+        assert json.loads(overridden)['custom']['new'] == 'New'
+
+    def test_external_source(self, tmpdir):
+        """
+        Test source data is stored once and referenced by a version url
+        """
+        request = testing.DummyRequest()
+        request.registry.settings = {
+            'env': 'testing', 'session.data_dir': str(tmpdir)}
+        widget = DatatableSequenceWidget(request=request, source_public=True)
+        widget.source_data = [{'oid': 'a', 'name': 'A'}]
+        assert widget.source()['source_url'] == ''
+        widget.external_source = True
+        values = widget.source()
+        assert values['source'] == '[]'
+        version = values['source_url'].split('/')[-1]
+        path = source_path(request.registry.settings, 'public', version)
+        with gzip.open(path) as file:
+            assert json.loads(file.read())['data'] == widget.source_data
+        os.utime(path, (0, 0))
+        assert widget.source() == values
+        assert os.path.getmtime(path) > 0
+        os.unlink(path)
+        assert widget.source() == values
+        with gzip.open(path) as file:
+            assert json.loads(file.read())['data'] == widget.source_data
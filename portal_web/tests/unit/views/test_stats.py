@@ -0,0 +1,31 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+"""
+Stats View Tests
+"""
+
+import os
+
+from pyramid import testing
+
+from ....services.limiter import get_limiter
+from ....views.stats import StatsViews
+
+
+class TestStatsViews:
+    """
+    Stats view test class
+    """
+
+    def test_stats(self):
+        """
+        Test the statistics of the worker are reported
+        """
+        request = testing.DummyRequest()
+        limiter = get_limiter({'login.ip_limit': '5'}, 'login.ip')
+        stats = StatsViews(None, request).stats()
+        assert stats['pid'] == os.getpid()
+        assert stats['limiter']['login.ip'] == limiter.stats()
+        assert 'caches' in stats['sessions']
+        assert 'ratio' in stats['uploads']
@@ -0,0 +1,82 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+"""
+Upload View Tests
+"""
+
+import io
+
+from pyramid import testing
+
+from ....views.upload import UploadViews
+
+
+class TestUploadViews:
+    """
+    Chunked upload test class
+    """
+    content = b'0123456789' * 1000
+
+    def view(self, tmpdir, chunk=None, start=0, length=None, total=None,
+             **kw):
+        request = testing.DummyRequest(**kw)
+        request.session.id = 'session'
+        testing.setUp(request=request, settings={
+            'session.data_dir': str(tmpdir),
+            'session.file_expires': '0',
+        })
+        if chunk is not None:
+            request.body_file = io.BytesIO(chunk)
+            request.content_type = 'application/octet-stream'
+            request.headers['Content-Disposition'] = \
+                'attachment; filename="file.bin"'
+            request.headers['Content-Range'] = 'bytes %s-%s/%s' % (
+                start, start + (length or len(chunk)) - 1,
+                total or len(self.content))
+        return UploadViews(None, request)
+
+    def test_resume(self, tmpdir):
+        """
+        Test chunked upload with resume query
+        """
+        res = self.view(tmpdir, self.content[:4000]).upload()
+        assert res['files'][0]['size'] == 4000
+        res = self.view(tmpdir, params={'file': 'file.bin'}).status()
+        assert res['file']['size'] == 4000
+        view = self.view(tmpdir, self.content[4000:], start=4000)
+        res = view.upload()
+        uid = res['files'][0]['uid']
+        tmpstore = view.request.session['file_upload']
+        assert tmpstore[uid]['fp'].read() == self.content
+        assert tmpstore[uid]['size'] == len(self.content)
+        res = self.view(tmpdir, params={'file': 'file.bin'}).status()
+        assert res == {}
+        testing.tearDown()
+
+    def test_missing_chunk(self, tmpdir):
+        """
+        Test rejection of a chunk after a gap
+        """
+        view = self.view(tmpdir, self.content[4000:], start=4000)
+        res = view.upload()
+        assert view.request.response.status_int == 416
+        assert res['files'][0]['size'] == 0
+        testing.tearDown()
+
+    def test_range_mismatch(self, tmpdir):
+        """
+        Test rejection of chunks not matching their Content-Range
+        """
+        view = self.view(tmpdir, self.content[:4000], length=3000)
+        res = view.upload()
+        assert view.request.response.status_int == 416
+        assert res['files'][0]['size'] == 0
+        res = self.view(tmpdir, params={'file': 'file.bin'}).status()
+        assert res['file']['size'] == 0
+        view = self.view(tmpdir, self.content[:4000], total=3000)
+        res = view.upload()
+        assert view.request.response.status_int == 416
+        view = self.view(tmpdir, self.content[:4000])
+        assert view.upload()['files'][0]['size'] == 4000
+        testing.tearDown()
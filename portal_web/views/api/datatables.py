@@ -0,0 +1,299 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+"""
+Server-side processing of the source tables of DatatableSequenceWidgets.
+
+DataTables posts the paging (`start`, `length`), ordering (`order`) and
+filtering (`search`, `columns[i].search`) parameters as json. A
+`DatatableSource` maps them onto a domain query of a Tryton model with
+limit and offset, reads only the fields of the columns and caches the
+record counts for a short time, so the time per request depends on the page
+size, not on the size of the table.
+
+Example service of a plugin (module scanned by `includes.api_views`)::
+
+    from pyramid.security import NO_PERMISSION_REQUIRED
+    from portal_web.views.api.datatables import (
+        DatatableSource,
+        datatables_service
+    )
+    from ...models import Artist
+
+    class ArtistSource(DatatableSource):
+        model = Artist
+        columns = {
+            'oid': 'oid',
+            'name': 'name',
+            'code': 'code',
+            'party': 'party.name',
+        }
+        searchable = ('name', 'code')
+
+        def domain(self):
+            return [('claim_state', '!=', 'unclaimed')]
+
+    artist = datatables_service(
+        ArtistSource, name='datatables-artist',
+        path='/datatables/artist', permission=NO_PERMISSION_REQUIRED)
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+import colander
+from cornice import Service
+from cornice.validators import colander_body_validator
+
+log = logging.getLogger(__name__)
+
+counts = OrderedDict()
+counts_lock = threading.Lock()
+counts_size = 1024
+
+
+# --- Schemas -----------------------------------------------------------------
+
+class SearchSchema(colander.MappingSchema):
+    value = colander.SchemaNode(colander.String(), missing='')
+    regex = colander.SchemaNode(colander.Boolean(), missing=False)
+
+
+class OrderSchema(colander.MappingSchema):
+    column = colander.SchemaNode(colander.Int())
+    dir = colander.SchemaNode(
+        colander.String(), validator=colander.OneOf(['asc', 'desc']),
+        missing='asc')
+
+
+class OrderSequence(colander.SequenceSchema):
+    order = OrderSchema()
+
+
+class ColumnSchema(colander.MappingSchema):
+    data = colander.SchemaNode(colander.String(), missing='')
+    name = colander.SchemaNode(colander.String(), missing='')
+    searchable = colander.SchemaNode(colander.Boolean(), missing=True)
+    orderable = colander.SchemaNode(colander.Boolean(), missing=True)
+    search = SearchSchema(missing={'value': '', 'regex': False})
+
+
+class ColumnSequence(colander.SequenceSchema):
+    column = ColumnSchema()
+
+
+class DatatablesSchema(colander.MappingSchema):
+    """
+    Parameters of a DataTables server-side processing request.
+    """
+    draw = colander.SchemaNode(colander.Int(), missing=0)
+    start = colander.SchemaNode(
+        colander.Int(), validator=colander.Range(min=0), missing=0)
+    length = colander.SchemaNode(colander.Int(), missing=10)
+    search = SearchSchema(missing={'value': '', 'regex': False})
+    order = OrderSequence(missing=[])
+    columns = ColumnSequence(missing=[])
+
+
+# --- Sources -----------------------------------------------------------------
+
+class DatatableSource(object):
+    """
+    Server-side processing of DataTables requests for a Tryton model.
+
+    Subclasses configure the model wrapper and the columns and may restrict
+    the records by overriding `domain`.
+
+    Attributes:
+        model (Tdb): Model wrapper of the records.
+        columns (dict): Tryton field names (dotted for relations) by
+            DataTables column data name.
+        searchable (tuple): Field names matched by the search values
+            (default: all char and text fields of the model in the columns).
+        max_length (int): Maximum number of rows per page.
+        count_timeout (int): Seconds to cache the record counts (0: off).
+
+    Args:
+        request (pyramid.request.Request): Current request.
+    """
+    model = None
+    columns = {}
+    searchable = ()
+    max_length = 100
+    count_timeout = 30
+
+    def __init__(self, request):
+        self.request = request
+
+    def domain(self):
+        """
+        Gets the domain of all records available to the request.
+
+        Returns:
+            list: Tryton domain.
+        """
+        return []
+
+    def search_fields(self):
+        """
+        Gets the field names matched by the search values.
+
+        Returns:
+            tuple: Field names.
+        """
+        if self.searchable:
+            return tuple(self.searchable)
+        fields = self.model.get()._fields
+        return tuple(
+            field for field in self.columns.values()
+            if field in fields and fields[field]._type in ('char', 'text'))
+
+    def search(self, args):
+        """
+        Gets the domain of the global and the column search values.
+
+        Args:
+            args (dict): Validated request parameters.
+
+        Returns:
+            list: Tryton domain.
+        """
+        domain = []
+        fields = self.search_fields()
+        value = args['search']['value'].strip()
+        if value and fields:
+            domain.append(['OR'] + [
+                (field, 'ilike', self.model.escape(value, wrap=True))
+                for field in fields])
+        for column in args['columns']:
+            value = column['search']['value'].strip()
+            field = self.columns.get(column['data'])
+            if value and field in fields and column['searchable']:
+                domain.append(
+                    (field, 'ilike', self.model.escape(value, wrap=True)))
+        return domain
+
+    def order(self, args):
+        """
+        Gets the order of the records.
+
+        The id is appended as last criterion for a stable paging.
+
+        Args:
+            args (dict): Validated request parameters.
+
+        Returns:
+            list: Tryton order [(field, 'ASC'|'DESC'), ...].
+        """
+        order = []
+        for criterion in args['order']:
+            if criterion['column'] >= len(args['columns']):
+                continue
+            column = args['columns'][criterion['column']]
+            field = self.columns.get(column['data'])
+            if field and column['orderable']:
+                order.append((field, criterion['dir'].upper()))
+        order.append(('id', 'ASC'))
+        return order
+
+    def count(self, domain):
+        """
+        Counts the records of a domain, cached for `count_timeout` seconds.
+
+        Args:
+            domain (list): Tryton domain.
+
+        Returns:
+            int: Number of records.
+        """
+        key = (self.model.__name__, repr(domain))
+        now = time.monotonic()
+        cached = counts.get(key)
+        if cached and now - cached[1] < self.count_timeout:
+            return cached[0]
+        count = self.model.get().search_count(domain)
+        if self.count_timeout:
+            with counts_lock:
+                counts[key] = (count, now)
+                counts.move_to_end(key)
+                if len(counts) > counts_size:
+                    counts.popitem(last=False)
+        return count
+
+    def row(self, values):
+        """
+        Maps the values of a record to a DataTables row.
+
+        Args:
+            values (dict): Values of the record read by search_read.
+
+        Returns:
+            dict: Row by column data name.
+        """
+        row = {}
+        for column, field in self.columns.items():
+            value = values
+            *relations, name = field.split('.')
+            for relation in relations:
+                value = value.get(relation + '.') or {}
+            row[column] = value.get(name)
+        return row
+
+    def process(self, args):
+        """
+        Processes a DataTables request.
+
+        Args:
+            args (dict): Validated request parameters.
+
+        Returns:
+            dict: DataTables response {'draw', 'recordsTotal',
+                'recordsFiltered', 'data'}.
+        """
+        domain = self.domain()
+        search = self.search(args)
+        total = self.count(domain)
+        filtered = self.count(domain + search) if search else total
+        length = args['length']
+        if length < 0 or length > self.max_length:
+            length = self.max_length
+        records = []
+        if filtered and args['start'] < filtered:
+            records = self.model.get().search_read(
+                domain + search, offset=args['start'], limit=length,
+                order=self.order(args),
+                fields_names=sorted(set(self.columns.values())))
+        return {
+            'draw': args['draw'],
+            'recordsTotal': total,
+            'recordsFiltered': filtered,
+            'data': [self.row(values) for values in records],
+        }
+
+
+def datatables_service(source, name, path, **kwargs):
+    """
+    Creates a cornice service for a DataTables source.
+
+    The service has to be created on module level of a scanned module.
+
+    Args:
+        source (DatatableSource): Source class.
+        name (str): Name of the service.
+        path (str): Path of the service.
+        **kwargs: Keyword arguments for the cornice service (e.g. permission,
+            factory, cors_policy).
+
+    Returns:
+        cornice.Service: Service.
+    """
+    service = Service(name=name, path=path, depth=2, **kwargs)
+
+    @service.post(schema=DatatablesSchema(),
+                  validators=(colander_body_validator,))
+    def post(request):
+        return source(request).process(request.validated)
+
+    return service
@@ -10,6 +10,7 @@ from pyramid.httpexceptions import (
 )
 
 from ..resources import ResourceBase
+from ..services.session import track_session
 
 
 log = logging.getLogger(__name__)
@@ -30,6 +31,8 @@ class ViewBase:
         self.request = request
         self.context = context
         self.response = {}
+        # detect changes of the forms in the session to avoid needless writes
+        track_session(request)
         self.cleanup_forms()
 
     def process_forms(self, data={}):
@@ -0,0 +1,136 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+import os
+import re
+import gzip
+import hashlib
+import logging
+
+from pyramid.httpexceptions import HTTPNotFound
+from pyramid.i18n import make_localizer
+from pyramid.interfaces import ITranslationDirectories
+from pyramid.response import (
+    FileResponse,
+    Response
+)
+from pyramid.security import NO_PERMISSION_REQUIRED
+from pyramid.view import (
+    view_config,
+    view_defaults
+)
+
+from .forms.datatables.datatable_sequence import (
+    language,
+    source_path
+)
+
+log = logging.getLogger(__name__)
+
+LOCALE = re.compile(r'^[a-z]{2}(_[A-Z]{2})?$')
+DOMAIN = re.compile(r'^[a-z_]+$')
+VERSION = re.compile(r'^[0-9a-f]{32}$')
+
+localizers = {}
+
+
+def get_localizer(registry, locale):
+    """
+    Gets a localizer for the default locale or a locale with translations,
+    created once.
+
+    Args:
+        registry (pyramid.registry.Registry): Application registry.
+        locale (str): Locale name.
+
+    Returns:
+        pyramid.i18n.Localizer: Localizer.
+        None: If there are no translations for the locale.
+    """
+    if locale not in localizers:
+        directories = registry.queryUtility(
+            ITranslationDirectories, default=[])
+        default = registry.settings.get('pyramid.default_locale_name', 'en')
+        if locale != default and not any(
+                os.path.isdir(os.path.join(directory, locale))
+                for directory in directories):
+            return None
+        localizers[locale] = make_localizer(locale, directories)
+    return localizers[locale]
+
+
+@view_defaults(
+    context='..resources.ResourceBase',
+    name='datatables_language',
+    permission=NO_PERMISSION_REQUIRED)
+class DatatablesViews():
+    """
+    Views for the DataTables language settings and source data.
+
+    The url `datatables_language/<locale>[/<domain>]` serves the translated
+    language settings as a cacheable json resource, e.g. for the DataTables
+    option `language.url`.
+
+    The url `datatables_source/<version>` serves the source data stored by a
+    DatatableSequenceWidget. The files are immutable, as the version is the
+    hash of the content.
+    """
+
+    def __init__(self, context, request):
+        self.context = context
+        self.request = request
+
+    @view_config()
+    def language(self):
+        subpath = self.request.subpath
+        if not 1 <= len(subpath) <= 2:
+            raise HTTPNotFound()
+        locale = subpath[0]
+        domain = subpath[1] if len(subpath) > 1 else 'portal_web'
+        if not LOCALE.match(locale) or not DOMAIN.match(domain):
+            raise HTTPNotFound()
+        localizer = get_localizer(self.request.registry, locale)
+        if localizer is None:
+            raise HTTPNotFound()
+        payload = language(localizer, domain)
+        response = Response(
+            payload, content_type='application/json', charset='utf-8',
+            conditional_response=True)
+        response.etag = hashlib.sha1(payload.encode('utf-8')).hexdigest()
+        response.cache_control = 'public, max-age=86400'
+        return response
+
+    @view_config(name='datatables_source')
+    def source(self):
+        subpath = self.request.subpath
+        if len(subpath) != 1 or not VERSION.match(subpath[0]):
+            raise HTTPNotFound()
+        version = subpath[0]
+        settings = self.request.registry.settings
+        scope = 'public'
+        path = source_path(settings, scope, version)
+        session_id = getattr(self.request.session, 'id', None)
+        if session_id:
+            private = source_path(settings, session_id, version)
+            if os.path.isfile(private):
+                path, scope = private, 'private'
+        if not os.path.isfile(path):
+            raise HTTPNotFound()
+        accept = self.request.accept_encoding
+        if 'Accept-Encoding' in self.request.headers and \
+                accept.acceptable_offers(['gzip']):
+            response = FileResponse(
+                path, request=self.request, content_type='application/json')
+            response.content_encoding = 'gzip'
+        else:
+            with gzip.open(path, 'rb') as file:
+                response = Response(
+                    file.read(), content_type='application/json',
+                    conditional_response=True)
+            response.last_modified = os.path.getmtime(path)
+        response.charset = 'utf-8'
+        response.etag = version
+        response.vary = ('Accept-Encoding',)
+        response.cache_control = (
+            '%s, max-age=31536000, immutable' % scope)
+        return response
@@ -14,6 +14,9 @@ from psycopg2 import (
 )
 
 from ..services import benchmarks
+from ..services.session import stats as session_stats
+from ..services.limiter import stats as limiter_stats
+from .forms.base import dedup_stats
 from ..models import Tdb
 from ..views import ViewBase
 
@@ -105,3 +108,21 @@ class DebugViews(ViewBase):
     def benchmark(self):
         delete = ('delete' in self.request.POST or self.request.GET)
         return benchmarks(delete)
+
+    @view_config(
+        name='sessions',
+        renderer='json')
+    def sessions(self):
+        return session_stats()
+
+    @view_config(
+        name='uploads',
+        renderer='json')
+    def uploads(self):
+        return dedup_stats()
+
+    @view_config(
+        name='limiter',
+        renderer='json')
+    def limiter(self):
+        return limiter_stats()
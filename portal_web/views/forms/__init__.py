@@ -9,6 +9,7 @@ import deform
 
 from .base import (
     FormController,
+    file_tmpstore,
     deferred_file_upload_widget
 )
 from .login_web_user import LoginWebuser
@@ -2,36 +2,313 @@
 # Repository: https://github.com/C3S/portal_web
 
 import os
-import shutil
-import glob
+import zlib
+import hashlib
+import pickle
 import tempfile
 # from tempfile import NamedTemporaryFile
-import time
+import threading
+import weakref
+from collections import OrderedDict
 
 from abc import ABCMeta, abstractmethod
 import logging
 
 from pyramid.httpexceptions import HTTPFound
+from pyramid.settings import asbool
+from pyramid.threadlocal import get_current_request
 import colander
 import deform
+import magic
 
 from ...resources import ResourceBase
-from ...services import benchmark
+from ...services import (
+    _,
+    benchmark
+)
+from ...services.janitor import (
+    create,
+    get_janitor
+)
+from ...services.preview import (
+    get_previewer,
+    preview_sizes
+)
 
 log = logging.getLogger(__name__)
 
+form_prototypes = {}
+form_prototypes_lock = threading.Lock()
+render_cache = OrderedDict()
+render_cache_lock = threading.Lock()
+render_cache_size = 256
+RENDERS = 'portal_web.forms.renders'
+
+
+def clone_form(prototype):
+    """
+    Clones a form, retaining the oids of the prototype.
+
+    `deform.Field.clone` assigns new default oids to the clones, which would
+    break custom oids referenced by templates and scripts, and builds the
+    subfields of each field from the schema before it replaces them with
+    clones, which is slower than building the form. The fields are copied
+    instead, sharing the schema, widgets and attribute values with the
+    prototype like `deform.Field.clone` does.
+
+    Args:
+        prototype (deform.Form): Pristine form.
+
+    Returns:
+        deform.Form: Clone of the form.
+    """
+    form = prototype.__class__.__new__(prototype.__class__)
+    form.__dict__.update(prototype.__dict__)
+    form._parent = None
+    fields = [(form, prototype)]
+    while fields:
+        clone, field = fields.pop()
+        clone.children = []
+        for child in field.children:
+            cloned = child.__class__.__new__(child.__class__)
+            cloned.__dict__.update(child.__dict__)
+            cloned._parent = weakref.ref(clone)
+            clone.children.append(cloned)
+            fields.append((cloned, child))
+    return form
+
+
+class StateBlob(bytes):
+    """
+    Serialized value of a form state, deserialized on first access.
+
+    The first byte marks the encoding: b'p' for a plain pickle, b'z' for a
+    zlib compressed pickle.
+    """
+
+    @classmethod
+    def dump(cls, value, level=6, threshold=1024):
+        """
+        Serializes a value.
+
+        Args:
+            value (obj): Picklable value.
+            level (int): Compression level of zlib (0: no compression).
+            threshold (int): Minimum size of the pickle to be compressed.
+
+        Returns:
+            StateBlob: Serialized value.
+        """
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if level and len(data) >= threshold:
+            return cls(b'z' + zlib.compress(data, level))
+        return cls(b'p' + data)
+
+    def load(self):
+        """
+        Deserializes the value.
+
+        Returns:
+            obj: Value.
+        """
+        data = memoryview(self)[1:]
+        if self[:1] == b'z':
+            data = zlib.decompress(data)
+        return pickle.loads(data)
+
+
+class LazyState(dict):
+    """
+    Dictionary of form state values, deserialized on first access.
+
+    Values, which were not accessed since the state was loaded, keep their
+    serialized blob and are stored again without being serialized.
+    """
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if isinstance(value, StateBlob):
+            value = value.load()
+            dict.__setitem__(self, key, value)
+        return value
+
+    def __iter__(self):
+        # also disables the fast copy of the raw values by dict(), update()
+        return iter(self.keys())
+
+    def __eq__(self, other):
+        return dict(self.items()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def pop(self, key, *default):
+        value = dict.pop(self, key, *default)
+        if isinstance(value, StateBlob):
+            value = value.load()
+        return value
+
+    def popitem(self):
+        key = next(reversed(self.keys()))
+        return key, self.pop(key)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            dict.__setitem__(self, key, default)
+        return self[key]
+
+    def copy(self):
+        return dict(self.items())
+
+
+def dump_state(data, level=6, threshold=1024):
+    """
+    Serializes the values of a state dictionary separately.
+
+    Args:
+        data (dict): State dictionary, may contain StateBlobs.
+        level (int): Compression level of zlib (0: no compression).
+        threshold (int): Minimum size of a pickle to be compressed.
+
+    Returns:
+        dict: Serialized values (bytes) by key.
+    """
+    return {
+        key: bytes(value) if isinstance(value, StateBlob)
+        else bytes(StateBlob.dump(value, level, threshold))
+        for key, value in dict.items(data)
+    }
+
+
+def load_state(blobs):
+    """
+    Wraps the serialized values of a state dictionary for lazy loading.
+
+    Args:
+        blobs (dict): Serialized values (bytes) by key.
+
+    Returns:
+        LazyState: State dictionary.
+    """
+    return LazyState(
+        (key, StateBlob(value)) for key, value in blobs.items())
+
+
+def render_count(request):
+    """
+    Gets the number of forms rendered in a request.
+
+    Args:
+        request (pyramid.request.Request): Current request.
+
+    Returns:
+        int: Number of renders.
+    """
+    return request.environ.get(RENDERS, 0)
+
+
+class LazyRender(object):
+    """
+    Markup of a form, rendered on first access by the template.
+
+    Responses of views with other renderers (e.g. json) are converted to
+    str by the `config.render_forms` subscriber. Otherwise it behaves like
+    the rendered str: truth tests, `len`, `in`, concatenation and str
+    methods render the form first.
+
+    Args:
+        render (callable): Function returning the markup.
+        request (pyramid.request.Request): Current request.
+    """
+
+    def __init__(self, render, request=None):
+        self._render = render
+        self._request = request
+        self._html = None
+
+    def __html__(self):
+        if self._html is None:
+            self._html = self._render()
+            if self._request is not None:
+                environ = self._request.environ
+                environ[RENDERS] = environ.get(RENDERS, 0) + 1
+                log.debug("form render %s in request" % environ[RENDERS])
+        return self._html
+
+    def __str__(self):
+        return str(self.__html__())
+
+    def __bool__(self):
+        return bool(str(self))
+
+    def __len__(self):
+        return len(str(self))
+
+    def __contains__(self, item):
+        return item in str(self)
+
+    def __add__(self, other):
+        return str(self) + other
+
+    def __radd__(self, other):
+        return other + str(self)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(str(self), name)
+
+    def __eq__(self, other):
+        return str(self) == other
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __repr__(self):
+        return '<LazyRender rendered=%s>' % (self._html is not None)
+
 
 class FormController(object, metaclass=ABCMeta):
     """
     Abstract class for form handling
+
+    The state stored in the session is versioned (`__state_version__`). The
+    values of `data` and the `appstruct` are serialized separately and
+    deserialized on first access, so values of stages which are not touched
+    by a request are neither deserialized nor serialized again. Values of
+    the appstruct which are also contained in `data` are stored once.
+    Serialized values larger than `__state_threshold__` bytes are compressed
+    with zlib level `__state_compression__` (0: no compression).
+
+    The responses are rendered lazily, when the template accesses them, so
+    only the last response of a request is rendered. Controllers rendering
+    the same markup for all users may opt in to cache the rendered pristine
+    forms (`__render_cache__`).
     """
     __stage__ = None
+    __render_cache__ = False
+    __state_version__ = 2
+    __state_compression__ = 6
+    __state_threshold__ = 1024
 
     def __init__(self, name=None, stage=None, persistent=False, appstruct=None,
                  context=None, request=None, response=None):
         self._name = name or self.__class__.__name__
         self._form = None
         self._data = {}  # aggregates several appstructs, dep. on form design
+        self._appstruct_state = None
         self.persistent = persistent  # store in session?
         self.stage = stage or self.__stage__
         self.appstruct = appstruct or {}
@@ -42,25 +319,70 @@ class FormController(object, metaclass=ABCMeta):
 
     def __getstate__(self):
         return {
+            '__version__': self.__state_version__,
             '__stage__': self.__stage__,
             '_name': self._name,
-            '_data': self._data,
+            '_data': dump_state(
+                self._data, self.__state_compression__,
+                self.__state_threshold__),
             'persistent': self.persistent,
             'stage': self.stage,
-            'appstruct': self.appstruct
+            'appstruct': self._dump_appstruct()
         }
 
     def __setstate__(self, state):
         self.__stage__ = state['__stage__']
         self._name = state['_name']
         self._form = None
-        self._data = state['_data']
         self.persistent = state['persistent']
         self.stage = state['stage']
-        self.appstruct = state['appstruct']
         self.context = None
         self.request = None
         self.response = {}
+        if state.get('__version__') != self.__state_version__:
+            # unversioned state of former releases
+            self._data = state['_data']
+            self.appstruct = state['appstruct']
+            return
+        self._data = load_state(state['_data'])
+        self._appstruct = None
+        self._appstruct_state = state['appstruct']
+
+    def _dump_appstruct(self):
+        if self._appstruct_state is not None:
+            # not accessed since loaded
+            return self._appstruct_state
+        appstruct = self._appstruct
+        refs = []
+        if isinstance(appstruct, dict) and appstruct:
+            # values shared with data are stored once
+            refs = [
+                key for key, value in appstruct.items()
+                if key in self._data
+                and dict.__getitem__(self._data, key) is value]
+            appstruct = {
+                key: value for key, value in appstruct.items()
+                if key not in refs}
+        return {
+            'refs': refs,
+            'blob': bytes(StateBlob.dump(
+                appstruct, self.__state_compression__,
+                self.__state_threshold__))
+        }
+
+    @property
+    def appstruct(self):
+        if self._appstruct_state is not None:
+            state, self._appstruct_state = self._appstruct_state, None
+            self._appstruct = StateBlob(state['blob']).load()
+            for key in state['refs']:
+                self._appstruct[key] = self._data[key]
+        return self._appstruct
+
+    @appstruct.setter
+    def appstruct(self, appstruct):
+        self._appstruct_state = None
+        self._appstruct = appstruct
 
     @property
     def name(self):
@@ -84,12 +406,84 @@ class FormController(object, metaclass=ABCMeta):
         """
         return self._data
 
+    def cached_form(self, factory, **bind):
+        """
+        Gets a clone of a cached pristine form.
+
+        The prototypes are cached per worker keyed by the factory, the locale
+        and the keyword arguments, so the schema and the widgets are only
+        built once. The form must not hold request dependent state, which is
+        shared by all clones (e.g. a request bound schema or widget).
+
+        Args:
+            factory (callable): Function returning a deform.Form.
+            **bind: Hashable keyword arguments for the factory.
+
+        Returns:
+            deform.Form: Clone of the form.
+        """
+        key = (factory, getattr(self.request, 'locale_name', None),
+               frozenset(bind.items()))
+        with benchmark(self.request, name='forms.render',
+                       uid=self.name + ':build', scale=1000):
+            prototype = form_prototypes.get(key)
+            if prototype is None:
+                with form_prototypes_lock:
+                    prototype = form_prototypes.get(key)
+                    if prototype is None:
+                        prototype = factory(**bind)
+                        form_prototypes[key] = prototype
+            return clone_form(prototype)
+
+    def render_key(self, form, appstruct):
+        """
+        Gets the key of the rendered form in the render cache.
+
+        Forms with errors, with a csrf token and forms rendered while the
+        templates are reloaded are not cached.
+
+        Args:
+            form (deform.Form): Form to render.
+            appstruct (dict): Appstruct to render.
+
+        Returns:
+            tuple: Key of the rendered form.
+            None: If the rendered form must not be cached.
+        """
+        if not self.__render_cache__ or form.error is not None:
+            return None
+        settings = self.request.registry.settings or {}
+        if asbool(settings.get('pyramid.reload_templates')):
+            return None
+        if any(field.name == 'csrf_token' for field in form.children):
+            return None
+        try:
+            fingerprint = hashlib.sha1(pickle.dumps(
+                appstruct, protocol=pickle.HIGHEST_PROTOCOL)).hexdigest()
+        except Exception:
+            return None
+        return (self.__class__, self.name, self.stage, form.formid,
+                getattr(self.request, 'locale_name', None), fingerprint)
+
     def render(self, appstruct={}, form=None):
         if form is None:
             form = self.form
+        self.response = {self.name: LazyRender(
+            lambda: self._render(form, appstruct), self.request)}
+
+    def _render(self, form, appstruct):
         with benchmark(self.request, name='forms.render', uid=self.name,
                        scale=1000):
-            self.response = {self.name: form.render(appstruct=appstruct)}
+            key = self.render_key(form, appstruct)
+            html = render_cache.get(key) if key else None
+            if html is None:
+                html = form.render(appstruct=appstruct)
+                if key:
+                    with render_cache_lock:
+                        render_cache[key] = html
+                        if len(render_cache) > render_cache_size:
+                            render_cache.popitem(last=False)
+            return html
 
     def process(self, context, request):
         self.context = context
@@ -150,11 +544,13 @@ class FormController(object, metaclass=ABCMeta):
             if data:
                 _data += self.data.items()
             self.appstruct = self.form.validate(_data)
-            self.response = {self.name: self.form.render()}
+            self.response = {self.name: LazyRender(
+                self.form.render, self.request)}
             return True
         except deform.ValidationFailure as e:
             self.validationfailure = e
-            self.response = {self.name: self.validationfailure.render()}
+            self.response = {self.name: LazyRender(
+                self.validationfailure.render, self.request)}
         return False
 
     def clean(self):
@@ -181,25 +577,170 @@ class MemoryTmpStore(dict):
         return None
 
 
+class UploadTooLarge(Exception):
+    """
+    Raised, if an upload exceeds the maximum size.
+    """
+
+
+def spool(source, target=None, digests=(), max_size=0, chunk_size=65536,
+          sniff_size=2048):
+    """
+    Reads a file in chunks, computes its digests, size and mimetype.
+
+    Without a target and digests, only the head of the file is read.
+
+    Args:
+        source (file): File to read (binary).
+        target (file): File to write the chunks to (optional).
+        digests (list): Names of the hashlib algorithms to compute.
+        max_size (int): Maximum size of the file in bytes (0: unlimited).
+        chunk_size (int): Size of the chunks in bytes.
+        sniff_size (int): Number of bytes to sniff the mimetype from.
+
+    Returns:
+        tuple: Size (int), hex digests by algorithm name (dict) and mimetype
+            (str or None, if unknown).
+
+    Raises:
+        UploadTooLarge: If the source exceeds max_size.
+    """
+    hashes = {name: hashlib.new(name) for name in digests}
+    size = 0
+    head = b''
+    if target is None and not hashes:
+        head = source.read(sniff_size)
+        size = os.fstat(source.fileno()).st_size
+        if max_size and size > max_size:
+            raise UploadTooLarge(source.name)
+    while target is not None or hashes:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        size += len(chunk)
+        if max_size and size > max_size:
+            raise UploadTooLarge(getattr(source, 'name', None))
+        if len(head) < sniff_size:
+            head += chunk[:sniff_size - len(head)]
+        for digest in hashes.values():
+            digest.update(chunk)
+        if target is not None:
+            target.write(chunk)
+    if target is not None:
+        target.flush()
+    mimetype = None
+    if head:
+        try:
+            mimetype = magic.from_buffer(head, mime=True)
+        except Exception:
+            log.debug("mimetype could not be sniffed")
+    return size, {
+        name: digest.hexdigest() for name, digest in hashes.items()}, mimetype
+
+
 class TmpFile(object):
+    """
+    Temporary file of an upload.
+
+    The source is hard linked to the temporary file, if it is a named file
+    on the same filesystem, otherwise it is copied in chunks. The digests
+    and the mimetype (python-magic) are computed in the same pass.
 
-    def __init__(self, source, *args, **kwargs):
+    Args:
+        source (file): Uploaded file.
+        digests (list): Names of the hashlib algorithms to compute.
+        max_size (int): Maximum size of the file in bytes (0: unlimited).
+        *args: Arguments for tempfile.NamedTemporaryFile.
+        **kwargs: Keyword arguments for tempfile.NamedTemporaryFile.
+
+    Attributes:
+        size (int): Size of the file in bytes.
+        digests (dict): Hex digests by algorithm name.
+        mimetype (str): Mimetype sniffed from the content, None if unknown.
+
+    Raises:
+        UploadTooLarge: If the source exceeds max_size.
+    """
+    chunk_size = 64 * 1024
+    sniff_size = 2048
+
+    def __init__(self, source, *args, digests=(), max_size=0, **kwargs):
         self.file = tempfile.NamedTemporaryFile(*args, **kwargs)
-        shutil.copyfileobj(source, self)
+        self.size = 0
+        self.digests = {}
+        self.mimetype = None
+        try:
+            if self.link(source, max_size, kwargs.get('delete', True)):
+                self.spool(self.file, digests, max_size, write=False)
+            else:
+                self.spool(source, digests, max_size)
+        except UploadTooLarge:
+            self.close()
+            self.delete()
+            raise
+        self.file.seek(0)
+
+    def link(self, source, max_size, delete):
+        """
+        Replaces the temporary file by a hard link to the source.
+
+        Returns:
+            bool: True, if the source was linked, False otherwise.
+        """
+        if delete:
+            # the link would be deleted by the source on close
+            return False
+        try:
+            path = source.name
+            if not isinstance(path, str) or not os.path.isfile(path) or \
+                    'b' not in getattr(source, 'mode', 'b') or source.tell():
+                return False
+            if max_size and os.path.getsize(path) > max_size:
+                raise UploadTooLarge(path)
+            name = self.file.name
+            os.link(path, name + '.link')
+        except (AttributeError, OSError, ValueError):
+            return False
+        os.replace(name + '.link', name)
+        self.file.close()
+        self.file = open(name, 'r+b')
+        return True
+
+    def spool(self, source, digests, max_size, write=True):
+        """
+        Reads the source in chunks, computes the digests and the mimetype.
+        """
+        self.size, self.digests, self.mimetype = spool(
+            source, self.file if write else None, digests, max_size,
+            self.chunk_size, self.sniff_size)
 
     def __getstate__(self):
         try:
-            return self.name
+            name = self.name
         except:  # noqa: E722
-            pass
-        return None
+            return None
+        return {
+            'name': name,
+            'size': self.size,
+            'digests': self.digests,
+            'mimetype': self.mimetype,
+        }
 
-    def __setstate__(self, name):
+    def __setstate__(self, state):
+        # state of former releases: name only
+        if not isinstance(state, dict):
+            state = {'name': state}
+        name = state.get('name')
+        self.size = state.get('size')
+        self.digests = state.get('digests', {})
+        self.mimetype = state.get('mimetype')
         self.file = None
         if name and os.path.isfile(name):
-            self.file = open(name, 'r')
+            self.file = open(name, 'rb')
 
     def __getattr__(self, attr):
+        if attr == 'file':
+            raise AttributeError(attr)
         return getattr(self.file, attr)
 
     def __iter__(self):
@@ -211,44 +752,289 @@ class TmpFile(object):
             os.unlink(file)
 
 
+dedup_counters = dict.fromkeys(
+    ['uploads', 'upload_bytes', 'stored', 'stored_bytes'], 0)
+dedup_lock = threading.Lock()
+
+
+def dedup_count(size, stored=False):
+    """
+    Counts an upload of a content addressed tmpstore.
+
+    Args:
+        size (int): Size of the upload in bytes.
+        stored (bool): The content was stored as new blob.
+    """
+    with dedup_lock:
+        dedup_counters['uploads'] += 1
+        dedup_counters['upload_bytes'] += size
+        if stored:
+            dedup_counters['stored'] += 1
+            dedup_counters['stored_bytes'] += size
+
+
+def dedup_stats():
+    """
+    Gets the deduplication statistics of the content addressed tmpstores.
+
+    Returns:
+        dict: Counters of the uploads and the stored blobs of the process,
+            ratio of uploaded to stored bytes.
+    """
+    with dedup_lock:
+        counters = dict(dedup_counters)
+    counters['ratio'] = counters['stored_bytes'] and (
+        counters['upload_bytes'] / counters['stored_bytes'])
+    return counters
+
+
 class FileTmpStore(dict):
+    """
+    Deform tmpstore saving the uploaded files to temporary files.
 
-    def __init__(self, path=None, timeout=0):
+    The files of a session are saved in the subdirectory `subdirectory` of
+    `path`. Files expire `timeout` seconds after their last modification and
+    are removed by a background janitor (0: never). The `digests` of the
+    files are computed while saving, files larger than `max_size` bytes are
+    rejected (0: unlimited). Thumbnails of images are generated in the
+    background and served by the preview view.
+
+    In content addressed mode (`blobs` is the directory of the blobs), each
+    content is stored once as blob under its digest, the files of the
+    sessions are hard links to the blobs. The number of links is the
+    reference count of a blob, unreferenced blobs are removed on expiry.
+    """
+
+    def __init__(self, path=None, timeout=0, subdirectory=None, digests=(),
+                 max_size=0, blobs=None):
         self.path = path
         self.timeout = timeout
+        self.subdirectory = subdirectory
+        self.digests = digests
+        self.max_size = max_size
+        self.blobs = blobs
         self.files = {}
-        self.clear_tmpfiles()
 
-    def clear_tmpfiles(self):
+    @property
+    def directory(self):
+        # stores of former releases saved all files in path
+        subdirectory = getattr(self, 'subdirectory', None)
+        if subdirectory:
+            return os.path.join(self.path, subdirectory)
+        return self.path
+
+    @property
+    def janitor(self):
         if not self.timeout:
-            return
-        path = os.path.join(self.path, 'tmp*')
-        for tmpfile in glob.glob(path):
-            created = os.stat(tmpfile).st_mtime
-            now = time.time()
-            if created < now - self.timeout:
-                os.unlink(tmpfile)
+            return None
+        return get_janitor(self.path, self.timeout)
 
     def __setitem__(self, name, cstruct):
-        tmpfile = TmpFile(source=cstruct['fp'], dir=self.path, delete=False)
+        directory = self.directory
+        # stores of former releases lack the upload settings
+        if getattr(self, 'blobs', None):
+            tmpfile = self.store(cstruct['fp'], directory)
+            algorithm = self.algorithm
+            cstruct['checksum'] = {
+                'code': tmpfile.digests[algorithm],
+                'algorithm': algorithm,
+                'begin': 0,
+                'end': tmpfile.size,
+            }
+        else:
+            # the digest of the algorithm addresses the previews
+            digests = list(getattr(self, 'digests', ()))
+            if self.algorithm not in digests:
+                digests.append(self.algorithm)
+            tmpfile = create(directory, lambda: TmpFile(
+                source=cstruct['fp'], dir=directory, delete=False,
+                digests=digests, max_size=getattr(self, 'max_size', 0)))
         cstruct['fp'].close()
         cstruct['fp'] = tmpfile
+        cstruct['size'] = tmpfile.size
+        cstruct['digests'] = tmpfile.digests
+        cstruct['sniffed_mimetype'] = tmpfile.mimetype
+        if self.janitor:
+            self.janitor.register(tmpfile.name)
         super(FileTmpStore, self).__setitem__(name, cstruct)
 
+    # --- Content addressed mode ----------------------------------------------
+
+    @property
+    def algorithm(self):
+        """
+        Algorithm of the digests addressing the blobs.
+        """
+        digests = getattr(self, 'digests', ())
+        return digests[0] if digests else 'sha256'
+
+    def blob(self, code):
+        """
+        Gets the path of the blob of a content.
+
+        Args:
+            code (str): Hex digest of the content.
+
+        Returns:
+            str: Path of the blob.
+        """
+        return os.path.join(self.blobs, self.algorithm, code[:2], code)
+
+    def store(self, source, directory):
+        """
+        Stores a file as link to the blob of its content.
+
+        The digests are computed while the source is spooled into the
+        directory. If the content is known, the spooled file is replaced by
+        a link to the existing blob, otherwise it becomes the blob.
+
+        Args:
+            source (file): Uploaded file.
+            directory (str): Directory of the link.
+
+        Returns:
+            TmpFile: Link to the blob.
+        """
+        digests = list(self.digests) or [self.algorithm]
+        tmpfile = create(directory, lambda: TmpFile(
+            source=source, dir=directory, delete=False, digests=digests,
+            max_size=self.max_size))
+        blob = self.blob(tmpfile.digests[self.algorithm])
+        try:
+            create(os.path.dirname(blob), lambda: os.link(tmpfile.name, blob))
+        except FileExistsError:
+            # known content: use the blob
+            linked = self.link_blob(blob, directory)
+            if linked:
+                linked.digests = tmpfile.digests
+                linked.mimetype = tmpfile.mimetype
+                tmpfile.close()
+                tmpfile.delete()
+                return linked
+            dedup_count(tmpfile.size)
+            return tmpfile
+        dedup_count(tmpfile.size, stored=True)
+        if self.timeout:
+            get_janitor(self.blobs, self.timeout, linked=True).register(blob)
+        return tmpfile
+
+    def link_blob(self, blob, directory):
+        """
+        Links an existing blob into a directory.
+
+        Args:
+            blob (str): Path of the blob.
+            directory (str): Directory of the link.
+
+        Returns:
+            TmpFile: Link to the blob.
+            None: If the blob does not exist.
+        """
+        try:
+            # extends the lifetime of the blob and its links
+            os.utime(blob)
+            with open(blob, 'rb') as source:
+                tmpfile = create(directory, lambda: TmpFile(
+                    source=source, dir=directory, delete=False))
+        except OSError:
+            return None
+        dedup_count(tmpfile.size)
+        return tmpfile
+
     def preview_url(self, name):
-        return None
+        """
+        Schedules a thumbnail of an uploaded image and gets its url.
 
+        Args:
+            name (str): Uid of the upload.
 
-@colander.deferred
-def deferred_file_upload_widget(node, kw):
-    request = kw.get('request')
+        Returns:
+            str: Url of the thumbnail, addressed by the content digest.
+            None: If the upload is not an image or has no digest.
+        """
+        request = get_current_request()
+        cstruct = self.get(name)
+        if request is None or not cstruct or not cstruct.get('fp'):
+            return None
+        mimetype = cstruct.get('sniffed_mimetype') or \
+            cstruct.get('mimetype') or ''
+        if not mimetype.startswith('image/'):
+            return None
+        key = (cstruct.get('digests') or {}).get(self.algorithm)
+        if not key:
+            return None
+        source = cstruct['fp'].name
+        cstruct['preview_key'] = key
+        settings = request.registry.settings
+        size = preview_sizes(settings)[0]
+        get_previewer(settings).schedule(source, key, size)
+        return request.resource_path(request.root, 'preview', key, str(size))
+
+
+class SpooledFileUploadWidget(deform.widget.FileUploadWidget):
+    """
+    File upload widget rejecting uploads larger than the maximum size.
+
+    Spooling the upload into the tmpstore is benchmarked per MB
+    (`benchmark.upload.spool`).
+    """
+
+    def __init__(self, tmpstore, request=None, **kw):
+        super(SpooledFileUploadWidget, self).__init__(tmpstore, **kw)
+        self.request = request
+
+    def deserialize(self, field, pstruct):
+        upload = pstruct.get('upload') if isinstance(pstruct, dict) else None
+        source = getattr(upload, 'file', None)
+        try:
+            if source is None or self.request is None:
+                return super(SpooledFileUploadWidget, self).deserialize(
+                    field, pstruct)
+            with benchmark(self.request, name='upload.spool',
+                           uid=upload.filename, normalize=source,
+                           scale=1024 * 1024):
+                return super(SpooledFileUploadWidget, self).deserialize(
+                    field, pstruct)
+        except UploadTooLarge:
+            max_size = getattr(self.tmpstore, 'max_size', 0)
+            raise colander.Invalid(field.schema, _(
+                "File is too large (maximum: ${size} MB)",
+                mapping={'size': max_size // (1024 * 1024)}))
+
+
+def file_tmpstore(request):
+    """
+    Gets the FileTmpStore of the session, creates it if necessary.
+
+    Args:
+        request (pyramid.request.Request): Current request.
+
+    Returns:
+        FileTmpStore: Tmpstore for the file uploads of the session.
+    """
     session = request.session
-    basepath = request.registry.settings.get('session.data_dir', '/tmp')
+    settings = request.registry.settings
+    basepath = settings.get('session.data_dir', '/tmp')
     path = os.path.join(basepath, 'file_tmp_store')
-    timeout = int(request.registry.settings.get('session.file_expires', 0))
-    if not os.path.isdir(path):
-        os.makedirs(path)
+    timeout = int(settings.get('session.file_expires', 0))
     if 'file_upload' not in session:
-        session['file_upload'] = FileTmpStore(path=path, timeout=timeout)
-    widget = deform.widget.FileUploadWidget(session['file_upload'])
+        session['file_upload'] = FileTmpStore(
+            path=path, timeout=timeout, subdirectory=session.id,
+            digests=[
+                digest.strip() for digest
+                in settings.get('upload.digests', '').split(',')
+                if digest.strip()],
+            max_size=int(settings.get('upload.max_size', 0)) * 1024 * 1024,
+            blobs=os.path.join(basepath, 'file_tmp_store_blobs') if (
+                asbool(settings.get('upload.content_addressed'))) else None)
+    tmpstore = session['file_upload']
+    if tmpstore.janitor:
+        tmpstore.janitor.start()
+    return tmpstore
+
+
+@colander.deferred
+def deferred_file_upload_widget(node, kw):
+    request = kw.get('request')
+    widget = SpooledFileUploadWidget(file_tmpstore(request), request=request)
     return widget
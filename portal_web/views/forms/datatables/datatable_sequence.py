@@ -1,14 +1,248 @@
+import os
+import gzip
 import logging
+import hashlib
+import threading
 import deform
 import colander
 import json
+from collections import OrderedDict
+from collections.abc import Hashable
 
 from pyramid.renderers import get_renderer
+from pyramid.settings import asbool
+from translationstring import TranslationString
 
 from ....services import _, benchmark
+from ....services.janitor import (
+    create,
+    get_janitor
+)
 
 log = logging.getLogger(__name__)
 
+prototypes = OrderedDict()
+prototypes_lock = threading.Lock()
+prototypes_size = 512
+languages = OrderedDict()
+languages_lock = threading.Lock()
+languages_size = 64
+
+
+def dictmerge(source, destination):
+    """
+    Merges a source dict recursively into a destination dict.
+
+    Args:
+        source (dict): Source dict.
+        destination (dict): Destination dict, modified in place.
+
+    Returns:
+        dict: Destination dict.
+    """
+    for key, value in source.items():
+        if isinstance(value, dict):
+            # get node or create one
+            node = destination.setdefault(key, {})
+            dictmerge(value, node)
+        else:
+            destination[key] = value
+    return destination
+
+
+def language(localizer, domain='portal_web', overrides=None):
+    """
+    Gets the translated DataTables language settings as json.
+
+    The json is cached per locale, domain and overrides, as it is the same
+    for all widgets and requests with the same locale.
+
+    Args:
+        localizer (pyramid.i18n.Localizer): Localizer of the locale.
+        domain (str): Translation domain.
+        overrides (dict): Custom language settings merged into the defaults.
+
+    Returns:
+        str: Json encoded language settings.
+    """
+    key = (localizer.locale_name, domain, json.dumps(
+        overrides or {}, sort_keys=True, default=str))
+    payload = languages.get(key)
+    if payload is not None:
+        return payload
+    _ = localizer.translate
+    d = domain
+    langdict = {
+        # en (https://datatables.net/plug-ins/i18n/English)
+        "sEmptyTable": _("No data available in table", d),
+        "sInfo": _("Showing _START_ to _END_ of _TOTAL_ entries", d),
+        "sInfoEmpty": _("Showing 0 to 0 of 0 entries", d),
+        "sInfoFiltered": _("(filtered from _MAX_ total entries)", d),
+        "sInfoThousands": _(",", d),
+        "sLengthMenu": _("Show _MENU_ entries", d),
+        "sLoadingRecords": _("Loading...", d),
+        "sProcessing": _("Processing...", d),
+        "sSearch": _("Search:", d),
+        "sZeroRecords": _("No matching records found", d),
+        "oPaginate": {
+            "sFirst": _("First", d),
+            "sLast": _("Last", d),
+            "sNext": _("Next", d),
+            "sPrevious": _("Previous", d)
+        },
+        "oAria": {
+            "sSortAscending":  _(": activate to sort column ascending", d),
+            "sSortDescending": _(": activate to sort column descending", d)
+        },
+        # custom
+        "custom": {
+            "search": _("Search", d),
+            "new": _("New", d),
+            "edit": _("Edit", d),
+            "apply": _("Apply", d),
+            "remove": _("Remove", d),
+            "add": _("Add", d),
+            "create": _("Create", d),
+            "cancel": _("Cancel", d),
+        }
+    }
+    payload = json.dumps(dictmerge(overrides or {}, langdict))
+    with languages_lock:
+        languages[key] = payload
+        if len(languages) > languages_size:
+            languages.popitem(last=False)
+    return payload
+
+
+def source_path(settings, scope=None, version=None):
+    """
+    Gets the path of the stored source data.
+
+    Args:
+        settings (dict): Parsed .ini file settings.
+        scope (str): Session id or 'public'.
+        version (str): Version hash of the source data.
+
+    Returns:
+        str: Directory of all sources, of the scope or path of the file.
+    """
+    path = os.path.join(
+        settings.get('session.data_dir', '/tmp'), 'datatables_source')
+    if scope is not None:
+        path = os.path.join(path, scope)
+    if version is not None:
+        path = os.path.join(path, version + '.json.gz')
+    return path
+
+
+def store_source(request, data, total=False, public=False):
+    """
+    Stores the source data of a widget as gzipped json file.
+
+    The version is the hash of the json (and the session id for private
+    data), so unchanged source data is only written once and may be cached
+    by browsers and proxies forever. Stored files are touched on each use,
+    so the janitor only removes sources, which weren't rendered for the
+    expiry time.
+
+    Args:
+        request (pyramid.request.Request): Current request.
+        data (list): Source rows.
+        total (int): Total number of source records (False: unknown).
+        public (bool): Source data is the same for all users.
+
+    Returns:
+        str: Version hash of the source data.
+    """
+    settings = request.registry.settings
+    scope = 'public' if public else request.session.id
+    payload = json.dumps({'data': data, 'total': total}).encode('utf-8')
+    digest = hashlib.sha256(payload)
+    if not public:
+        digest.update(scope.encode('utf-8'))
+    version = digest.hexdigest()[:32]
+    path = source_path(settings, scope, version)
+    try:
+        # extends the lifetime of the rendered source
+        os.utime(path)
+        return version
+    except FileNotFoundError:
+        # not stored yet or removed by the janitor meanwhile
+        pass
+    tmp = '%s.%s.tmp' % (path, threading.get_ident())
+    with create(os.path.dirname(path), lambda: open(tmp, 'wb')) as file:
+        with gzip.GzipFile(fileobj=file, mode='wb', mtime=0) as archive:
+            archive.write(payload)
+    os.replace(tmp, path)
+    timeout = int(settings.get('session.file_expires', 0))
+    if timeout:
+        get_janitor(source_path(settings), timeout).register(path)
+    return version
+
+
+def configuration(value):
+    """
+    Gets a stable representation of a schema or widget attribute value.
+
+    Values which are not plain data (e.g. a request) are represented by
+    their type only, as their repr might contain a memory address.
+
+    Args:
+        value (obj): Attribute value.
+
+    Returns:
+        obj: Hashable representation of the value.
+    """
+    if isinstance(value, TranslationString):
+        return ('_', str(value), value.domain, value.default,
+                configuration(value.mapping))
+    if value is None or isinstance(value, (str, bytes, int, float, bool)):
+        return value
+    if value is colander.null or value is colander.required:
+        return repr(value)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(configuration(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted(
+            (str(key), configuration(item)) for key, item in value.items()))
+    return type(value).__module__ + '.' + type(value).__qualname__
+
+
+def fingerprint(field):
+    """
+    Gets a structural fingerprint of a field and its children.
+
+    The schemas of forms are usually instantiated per request, so the
+    fingerprint covers the classes, names, titles, defaults and widget
+    configurations of the fields instead of the identity of the instances.
+    The fingerprint is computed once per field and stored on it, so the
+    prototypes of nested sequences reuse the fingerprints of their items.
+
+    Args:
+        field (deform.Field): Field.
+
+    Returns:
+        str: Hex digest.
+    """
+    cached = field.__dict__.get('_fingerprint')
+    if cached is not None:
+        return cached
+    widget = field.widget
+    digest = hashlib.sha1(repr((
+        configuration(field.schema),
+        field.name,
+        configuration(field.title),
+        configuration(field.description),
+        field.required,
+        configuration(field.cstruct),
+        configuration(widget),
+        configuration(vars(widget)),
+    )).encode('utf-8'))
+    for child in field.children:
+        digest.update(fingerprint(child).encode('ascii'))
+    field._fingerprint = digest.hexdigest()
+    return field._fingerprint
+
 
 @colander.deferred
 def defered_datatable_sequence_validator(node, kw):
@@ -613,20 +847,37 @@ class DatatableSequenceWidget(deform.widget.SequenceWidget):
     category = 'structural'
     item_template = 'datatables/sequence_item'
     language_overrides = {}
-    prototypes = {}
     source_data = []
     source_data_total = False
+    external_source = False
+    source_public = False
+    client_rows = False
+
+    def prototype(self, field):
+        """
+        Gets the url quoted item template for new sequence items, cached.
 
-    def prototype(self, *args, **kwargs):
+        The cache is keyed by the widget class, the item template, the
+        locale and the structural fingerprint of the item field, so it is
+        shared by requests and threads, but not by differing schemas.
+        """
         with benchmark(self.request, name='datatables.prototype',
                        uid=self.template, scale=1000):
-            return super(
-                DatatableSequenceWidget, self).prototype(*args, **kwargs)
-            # TODO: fix caching:
-            # if self.item_template not in self.prototypes:
-            #     self.prototypes[self.item_template] = super(
-            #         DatatableSequenceWidget, self).prototype(*args, **kwargs)
-            # return self.prototypes[self.item_template]
+            request = getattr(self, 'request', None)
+            settings = request and request.registry.settings or {}
+            if asbool(settings.get('pyramid.reload_templates')):
+                return super(DatatableSequenceWidget, self).prototype(field)
+            key = (type(self), self.item_template,
+                   getattr(request, 'locale_name', None),
+                   fingerprint(field.children[0]))
+            proto = prototypes.get(key)
+            if proto is None:
+                proto = super(DatatableSequenceWidget, self).prototype(field)
+                with prototypes_lock:
+                    prototypes[key] = proto
+                    if len(prototypes) > prototypes_size:
+                        prototypes.popitem(last=False)
+            return proto
 
     def serialize(self, *args, **kwargs):
         """Serialize"""
@@ -643,25 +894,67 @@ class DatatableSequenceWidget(deform.widget.SequenceWidget):
                 DatatableSequenceWidget, self).deserialize(*args, **kwargs)
 
     def rows(self, field, cstruct, kw):
+        """
+        Gets the initial rows of the target table.
+
+        By default each row contains the rendered sequence item. If
+        `client_rows` is set, rows with scalar fields only contain the field
+        values (`fields`) instead, and the client instantiates the sequence
+        items from the prototype, so the template time doesn't grow with the
+        number of rows. Rows with nested mappings or sequences and rows with
+        errors (to render the error messages of the fields) are always
+        rendered on the server.
+
+        Args:
+            field (deform.Field): Sequence field.
+            cstruct (list): Cstruct of the sequence.
+            kw (dict): Template values.
+
+        Returns:
+            str: Json encoded list of rows.
+            None: If the sequence is empty.
+        """
         if not cstruct:
             return
         # prepare data
         data = []
+        item_field = field.children[0]
+        client = self.client_rows and not any(
+            item.children for item in item_field.children)
+        # select options by column, labels translated on first use
+        options = {
+            item.name: self.options(item.widget.values)
+            for item in item_field.children
+            if isinstance(item.widget, deform.widget.SelectWidget)}
+        labels = {name: {} for name in options}
+        names = [item.name for item in item_field.children]
         for subfield in [x[1] for x in kw['subfields']]:
             row = subfield.cstruct
-            for column in row:
+            fields = {}
+            for column, value in row.items():
                 # substitue colander null values
-                if row[column] == colander.null:
-                    row[column] = ""
-            for item in subfield:
+                if value is colander.null:
+                    value = row[column] = ""
+                fields[column] = value
                 # use select text instead of value
-                if isinstance(item.widget, deform.widget.SelectWidget):
-                    for option in item.widget.values:
-                        if option[0] == row[item.name]:
-                            row[item.name] = item.translate(option[1])
-            # provide rendered sequence
-            row['sequence'] = subfield.render_template(
-                self.item_template, parent=field)
+                if column in options and isinstance(value, Hashable) \
+                        and value in options[column]:
+                    label = labels[column].get(value)
+                    if label is None:
+                        label = labels[column][value] = \
+                            item_field[column].translate(
+                                options[column][value])
+                    row[column] = label
+            error = subfield.error or any(
+                child.error for child in subfield.children)
+            if client and not error:
+                # provide field values for the client side sequence
+                row['fields'] = {
+                    name: fields[name] for name in names if name in fields}
+            else:
+                # provide rendered sequence
+                row['sequence'] = subfield.render_template(
+                    self.item_template, parent=field)
             # provide errors
             row['errors'] = ""
             for child in subfield.children:
@@ -675,60 +968,67 @@ class DatatableSequenceWidget(deform.widget.SequenceWidget):
             data.append(row)
         return json.dumps(data)
 
+    def options(self, values):
+        """
+        Maps the values of select options to their labels.
+
+        Args:
+            values (list): Options of a select widget (value, label) or
+                deform.widget.OptGroup.
+
+        Returns:
+            dict: Labels by value.
+        """
+        options = {}
+        for option in values:
+            if isinstance(option, deform.widget.OptGroup):
+                options.update(self.options(option.options))
+                continue
+            options[option[0]] = option[1]
+        return options
+
     def dictmerge(self, source, destination):
         """
         merges source dict int destinatio dict
         """
-        for key, value in source.items():
-            if isinstance(value, dict):
-                # get node or create one
-                node = destination.setdefault(key, {})
-                self.dictmerge(value, node)
-            else:
-                destination[key] = value
-        return destination
+        return dictmerge(source, destination)
 
     def language(self):
-        _ = self.request.localizer.translate
-        d = getattr(self, 'domain', 'portal_web')
-        langdict = {
-            # en (https://datatables.net/plug-ins/i18n/English)
-            "sEmptyTable": _("No data available in table", d),
-            "sInfo": _("Showing _START_ to _END_ of _TOTAL_ entries", d),
-            "sInfoEmpty": _("Showing 0 to 0 of 0 entries", d),
-            "sInfoFiltered": _("(filtered from _MAX_ total entries)", d),
-            "sInfoThousands": _(",", d),
-            "sLengthMenu": _("Show _MENU_ entries", d),
-            "sLoadingRecords": _("Loading...", d),
-            "sProcessing": _("Processing...", d),
-            "sSearch": _("Search:", d),
-            "sZeroRecords": _("No matching records found", d),
-            "oPaginate": {
-                "sFirst": _("First", d),
-                "sLast": _("Last", d),
-                "sNext": _("Next", d),
-                "sPrevious": _("Previous", d)
-            },
-            "oAria": {
-                "sSortAscending":  _(": activate to sort column ascending", d),
-                "sSortDescending": _(": activate to sort column descending", d)
-            },
-            # custom
-            "custom": {
-                "search": _("Search", d),
-                "new": _("New", d),
-                "edit": _("Edit", d),
-                "apply": _("Apply", d),
-                "remove": _("Remove", d),
-                "add": _("Add", d),
-                "create": _("Create", d),
-                "cancel": _("Cancel", d),
-            }
+        return language(
+            self.request.localizer, getattr(self, 'domain', 'portal_web'),
+            getattr(self, 'language_overrides', None))
+
+    def source(self):
+        """
+        Gets the template values of the source data.
+
+        If `external_source` is set (for widgets with large source data),
+        non-empty source data is stored by `store_source` and referenced by
+        the url of the `datatables_source` view instead of being inlined
+        into the html of each render. The widget then loads the source data
+        asynchronously before its initialization.
+
+        Returns:
+            dict: Template values source, source_total and source_url.
+        """
+        values = {
+            'source': json.dumps(self.source_data),
+            'source_total': self.source_data_total,
+            'source_url': '',
         }
-        if hasattr(self, "language_overrides"):
-            return json.dumps(self.dictmerge(
-                self.language_overrides, langdict))
-        return json.dumps(langdict)
+        if not self.source_data or not self.external_source:
+            return values
+        with benchmark(self.request, name='datatables.source',
+                       uid=self.template, scale=1000):
+            version = store_source(
+                self.request, self.source_data, self.source_data_total,
+                public=self.source_public)
+        values.update({
+            'source': '[]',
+            'source_url': self.request.resource_path(
+                self.request.root, 'datatables_source', version),
+        })
+        return values
 
     def get_template_values(self, field, cstruct, kw):
         settings = self.request.registry.settings
@@ -744,8 +1044,6 @@ class DatatableSequenceWidget(deform.widget.SequenceWidget):
             'dumps': json.dumps,
             'api': api,
             'target': target_data,
-            'source': json.dumps(self.source_data),
-            'source_total': self.source_data_total,
             'language': self.language(),
             'sequence': get_renderer(
                 "portal_web:"
@@ -753,5 +1051,6 @@ class DatatableSequenceWidget(deform.widget.SequenceWidget):
             ).implementation(),
             '_': _
         })
+        kw.update(self.source())
         return super(DatatableSequenceWidget, self).get_template_values(
             field, cstruct, kw)
@@ -8,6 +8,10 @@ import logging
 
 from . import FormController
 from ...services import _
+from ...services.limiter import (
+    client_address,
+    get_limiter
+)
 from ...models import WebUser
 from ...resources import BackendResource
 
@@ -20,20 +24,50 @@ class LoginWebuser(FormController):
     """
     form controller for web_user login
     """
+    __render_cache__ = True
 
     def controller(self):
-        self.form = login_form()
+        self.form = self.cached_form(login_form)
         self.render()
-        if self.submitted() and self.validate():
-            self.login()
+        if self.submitted():
+            # reject bursts before any database or password hash work
+            if self.throttled():
+                self.reject()
+            elif self.validate():
+                self.login()
         return self.response
 
     # --- Stages --------------------------------------------------------------
 
     # --- Conditions ----------------------------------------------------------
 
+    def throttled(self):
+        """
+        Takes a token from the buckets of the ip address and the email.
+
+        Returns:
+            bool: True, if one of the limits is exceeded, False otherwise.
+        """
+        settings = self.request.registry.settings
+        email = self.request.POST.get('email', '').strip().lower()
+        allowed = get_limiter(settings, 'login.ip').allow(
+            client_address(self.request))
+        if email:
+            allowed = get_limiter(settings, 'login.email').allow(
+                email) and allowed
+        return not allowed
+
     # --- Actions -------------------------------------------------------------
 
+    def reject(self):
+        self.request.response.status_int = 429
+        self.form.error = colander.Invalid(
+            self.form.schema,
+            _("Too many login attempts, please try again later"))
+        self.render({'email': self.request.POST.get('email', '')})
+        log.info("web_user login throttled: %s" % client_address(
+            self.request))
+
     def login(self):
         self.redirect(
             BackendResource, '',
@@ -45,11 +79,13 @@ class LoginWebuser(FormController):
 # --- Validators --------------------------------------------------------------
 
 def authentication_is_successful(values):
-    if not WebUser.search_by_email(values['email']):
+    login = WebUser.load_for_login(values['email'], values['password'])
+    if not login:
+        log.info("web_user login failed: %s" % values['email'])
         return _('Login failed')
-    if not (WebUser.get_opt_in_state_by_email(values['email']) == 'opted-in'):
+    if not login['opt_in_state'] == 'opted-in':
         return _('User mail address not verified yet')
-    if WebUser.authenticate(values['email'], values['password']):
+    if login['valid']:
         return True
     log.info("web_user login failed: %s" % values['email'])
     return _('Login failed')
@@ -24,9 +24,10 @@ class RegisterWebuser(FormController):
     """
     form controller for web_user login
     """
+    __render_cache__ = True
 
     def controller(self):
-        self.form = register_form()
+        self.form = self.cached_form(register_form)
         self.render()
         if self.submitted() and self.validate():
             self.register()
@@ -85,7 +86,7 @@ class RegisterWebuser(FormController):
 # --- Validators --------------------------------------------------------------
 
 def email_is_unique(value):
-    if not WebUser.search_by_email(value):
+    if not WebUser.email_exists(value):
         return True
     return _('Email already registered')
 
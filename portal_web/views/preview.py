@@ -0,0 +1,81 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+import logging
+
+from pyramid.httpexceptions import HTTPNotFound
+from pyramid.response import (
+    FileResponse,
+    Response
+)
+from pyramid.security import NO_PERMISSION_REQUIRED
+from pyramid.view import (
+    view_config,
+    view_defaults
+)
+
+from ..services.preview import (
+    get_previewer,
+    placeholder,
+    preview_sizes
+)
+
+log = logging.getLogger(__name__)
+
+
+@view_defaults(
+    context='..resources.ResourceBase',
+    name='preview',
+    permission=NO_PERMISSION_REQUIRED)
+class PreviewViews():
+    """
+    Views for the thumbnails of uploaded images.
+
+    The url `preview/<key>/<size>` is content addressed, so the thumbnails
+    are served with long-lived cache headers. Only thumbnails of the uploads
+    of the current session are served. Until a thumbnail is generated, an
+    uncached placeholder is served.
+    """
+
+    def __init__(self, context, request):
+        self.context = context
+        self.request = request
+
+    def upload(self, key):
+        tmpstore = self.request.session.get('file_upload') or {}
+        for cstruct in tmpstore.values():
+            if cstruct.get('preview_key') == key:
+                return cstruct
+        return None
+
+    @view_config()
+    def preview(self):
+        settings = self.request.registry.settings
+        try:
+            key, size = self.request.subpath
+            size = int(size)
+        except ValueError:
+            raise HTTPNotFound()
+        if size not in preview_sizes(settings):
+            raise HTTPNotFound()
+        cstruct = self.upload(key)
+        if not cstruct or not cstruct.get('fp'):
+            raise HTTPNotFound()
+
+        # schedule again, if the cached thumbnail expired
+        previewer = get_previewer(settings)
+        previewer.schedule(cstruct['fp'].name, key, size)
+        thumbnail = previewer.get(key, size)
+        if not thumbnail:
+            response = Response(
+                body=placeholder(size), content_type='image/png')
+            response.headers['Cache-Control'] = 'no-store'
+            response.headers['Retry-After'] = '1'
+            return response
+
+        response = FileResponse(
+            thumbnail, request=self.request, content_type='image/png')
+        response.etag = '%s-%s' % (key, size)
+        response.headers['Cache-Control'] = \
+            'private, max-age=31536000, immutable'
+        return response
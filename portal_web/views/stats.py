@@ -0,0 +1,44 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+import os
+import logging
+
+from pyramid.view import (
+    view_config,
+    view_defaults
+)
+
+from ..services.limiter import stats as limiter_stats
+from ..services.session import stats as session_stats
+from .forms.base import dedup_stats
+
+log = logging.getLogger(__name__)
+
+
+@view_defaults(
+    context='..resources.BackendResource',
+    permission='administrator')
+class StatsViews():
+    """
+    Views for the operating statistics of the worker process.
+
+    Unlike the debug views, the statistics are available in all
+    environments, restricted to administrators. The counters are kept per
+    worker process, so the response reflects the worker serving it.
+    """
+
+    def __init__(self, context, request):
+        self.context = context
+        self.request = request
+
+    @view_config(
+        name='stats',
+        renderer='json')
+    def stats(self):
+        return {
+            'pid': os.getpid(),
+            'limiter': limiter_stats(),
+            'sessions': session_stats(),
+            'uploads': dedup_stats(),
+        }
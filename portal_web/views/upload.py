@@ -0,0 +1,236 @@
+# For copyright and license terms, see COPYRIGHT.rst (top level of repository)
+# Repository: https://github.com/C3S/portal_web
+
+"""
+Resumable chunked uploads for jQuery-File-Upload.
+
+The chunks of an upload are posted with a `Content-Range` header (option
+`maxChunkSize`) either as multipart form (`files[]`) or as raw body (option
+`multipart: false`, filename in the `Content-Disposition` header). They are
+appended to a spool file per session and filename. The size of the spooled
+part is queried with `GET upload?file=<filename>` to resume an upload (option
+`uploadedBytes`). The completed file is moved into the FileTmpStore of the
+session and referenced by its uid in the deform file upload widget.
+
+Example client configuration::
+
+    $('#fileupload').fileupload({
+        url: '/upload',
+        maxChunkSize: 10000000,
+        add: function (e, data) {
+            $.getJSON('/upload', {file: data.files[0].name}, function (r) {
+                data.uploadedBytes = r.file && r.file.size;
+                $.blueimp.fileupload.prototype.options.add.call(this, e, data);
+            });
+        }
+    });
+"""
+
+import os
+import re
+import hashlib
+import logging
+import secrets
+
+from pyramid.view import (
+    view_config,
+    view_defaults
+)
+from deform.widget import filedict
+
+from ..services import _
+from ..services.janitor import (
+    create,
+    get_janitor
+)
+from .forms.base import file_tmpstore
+
+log = logging.getLogger(__name__)
+
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+CONTENT_DISPOSITION_FILENAME = re.compile(r'filename="?([^";]+)"?')
+CHUNK_SIZE = 64 * 1024
+
+
+@view_defaults(
+    context='..resources.BackendResource',
+    name='upload',
+    permission='authenticated',
+    renderer='json')
+class UploadViews():
+    """
+    Views for resumable chunked uploads.
+
+    Note:
+        The views don't inherit from ViewBase, as the cleanup of the forms
+        would reset the form the upload belongs to.
+    """
+
+    def __init__(self, context, request):
+        self.context = context
+        self.request = request
+        settings = request.registry.settings
+        self.max_size = int(settings.get('upload.max_size', 0)) * 1024 * 1024
+        self.timeout = int(settings.get('session.file_expires', 0))
+        self.path = os.path.join(
+            settings.get('session.data_dir', '/tmp'), 'upload_spool')
+
+    def spool_file(self, filename):
+        """
+        Gets the path of the spool file of an upload.
+
+        Args:
+            filename (str): Client side name of the file.
+
+        Returns:
+            str: Path of the spool file.
+        """
+        key = hashlib.sha1(filename.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, self.request.session.id, key)
+
+    def error(self, filename, message, status=400, size=0):
+        self.request.response.status_int = status
+        return {'files': [{
+            'name': filename,
+            'size': size,
+            'error': self.request.localizer.translate(message)}]}
+
+    @view_config(request_method='GET')
+    def status(self):
+        """
+        Gets the size of the spooled part of an upload to resume it.
+
+        Returns:
+            dict: {'file': {'name': str, 'size': int}}, empty if unknown.
+        """
+        filename = self.request.GET.get('file')
+        if not filename:
+            return {}
+        try:
+            size = os.path.getsize(self.spool_file(filename))
+        except OSError:
+            return {}
+        return {'file': {'name': filename, 'size': size}}
+
+    @view_config(request_method='DELETE')
+    def abort(self):
+        """
+        Removes the spooled part of an upload.
+
+        Returns:
+            dict: {'files': [{'name': bool}]}
+        """
+        filename = self.request.GET.get('file', '')
+        try:
+            os.unlink(self.spool_file(filename))
+            removed = True
+        except OSError:
+            removed = False
+        return {'files': [{filename: removed}]}
+
+    @view_config(request_method='POST')
+    def upload(self):
+        """
+        Appends a chunk to the spool file and assembles the completed file.
+
+        Returns:
+            dict: {'files': [{'name': str, 'size': int}]}, additionally with
+                the 'uid' of the FileTmpStore entry, if completed, or with an
+                'error' message.
+        """
+        request = self.request
+
+        # source
+        field = None
+        for value in request.POST.values():
+            if hasattr(value, 'file'):
+                field = value
+                break
+        if field is not None:
+            source, filename = field.file, field.filename
+            mimetype = field.type
+        else:
+            source = request.body_file
+            match = CONTENT_DISPOSITION_FILENAME.search(
+                request.headers.get('Content-Disposition', ''))
+            filename = match and match.group(1)
+            mimetype = request.content_type
+        if not filename:
+            return self.error('', _("No file uploaded"))
+        filename = os.path.basename(filename.replace('\\', '/'))
+
+        # range
+        spool = self.spool_file(filename)
+        try:
+            spooled = os.path.getsize(spool)
+        except OSError:
+            spooled = 0
+        content_range = request.headers.get('Content-Range')
+        if content_range:
+            match = CONTENT_RANGE.match(content_range.strip())
+            if not match:
+                return self.error(filename, _("Invalid Content-Range"))
+            start, end, total = map(int, match.groups())
+            if end < start or end >= total:
+                return self.error(
+                    filename, _("Invalid Content-Range"), status=416,
+                    size=spooled)
+        else:
+            start, end, total = 0, None, None
+        if start > spooled:
+            # a chunk is missing, the client has to resume at spooled
+            return self.error(
+                filename, _("Upload incomplete"), status=416, size=spooled)
+        if self.max_size and total and total > self.max_size:
+            return self.error(filename, _("File is too large"), status=413)
+
+        # append chunk
+        with create(os.path.dirname(spool), lambda: open(
+                spool, 'r+b' if os.path.exists(spool) else 'wb')) as f:
+            # repeated chunks overwrite the spooled part
+            f.seek(start)
+            f.truncate()
+            size = start
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if self.max_size and size > self.max_size:
+                    f.close()
+                    os.unlink(spool)
+                    return self.error(
+                        filename, _("File is too large"), status=413)
+                f.write(chunk)
+            if end is not None and size != end + 1:
+                # the chunk doesn't match its range, discard it
+                f.seek(start)
+                f.truncate()
+                return self.error(
+                    filename, _("Upload incomplete"), status=416, size=start)
+        if self.timeout and not start:
+            get_janitor(self.path, self.timeout).register(spool)
+        if total is not None and size < total:
+            return {'files': [{'name': filename, 'size': size}]}
+
+        # assemble
+        tmpstore = file_tmpstore(request)
+        uid = secrets.token_hex(5)
+        while uid in tmpstore:
+            uid = secrets.token_hex(5)
+        data = filedict(
+            fp=open(spool, 'rb'), filename=filename, mimetype=mimetype,
+            size=size, uid=uid)
+        tmpstore[uid] = data
+        tmpstore[uid]['preview_url'] = tmpstore.preview_url(uid)
+        os.unlink(spool)
+        # nested change of the session
+        request.session.changed()
+        log.debug("upload %s assembled as %s" % (filename, uid))
+        return {'files': [{
+            'name': filename,
+            'size': size,
+            'uid': uid,
+            'mimetype': data.get('sniffed_mimetype') or mimetype,
+            'thumbnailUrl': data.get('preview_url'),
+        }]}
@@ -85,5 +85,9 @@ setup(
     entry_points="""\
     [paste.app_factory]
     main = %s:main
-    """ % (MODULE),
+    [paste.server_runner]
+    prefork = %s.server:prefork_server_runner
+    [beaker.backends]
+    lrufile = %s.services.session:LRUFileNamespaceManager
+    """ % (MODULE, MODULE, MODULE),
 )